@@ -1,28 +1,112 @@
 import logging
 import numpy as np
-from typing import List, Dict, Any, Optional, Tuple
+from typing import List, Dict, Any, Optional, Sequence, Set, Tuple
 from dataclasses import dataclass
-from sentence_transformers import SentenceTransformer, CrossEncoder
-from rank_bm25 import BM25Okapi
+import os
 import re
+import threading
+import time
+from contextlib import contextmanager
+from bm25_index import BM25Index
+from dense_index import DenseIndex, load_dense_index, make_dense_index, measure_recall
+from document_store import DocumentStore
+from embedding_store import EmbeddingStore, content_hash, dot_blocks
+from financial_lexicon import FinancialLexicon, LexiconSpan
+from fusion import FUSION_STRATEGIES, ScoreStats, candidate_ranks, fuse_scores, top_candidates
+from instrumentation import TracedResults, Tracer
+from metadata_index import MetadataIndex, explicit_metadata, extract_metadata
+from model_registry import CROSS_ENCODER, ENCODER, get_model
+from near_duplicates import NearDuplicateIndex
+from rerank_cache import RerankScoreCache, rerank_cache_key
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-@dataclass
 class RetrievalResult:
-    doc_id: str
-    score: float
-    text: str
-    metadata: Dict[str, Any]
+    """
+    One retrieved document. A slotted record that is cheap to create for every fusion candidate:
+    text is decoded from the document store (store, row) on first access and the metadata dict
+    (dense_score, sparse_score) is only built when read.
+    duplicate_ids holds the ids of the near-duplicates folded into this document at index time
+    (see HybridRetriever dedup_threshold and expand_duplicates()).
+    """
+    __slots__ = ("doc_id", "score", "dense_score", "sparse_score", "duplicate_ids", "_text", "_metadata", "_store",
+                 "_row")
+
+    def __init__(self, doc_id: str, score: float, text: Optional[str] = None,
+                 metadata: Optional[Dict[str, Any]] = None, store: Optional[DocumentStore] = None, row: int = -1,
+                 dense_score: Optional[float] = None, sparse_score: Optional[float] = None,
+                 duplicate_ids: Tuple[str, ...] = ()):
+        self.doc_id = doc_id
+        self.score = score
+        self.dense_score = dense_score
+        self.sparse_score = sparse_score
+        self.duplicate_ids = duplicate_ids
+        self._text = text
+        self._metadata = metadata
+        self._store = store
+        self._row = row
+
+    @property
+    def text(self) -> str:
+        if self._text is None and self._store is not None:
+            self._text = self._store[self._row]
+        return self._text
+
+    @text.setter
+    def text(self, value: str):
+        self._text = value
+
+    @property
+    def metadata(self) -> Dict[str, Any]:
+        if self._metadata is None:
+            self._metadata = {"dense_score": self.dense_score, "sparse_score": self.sparse_score}
+        return self._metadata
+
+    @metadata.setter
+    def metadata(self, value: Dict[str, Any]):
+        self._metadata = value
+
+    def __eq__(self, other) -> bool:
+        if not isinstance(other, RetrievalResult):
+            return NotImplemented
+        return (self.doc_id, self.score, self.text, self.metadata) == \
+            (other.doc_id, other.score, other.text, other.metadata)
+
+    def __repr__(self) -> str:
+        return f"RetrievalResult(doc_id={self.doc_id!r}, score={self.score!r}, text={self.text!r}, " \
+               f"metadata={self.metadata!r})"
+
+def expand_duplicates(results: List[RetrievalResult]) -> List[RetrievalResult]:
+    """
+    One result per source document: each result is followed by a copy (same score, the representative's text)
+    for every near-duplicate folded into it.
+    """
+    expanded = []
+    for result in results:
+        expanded.append(result)
+        for doc_id in result.duplicate_ids:
+            expanded.append(RetrievalResult(doc_id, result.score, text=result._text, store=result._store,
+                                            row=result._row, dense_score=result.dense_score,
+                                            sparse_score=result.sparse_score))
+    return expanded
 
 class QueryProcessor:
     """
     Handles Query Expansion and Span/Keyword Extraction (2nd Place Strategy).
     """
-    def __init__(self, llm_client=None):
+    def __init__(self, llm_client=None, lexicon: Optional[FinancialLexicon] = None):
         self.llm_client = llm_client # Placeholder for OpenAI/Local LLM client
+        # Compiled entity/metric/period lexicon (see financial_lexicon.py); built-in metrics only by default
+        self.lexicon = lexicon or FinancialLexicon()
+
+    def extract_typed_spans(self, text: str) -> List[LexiconSpan]:
+        """
+        Typed (entity/metric/period) spans with character offsets, from one pass of the compiled lexicon.
+        Works on documents as well as queries.
+        """
+        return self.lexicon.tag(text)
 
     def extract_query_spans(self, query: str) -> List[str]:
         """
@@ -31,7 +115,7 @@ class QueryProcessor:
         
         Strategy:
         1. Use LLM if available (Best performance).
-        2. Fallback to Regex/Heuristics (Baseline).
+        2. Fallback to Regex/Heuristics + compiled lexicon (Baseline).
         """
         if self.llm_client:
             # TODO: Implement LLM call to extract entities
@@ -42,11 +126,11 @@ class QueryProcessor:
         # This is a basic implementation to demonstrate the concept.
         spans = re.findall(r'\b[A-Z][a-zA-Z]*\b|\b\d{4}\b|\bFY\d{2,4}\b', query)
         
-        # Add specific financial keywords if present
-        financial_terms = ["revenue", "profit", "margin", "tax", "asset", "liability", "turnover"]
-        for term in financial_terms:
-            if term in query.lower():
-                spans.append(term)
+        # Add lexicon matches (entities, metrics, periods), plus the canonical name of each metric
+        for span in self.extract_typed_spans(query):
+            spans.append(span.text)
+            if span.type == "metric":
+                spans.append(span.canonical.lower())
                 
         return list(set(spans))
 
@@ -57,93 +141,859 @@ class QueryProcessor:
         # TODO: Implement expansion logic (e.g., generate a hypothetical answer)
         return query
 
+class _ReadWriteLock:
+    """
+    Any number of concurrent readers (queries) or a single writer (index mutation).
+    A waiting writer blocks new readers, so a stream of queries cannot starve updates.
+    """
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._readers = 0
+        self._writers_waiting = 0
+        self._writing = False
+
+    @contextmanager
+    def read(self):
+        with self._cond:
+            while self._writing or self._writers_waiting:
+                self._cond.wait()
+            self._readers += 1
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._readers -= 1
+                if self._readers == 0:
+                    self._cond.notify_all()
+
+    @contextmanager
+    def write(self):
+        with self._cond:
+            self._writers_waiting += 1
+            while self._writing or self._readers:
+                self._cond.wait()
+            self._writers_waiting -= 1
+            self._writing = True
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._writing = False
+                self._cond.notify_all()
+
 class HybridRetriever:
     """
     Combines Dense (Vector) and Sparse (Keyword) retrieval (1st Place Strategy).
+
+    The index can be changed in place with add_documents(), update_documents() and delete_documents().
+    Deleted rows are tombstoned and hidden from results at once, BM25 statistics are updated incrementally
+    and new embeddings are appended as segments searched exactly next to the dense index. compact()
+    (run in the background once max_segments or max_deleted_fraction is exceeded) rebuilds everything over the
+    live documents and swaps it in while queries keep running on the old state. With the flat dense index,
+    results always equal those of index_corpus() over the live documents in row order.
+
+    With dedup_threshold set, near-duplicate documents are folded into clusters (see near_duplicates.py) and
+    only one representative per cluster is embedded and indexed; its results list the other members as
+    duplicate_ids. Mutations keep the clusters current: deleting a representative promotes the next member.
     """
-    def __init__(self, embedding_model_name: str = 'BAAI/bge-m3'):
-        logger.info(f"Loading embedding model: {embedding_model_name}")
-        self.encoder = SentenceTransformer(embedding_model_name)
+    def __init__(self, embedding_model_name: str = 'BAAI/bge-m3', store_dir: Optional[str] = None,
+                 store_dtype: str = 'float16', encode_batch_size: int = 32, dense_index: str = 'flat',
+                 dense_index_params: Optional[Dict[str, Any]] = None, dense_candidates: int = 1000,
+                 fusion: str = 'weighted', fusion_candidates: Optional[int] = None, rrf_k: int = 60,
+                 lexicon: Optional[FinancialLexicon] = None, encoder: Optional[Any] = None,
+                 tracer: Optional[Tracer] = None, max_segments: Optional[int] = 8,
+                 max_deleted_fraction: Optional[float] = 0.25, dedup_threshold: Optional[float] = None):
+        """
+        store_dir: If set, corpus embeddings are persisted there and memory-mapped on reload
+                   (see EmbeddingStore). Only new or edited documents are re-encoded.
+                   Document texts are memory-mapped from <store_dir>/documents (see DocumentStore);
+                   they are kept as one in-memory UTF-8 blob otherwise.
+        dense_index: 'flat' (exact, default), 'ivf' or 'graph' (approximate, see dense_index.py), or 'int8' /
+                     'binary' (quantized codes, rescored against the float vectors).
+                     Approximate indexes are saved next to the stored embeddings.
+        dense_candidates: Number of nearest neighbours an approximate index returns per query.
+        fusion: Default fusion strategy, one of 'weighted', 'rrf', 'zscore' (see fusion.py).
+        fusion_candidates: Candidates taken from each retriever before fusion (default: 2 * top_k).
+        lexicon: Lexicon used to extract per-document metadata (company, fiscal period) at index time.
+        encoder: Prebuilt encoder with a SentenceTransformer-compatible encode(). When None, embedding_model_name
+                 is loaded through model_registry on first use, i.e. only once something needs encoding.
+                 embedding_model_name still names the embedding store.
+        tracer: Records per-stage timings and candidate counts (see instrumentation.py).
+        max_segments, max_deleted_fraction: Start a background compaction once more embedding segments have been
+                                            appended, or more of the rows deleted, than this (None: never).
+        dedup_threshold: Fold documents whose estimated Jaccard similarity (word 5-shingles) to an earlier one is
+                         at least this into its cluster (None: index every document). A representative matches a
+                         metadata filter if any member of its cluster does. Folded documents are kept in memory
+                         so they can be promoted when their representative is deleted.
+        """
+        if fusion not in FUSION_STRATEGIES:
+            raise ValueError(f"Unknown fusion strategy: {fusion} (expected one of {FUSION_STRATEGIES})")
+        self.embedding_model_name = embedding_model_name
+        self._encoder = encoder
+        self.encode_batch_size = encode_batch_size
+        self.store_dir = store_dir
+        self.embedding_store = EmbeddingStore(store_dir, embedding_model_name, dtype=store_dtype) if store_dir else None
+        self.dense_index_type = dense_index
+        self.dense_index_params = dense_index_params or {}
+        self.dense_candidates = dense_candidates
+        self.dense_index: Optional[DenseIndex] = None
+        self.fusion = fusion
+        self.fusion_candidates = fusion_candidates
+        self.rrf_k = rrf_k
+        self.lexicon = lexicon or FinancialLexicon()
+        self.metadata_index: Optional[MetadataIndex] = None
         self.bm25 = None
-        self.corpus_texts = []
+        self.corpus_texts = DocumentStore()
         self.corpus_ids = []
         self.corpus_embeddings = None
+        self.embedding_segments: List[np.ndarray] = []
+        self.build_seconds: Dict[str, float] = {}
+        self.tracer = tracer or Tracer()
+        self.max_segments = max_segments
+        self.max_deleted_fraction = max_deleted_fraction
+        self._deleted = np.zeros(0, dtype=bool)
+        self._live_rows: Optional[np.ndarray] = None  # None while no row is deleted
+        self._row_of: Dict[str, int] = {}
+        self.dedup_threshold = dedup_threshold
+        self.near_duplicates: Optional[NearDuplicateIndex] = None
+        self.duplicates: Dict[str, Tuple[str, ...]] = {}  # representative id -> ids folded into it
+        self._duplicate_of: Dict[str, str] = {}
+        self._duplicate_docs: Dict[str, Dict[str, Any]] = {}
+        self._own_metadata: Dict[str, Dict[str, Set[Any]]] = {}  # of representatives with a cluster
+        self._state_lock = _ReadWriteLock()
+        # Held by mutations and for the whole of a compaction, so the compacted snapshot cannot go stale
+        self._compaction_lock = threading.RLock()
+        self._compaction_thread: Optional[threading.Thread] = None
+
+    @property
+    def encoder(self):
+        # Loaded on first use: a fully cached corpus is indexed without the model
+        if self._encoder is None:
+            self._encoder = get_model(ENCODER, self.embedding_model_name)
+        return self._encoder
+
+    @encoder.setter
+    def encoder(self, encoder):
+        self._encoder = encoder
+
+    def _encode(self, texts: List[str], show_progress_bar: bool = False) -> np.ndarray:
+        # Normalized embeddings: a dot product against the corpus matrix equals cos_sim
+        return self.encoder.encode(texts, batch_size=self.encode_batch_size, convert_to_numpy=True,
+                                   normalize_embeddings=True, show_progress_bar=show_progress_bar)
 
     def index_corpus(self, corpus: List[Dict[str, str]]):
         """
         Indexes corpus for both Dense and Sparse retrieval.
-        corpus: List of dicts with 'id' and 'text' keys.
+        corpus: List of dicts with 'id' and 'text' keys. Optional metadata ('company', 'fiscal_year',
+                'fiscal_quarter', 'filing_type', top-level or under 'metadata') overrides extracted values.
         """
         logger.info(f"Indexing {len(corpus)} documents...")
+        self.build_seconds = {}
+        corpus = self._fold_corpus(corpus)
         self.corpus_ids = [doc['id'] for doc in corpus]
-        self.corpus_texts = [doc['text'] for doc in corpus]
+        texts = [doc['text'] for doc in corpus]
+        self.corpus_texts = DocumentStore.build(texts, self._document_store_path())
+        self.embedding_segments = []
+        self._deleted = np.zeros(len(corpus), dtype=bool)
+        self._live_rows = None
+        self._row_of = {doc_id: row for row, doc_id in enumerate(self.corpus_ids)}
+
+        # 0. Metadata Index (company, fiscal period, filing type) for pre-filtering
+        start = time.perf_counter()
+        self.metadata_index = MetadataIndex([self._representative_metadata(doc, self.duplicates.get(doc['id'], ()))
+                                             for doc in corpus])
+        self.build_seconds["metadata"] = time.perf_counter() - start
+        logger.info("Metadata Index built.")
 
         # 1. Build BM25 Index (Sparse)
-        tokenized_corpus = [doc.split(" ") for doc in self.corpus_texts]
-        self.bm25 = BM25Okapi(tokenized_corpus)
+        start = time.perf_counter()
+        self.bm25 = BM25Index(self._tokenize(text) for text in texts)
+        self.build_seconds["bm25"] = time.perf_counter() - start
         logger.info("BM25 Index built.")
 
         # 2. Create Embeddings (Dense)
-        # Note: For large corpus, use batch encoding and save to disk/vector DB
-        self.corpus_embeddings = self.encoder.encode(self.corpus_texts, convert_to_tensor=True, show_progress_bar=True)
+        start = time.perf_counter()
+        if self.embedding_store is not None:
+            self.corpus_embeddings = self.embedding_store.sync(
+                self.corpus_ids, texts, lambda missing: self._encode(missing, show_progress_bar=True))
+        else:
+            self.corpus_embeddings = self._encode(texts, show_progress_bar=True).astype(np.float32)
+        self.build_seconds["embeddings"] = time.perf_counter() - start
         logger.info("Dense Embeddings created.")
+        start = time.perf_counter()
+        self.dense_index = self._build_dense_index(self.corpus_embeddings)
+        self.build_seconds["dense_index"] = time.perf_counter() - start
 
-    def retrieve(self, query: str, query_spans: List[str], top_k: int = 100, alpha: float = 0.5) -> List[RetrievalResult]:
+    def _fold_corpus(self, corpus: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
         """
-        Performs Hybrid Search:
-        alpha: Weight for Dense Search (0.0 to 1.0). 1.0 = Pure Dense, 0.0 = Pure Sparse.
+        Resets the near-duplicate clusters to those of corpus and returns the representatives, in corpus order
+        (the whole corpus without dedup_threshold).
         """
-        if not self.bm25 or self.corpus_embeddings is None:
-            raise ValueError("Corpus not indexed!")
+        self.near_duplicates = None
+        self.duplicates, self._duplicate_of, self._duplicate_docs, self._own_metadata = {}, {}, {}, {}
+        if self.dedup_threshold is None:
+            return corpus
+        start = time.perf_counter()
+        self.near_duplicates = NearDuplicateIndex(self.dedup_threshold)
+        representatives = []
+        clusters: Dict[str, List[str]] = {}
+        found = self.near_duplicates.add_many([doc['id'] for doc in corpus], [doc['text'] for doc in corpus])
+        for doc, representative in zip(corpus, found):
+            if representative is None:
+                representatives.append(doc)
+            else:
+                clusters.setdefault(representative, []).append(doc['id'])
+                self._duplicate_of[doc['id']] = representative
+                self._duplicate_docs[doc['id']] = doc
+        self.duplicates = {rep: tuple(members) for rep, members in clusters.items()}
+        self.build_seconds["dedup"] = time.perf_counter() - start
+        logger.info(f"Folded {len(self._duplicate_of)} near-duplicates into {len(self.duplicates)} clusters; "
+                    f"indexing {len(representatives)} of {len(corpus)} documents.")
+        return representatives
 
-        # 1. Dense Retrieval
-        query_embedding = self.encoder.encode(query, convert_to_tensor=True)
-        # Cosine similarity
-        from sentence_transformers.util import cos_sim
-        dense_scores = cos_sim(query_embedding, self.corpus_embeddings)[0].cpu().numpy()
+    def representatives(self, corpus: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """
+        The documents of corpus that are indexed themselves, i.e. not folded into a near-duplicate.
+        """
+        return [doc for doc in corpus if doc['id'] not in self._duplicate_of]
 
-        # 2. Sparse Retrieval (BM25)
+    def _representative_metadata(self, doc: Dict[str, Any], members: Sequence[str]) -> Dict[str, Set[Any]]:
+        # Union over the cluster, so filtering on a folded document's company or period still finds it
+        own = self._own_metadata.get(doc['id'])
+        if own is None:
+            own = self._doc_metadata(doc)
+        if not members:
+            self._own_metadata.pop(doc['id'], None)
+            return own
+        self._own_metadata[doc['id']] = own
+        meta = {field: set(values) for field, values in own.items()}
+        for member in members:
+            for field, values in self._doc_metadata(self._duplicate_docs[member]).items():
+                meta.setdefault(field, set()).update(values)
+        return meta
+
+    def _document_store_path(self) -> Optional[str]:
+        return os.path.join(self.store_dir, "documents") if self.store_dir else None
+
+    @staticmethod
+    def _tokenize(text: str) -> List[str]:
+        return text.split(" ")
+
+    def _doc_metadata(self, doc: Dict[str, Any]) -> Dict[str, Any]:
+        return {**extract_metadata(doc['text'], self.lexicon), **explicit_metadata(doc)}
+
+    def _build_dense_index(self, embeddings: np.ndarray) -> DenseIndex:
+        index_path = None
+        if self.embedding_store is not None and self.dense_index_type != 'flat':
+            index_path = os.path.join(self.embedding_store.path, f"index_{self.dense_index_type}.npz")
+            index = load_dense_index(index_path, embeddings, self.dense_index_type,
+                                     self.dense_index_params, fingerprint=self.embedding_store.fingerprint)
+            if index is not None:
+                logger.info(f"Loaded {self.dense_index_type} index from {index_path}.")
+                return index
+        index = make_dense_index(self.dense_index_type, **self.dense_index_params).build(embeddings)
+        if index_path is not None:
+            index.save(index_path, fingerprint=self.embedding_store.fingerprint)
+        return index
+
+    def _dense_search(self, query_embeddings: np.ndarray, k: int) -> List[Tuple[np.ndarray, Optional[np.ndarray], Optional[ScoreStats]]]:
+        """
+        Dense stage for a batch of (L2-normalized) query embeddings.
+        Returns, per query, (top-k doc indices best first, full score row or None, score stats or None).
+        Approximate indexes only return their dense_candidates nearest neighbours, so the full row and
+        the corpus-wide statistics are unknown; fusion then scores and normalizes over the candidate set.
+        Once documents have been deleted, indices and score rows refer to positions in the live rows.
+        """
+        live = self._live_rows
+        if self.dense_index.exact:
+            scores = self.dense_index.score_all(query_embeddings)
+            if self.embedding_segments:
+                scores = np.hstack([scores] + [dot_blocks(segment, query_embeddings)
+                                               for segment in self.embedding_segments])
+            if live is not None:
+                scores = scores[:, live]
+            return [(top_candidates(row, k), row, ScoreStats.from_scores(row)) for row in scores]
+        k_ann = max(self.dense_candidates, k)
+        n_base = len(self.corpus_embeddings)
+        n_dead = int(self._deleted[:n_base].sum())
+        # Over-fetch by the number of tombstones the index may still return
+        cand_scores, cand_ids = self.dense_index.search(query_embeddings, min(k_ann + n_dead, n_base))
+        if n_dead == 0 and not self.embedding_segments:
+            return [(ids[ids >= 0][:k], None, None) for ids in cand_ids]
+        # Appended rows are not in the index yet: score them exactly and merge
+        tail_rows = np.flatnonzero(~self._deleted[n_base:]) + n_base
+        tail_scores = dot_blocks(self._embedding_rows(tail_rows), query_embeddings) if len(tail_rows) else None
+        results = []
+        for j, (scores, ids) in enumerate(zip(cand_scores, cand_ids)):
+            keep = ids >= 0
+            keep[keep] = ~self._deleted[ids[keep]]
+            scores, ids = scores[keep][:k_ann], ids[keep][:k_ann]
+            if tail_scores is not None:
+                scores, ids = np.concatenate([scores, tail_scores[j]]), np.concatenate([ids, tail_rows])
+            ranked = ids[np.lexsort((ids, -scores))][:k]
+            results.append((ranked if live is None else np.searchsorted(live, ranked), None, None))
+        return results
+
+    def _embedding_rows(self, rows: np.ndarray) -> np.ndarray:
+        # float32 copy of the given rows, from the base matrix or the appended segments
+        rows = np.asarray(rows, dtype=np.int64)
+        if not self.embedding_segments:
+            return np.asarray(self.corpus_embeddings[rows], dtype=np.float32)
+        n_base = len(self.corpus_embeddings)
+        out = np.empty((len(rows), self.corpus_embeddings.shape[1]), dtype=np.float32)
+        in_base = rows < n_base
+        out[in_base] = self.corpus_embeddings[rows[in_base]]
+        out[~in_base] = np.concatenate(self.embedding_segments)[rows[~in_base] - n_base]
+        return out
+
+    @property
+    def num_docs(self) -> int:
+        """
+        Number of live (indexed and not deleted) documents.
+        """
+        return len(self._row_of)
+
+    def check_dense_recall(self, queries: Optional[List[str]] = None, k: int = 10, n_queries: int = 100,
+                           seed: int = 0) -> Dict[str, float]:
+        """
+        Measures recall@k of the configured dense index against exact search, with per-query latencies.
+        Uses the given queries, or a sample of corpus embeddings as queries.
+        """
+        if self.dense_index is None:
+            raise ValueError("Corpus not indexed!")
+        if queries:
+            query_embeddings = self._encode(queries)
+        else:
+            rng = np.random.default_rng(seed)
+            sample = np.sort(rng.choice(len(self.corpus_ids), min(n_queries, len(self.corpus_ids)), replace=False))
+            query_embeddings = np.asarray(self.corpus_embeddings[sample], dtype=np.float32)
+        return measure_recall(self.dense_index, self.corpus_embeddings, query_embeddings, k=k)
+
+    @staticmethod
+    def _sparse_query_tokens(query: str, query_spans: List[str]) -> List[str]:
         # Enhance query with extracted spans for BM25
         bm25_query = query + " " + " ".join(query_spans)
-        tokenized_query = bm25_query.split(" ")
-        sparse_scores = self.bm25.get_scores(tokenized_query)
+        return bm25_query.split(" ")
+
+    def _candidate_k(self, top_k: int) -> int:
+        return self.fusion_candidates or 2 * top_k
 
-        # Normalize scores (Min-Max normalization for simple fusion)
-        def normalize(scores):
-            if np.max(scores) == np.min(scores):
-                return scores
-            return (scores - np.min(scores)) / (np.max(scores) - np.min(scores))
+    def _fuse(self, query_embedding: np.ndarray, dense, sparse_scores: np.ndarray, top_k: int, alpha: float,
+              fusion: str, rows: Optional[np.ndarray] = None) -> List[RetrievalResult]:
+        """
+        Fuses the union of the dense and sparse top-k' candidates (k' = fusion_candidates, default 2 * top_k)
+        instead of the whole corpus: O(N + k log k) per query after scoring.
+        rows: Corpus rows the score arrays refer to (a filtered subset or the live rows); None means every row.
+        """
+        with self.tracer.stage("fusion") as stage:
+            dense_ranked, dense_full, dense_stats = dense
+            sparse_ranked = top_candidates(sparse_scores, self._candidate_k(top_k))
+            candidates = np.union1d(dense_ranked, sparse_ranked)
 
-        dense_scores_norm = normalize(dense_scores)
-        sparse_scores_norm = normalize(sparse_scores)
+            if dense_full is not None:
+                dense_c = dense_full[candidates]
+            else:
+                candidate_rows = candidates if rows is None else rows[candidates]
+                dense_c = self._embedding_rows(candidate_rows) @ query_embedding
+                dense_stats = ScoreStats.from_scores(dense_c)
+            sparse_c = sparse_scores[candidates]
 
-        # 3. Fusion (Weighted Sum)
-        fused_scores = alpha * dense_scores_norm + (1 - alpha) * sparse_scores_norm
+            # 3. Fusion over the candidate set
+            fused_scores = fuse_scores(fusion, dense_c, sparse_c, dense_stats, ScoreStats.from_scores(sparse_scores),
+                                       candidate_ranks(candidates, dense_ranked),
+                                       candidate_ranks(candidates, sparse_ranked), alpha=alpha, rrf_k=self.rrf_k)
 
-        # Get Top K
-        top_indices = np.argsort(fused_scores)[::-1][:top_k]
+            # Get Top K
+            top_indices = top_candidates(fused_scores, top_k)
+            stage.set(candidates=len(candidates))
         
         results = []
-        for idx in top_indices:
+        for i in top_indices:
+            idx = candidates[i] if rows is None else rows[candidates[i]]
+            doc_id = self.corpus_ids[idx]
             results.append(RetrievalResult(
-                doc_id=self.corpus_ids[idx],
-                score=float(fused_scores[idx]),
-                text=self.corpus_texts[idx],
-                metadata={"dense_score": float(dense_scores[idx]), "sparse_score": float(sparse_scores[idx])}
+                doc_id=doc_id,
+                score=float(fused_scores[i]),
+                store=self.corpus_texts,
+                row=int(idx),
+                dense_score=float(dense_c[i]),
+                sparse_score=float(sparse_c[i]),
+                duplicate_ids=self.duplicates.get(doc_id, ())
             ))
             
         return results
 
+    def retrieve(self, query: str, query_spans: List[str], top_k: int = 100, alpha: float = 0.5,
+                 fusion: Optional[str] = None, filters: Optional[Dict[str, Any]] = None,
+                 strict_filters: bool = True) -> List[RetrievalResult]:
+        """
+        Performs Hybrid Search:
+        alpha: Weight for Dense Search (0.0 to 1.0). 1.0 = Pure Dense, 0.0 = Pure Sparse.
+        fusion: 'weighted' (min-max weighted sum), 'rrf' (reciprocal-rank fusion) or 'zscore';
+                defaults to the retriever's configured strategy.
+        filters: Metadata predicates, e.g. {'company': 'Apple Inc.', 'fiscal_year': [2019, 2020]}.
+                 Only matching documents are scored (dense and sparse).
+        strict_filters: If False (filters guessed from query spans), documents without a value for a
+                        filtered field still match, and an empty selection falls back to the whole corpus.
+        """
+        if not self.bm25 or self.dense_index is None:
+            raise ValueError("Corpus not indexed!")
+        with self._state_lock.read():
+            return self._retrieve(query, query_spans, top_k, alpha, fusion, filters, strict_filters)
+
+    def _retrieve(self, query: str, query_spans: List[str], top_k: int, alpha: float, fusion: Optional[str],
+                  filters: Optional[Dict[str, Any]], strict_filters: bool) -> List[RetrievalResult]:
+        with self.tracer.stage("filter") as stage:
+            subset = self.select(filters, strict=strict_filters)
+            stage.set(candidates=self.num_docs if subset is None else len(subset))
+        with self.tracer.stage("query_encoding"):
+            query_embedding = self._encode([query])
+        if subset is not None:
+            return self._retrieve_subset(query_embedding[0], self._sparse_query_tokens(query, query_spans),
+                                         subset, top_k, alpha, fusion or self.fusion)
+
+        # 1. Dense Retrieval
+        # Cosine similarity (both sides are L2-normalized)
+        with self.tracer.stage("dense") as stage:
+            dense = self._dense_search(query_embedding, self._candidate_k(top_k))[0]
+            stage.set(candidates=len(dense[0]))
+
+        # 2. Sparse Retrieval (BM25)
+        with self.tracer.stage("sparse") as stage:
+            sparse_scores = self.bm25.get_scores(self._sparse_query_tokens(query, query_spans))
+            if self._live_rows is not None:
+                sparse_scores = sparse_scores[self._live_rows]
+            stage.set(candidates=int(np.count_nonzero(sparse_scores)))
+
+        return self._fuse(query_embedding[0], dense, sparse_scores, top_k, alpha, fusion or self.fusion,
+                          rows=self._live_rows)
+
+    def select(self, filters: Optional[Dict[str, Any]], strict: bool = True) -> Optional[np.ndarray]:
+        """
+        Sorted live rows matching the metadata filters, or None when every document is to be scored.
+        """
+        if not filters:
+            return None
+        subset = self.metadata_index.select(filters, include_missing=not strict)
+        if self._live_rows is not None:
+            subset = np.intersect1d(subset, self._live_rows, assume_unique=True).astype(np.int32)
+        if not strict and (len(subset) == 0 or len(subset) == self.num_docs):
+            return None
+        return subset
+
+    def _retrieve_subset(self, query_embedding: np.ndarray, sparse_tokens: List[str], subset: np.ndarray,
+                         top_k: int, alpha: float, fusion: str) -> List[RetrievalResult]:
+        # Exact dense and sparse scoring restricted to the selected rows; fusion statistics are taken over them
+        if len(subset) == 0:
+            return []
+        with self.tracer.stage("dense", filtered=True) as stage:
+            dense_scores = self._embedding_rows(subset) @ query_embedding
+            dense = (top_candidates(dense_scores, self._candidate_k(top_k)), dense_scores,
+                     ScoreStats.from_scores(dense_scores))
+            stage.set(candidates=len(dense[0]))
+        with self.tracer.stage("sparse", filtered=True) as stage:
+            sparse_scores = self.bm25.get_scores(sparse_tokens, doc_ids=subset)
+            stage.set(candidates=int(np.count_nonzero(sparse_scores)))
+        return self._fuse(query_embedding, dense, sparse_scores, top_k, alpha, fusion, rows=subset)
+
+    def retrieve_batch(self, queries: List[str], query_spans: List[List[str]], top_k: int = 100,
+                       alpha: float = 0.5, batch_size: int = 32, fusion: Optional[str] = None,
+                       filters: Optional[List[Optional[Dict[str, Any]]]] = None,
+                       strict_filters: bool = True) -> List[List[RetrievalResult]]:
+        """
+        Batched version of retrieve(): returns one result list per query, in input order.
+        Queries are encoded batch_size at a time, dense scores come from one matrix multiply per
+        batch and sparse scores from one sparse matrix product per batch.
+        filters: Optional per-query metadata filters; filtered queries are scored on their own subset.
+        """
+        if not self.bm25 or self.dense_index is None:
+            raise ValueError("Corpus not indexed!")
+        if len(queries) != len(query_spans) or (filters is not None and len(filters) != len(queries)):
+            raise ValueError("queries, query_spans and filters must have the same length")
+        with self._state_lock.read():
+            return self._retrieve_batch(queries, query_spans, top_k, alpha, batch_size, fusion, filters,
+                                        strict_filters)
+
+    def _retrieve_batch(self, queries: List[str], query_spans: List[List[str]], top_k: int, alpha: float,
+                        batch_size: int, fusion: Optional[str], filters: Optional[List[Optional[Dict[str, Any]]]],
+                        strict_filters: bool) -> List[List[RetrievalResult]]:
+        all_results = []
+        for start in range(0, len(queries), batch_size):
+            batch_queries = queries[start:start + batch_size]
+            batch_spans = query_spans[start:start + batch_size]
+            batch_tokens = [self._sparse_query_tokens(q, s) for q, s in zip(batch_queries, batch_spans)]
+            with self.tracer.stage("filter", queries=len(batch_queries)) as stage:
+                subsets = [self.select(f, strict=strict_filters) for f in filters[start:start + batch_size]] \
+                    if filters is not None else [None] * len(batch_queries)
+                stage.set(candidates=sum(self.num_docs if s is None else len(s) for s in subsets))
+            unfiltered = [i for i, subset in enumerate(subsets) if subset is None]
+
+            with self.tracer.stage("query_encoding", queries=len(batch_queries)):
+                query_embeddings = self._encode(batch_queries)
+            batch_results: List[List[RetrievalResult]] = [[] for _ in batch_queries]
+            if unfiltered:
+                # 1. Dense Retrieval: (batch, n_docs) cosine similarities
+                with self.tracer.stage("dense", queries=len(unfiltered)) as stage:
+                    dense = self._dense_search(query_embeddings[unfiltered], self._candidate_k(top_k))
+                    stage.set(candidates=sum(len(d[0]) for d in dense))
+
+                # 2. Sparse Retrieval (BM25): (batch, n_docs)
+                with self.tracer.stage("sparse", queries=len(unfiltered)) as stage:
+                    sparse_scores = self.bm25.get_scores_batch([batch_tokens[i] for i in unfiltered])
+                    if self._live_rows is not None:
+                        sparse_scores = sparse_scores[:, self._live_rows]
+                    stage.set(candidates=int(np.count_nonzero(sparse_scores)))
+
+                for j, i in enumerate(unfiltered):
+                    batch_results[i] = self._fuse(query_embeddings[i], dense[j], sparse_scores[j], top_k, alpha,
+                                                  fusion or self.fusion, rows=self._live_rows)
+            for i, subset in enumerate(subsets):
+                if subset is not None:
+                    batch_results[i] = self._retrieve_subset(query_embeddings[i], batch_tokens[i], subset, top_k,
+                                                             alpha, fusion or self.fusion)
+            all_results.extend(batch_results)
+        return all_results
+
+    def add_documents(self, docs: List[Dict[str, Any]]):
+        """
+        Indexes new documents without a rebuild. docs: same format as index_corpus().
+        Raises ValueError if an id is already indexed (see update_documents()).
+        """
+        self._check_mutable()
+        ids = [doc['id'] for doc in docs]
+        with self._compaction_lock:
+            existing = sorted({doc_id for doc_id in ids if self._is_indexed(doc_id)})
+            if existing or len(set(ids)) != len(ids):
+                raise ValueError(f"Document ids already indexed or repeated: {existing or ids}")
+            if self.near_duplicates is not None:
+                self._append(*self._fold(docs=docs))
+            else:
+                self._append(docs)
+        self._maybe_compact()
+
+    def update_documents(self, docs: List[Dict[str, Any]]):
+        """
+        Replaces indexed documents (matched by id) with new text and metadata.
+        The old rows are tombstoned and the new versions appended, in one step for concurrent queries.
+        """
+        self._check_mutable()
+        ids = [doc['id'] for doc in docs]
+        with self._compaction_lock:
+            unknown = sorted({doc_id for doc_id in ids if not self._is_indexed(doc_id)})
+            if unknown or len(set(ids)) != len(ids):
+                raise ValueError(f"Document ids not indexed or repeated: {unknown or ids}")
+            if self.near_duplicates is not None:
+                self._append(*self._fold(removed=ids, docs=docs))
+            else:
+                self._append(docs, replaced_rows=[self._row_of[doc_id] for doc_id in ids])
+        self._maybe_compact()
+
+    def delete_documents(self, doc_ids: List[str]) -> int:
+        """
+        Removes documents from all results immediately. Unknown ids are ignored; returns the number deleted.
+        """
+        self._check_mutable()
+        with self._compaction_lock:
+            if self.near_duplicates is not None:
+                known = list(dict.fromkeys(doc_id for doc_id in doc_ids if self._is_indexed(doc_id)))
+                self._append(*self._fold(removed=known))
+                deleted = len(known)
+            else:
+                rows = sorted({self._row_of[doc_id] for doc_id in doc_ids if doc_id in self._row_of})
+                if rows:
+                    with self._state_lock.write():
+                        self._tombstone(rows)
+                        self.bm25.refresh()
+                deleted = len(rows)
+        self._maybe_compact()
+        return deleted
+
+    def _check_mutable(self):
+        if not self.bm25 or self.dense_index is None:
+            raise ValueError("Corpus not indexed!")
+
+    def _is_indexed(self, doc_id: str) -> bool:
+        return doc_id in self._row_of or doc_id in self._duplicate_of
+
+    def _fold(self, removed: Sequence[str] = (), docs: Sequence[Dict[str, Any]] = ()):
+        """
+        Applies removals, then additions, to the near-duplicate clusters (caller holds _compaction_lock) and
+        returns the matching _append() arguments. Rows to index are new representatives, promoted members and
+        representatives whose cluster changed; the latter are re-appended for their new metadata, reusing
+        their vector. Deleting a representative promotes the first member of its cluster; the other members stay
+        with it only if they are similar enough to it, and are otherwise matched again like added documents.
+        """
+        index = self.near_duplicates
+        clusters: Dict[str, List[str]] = {}
+        pending: Dict[str, Tuple[Dict[str, Any], Optional[int]]] = {}  # id -> (doc, row holding its vector)
+        replaced = set()
+        refold: List[Dict[str, Any]] = []  # members of a deleted representative not similar to the promoted one
+
+        def cluster(rep: str) -> List[str]:
+            if rep not in clusters:
+                clusters[rep] = list(self.duplicates.get(rep, ()))
+            return clusters[rep]
+
+        def reindex(rep: str):
+            if rep in pending or rep not in self._row_of:
+                return
+            row = self._row_of[rep]
+            if rep not in self._own_metadata:
+                # Without a cluster the row holds exactly the representative's own metadata
+                self._own_metadata[rep] = self.metadata_index.row_metadata(row)
+            replaced.add(row)
+            pending[rep] = ({'id': rep, 'text': self.corpus_texts[row]}, row)
+
+        for doc_id in removed:
+            rep = self._duplicate_of.pop(doc_id, None)
+            if rep is not None:
+                cluster(rep).remove(doc_id)
+                del self._duplicate_docs[doc_id]
+                reindex(rep)
+                continue
+            index.remove(doc_id)
+            pending.pop(doc_id, None)
+            self._own_metadata.pop(doc_id, None)
+            if doc_id in self._row_of:
+                replaced.add(self._row_of[doc_id])
+            members = cluster(doc_id)
+            clusters[doc_id] = []
+            if members:
+                promoted, members = members[0], members[1:]
+                doc = self._duplicate_docs.pop(promoted)
+                del self._duplicate_of[promoted]
+                signature = index.signature(doc['text'])
+                index.insert(promoted, signature)
+                pending[promoted] = (doc, None)
+                clusters[promoted] = []
+                if not members:
+                    continue
+                # Members matched the deleted representative, which says little about the promoted one
+                similar = (index.signatures([self._duplicate_docs[member]['text'] for member in members])
+                           == signature).mean(axis=1) >= index.threshold
+                for member, keep in zip(members, similar):
+                    if keep:
+                        self._duplicate_of[member] = promoted
+                        clusters[promoted].append(member)
+                    else:
+                        del self._duplicate_of[member]
+                        refold.append(self._duplicate_docs.pop(member))
+
+        removed = set(removed)
+        docs = [doc for doc in refold if doc['id'] not in removed] + list(docs)
+        for doc, signature in zip(docs, index.signatures([doc['text'] for doc in docs])):
+            rep = index.match(signature)
+            if rep is None:
+                index.insert(doc['id'], signature)
+                pending[doc['id']] = (doc, None)
+                continue
+            cluster(rep).append(doc['id'])
+            self._duplicate_of[doc['id']] = rep
+            self._duplicate_docs[doc['id']] = doc
+            reindex(rep)
+
+        append_docs = [doc for doc, _ in pending.values()]
+        metadata = [self._representative_metadata(doc, clusters.get(doc['id'], self.duplicates.get(doc['id'], ())))
+                    for doc in append_docs]
+        vector_rows = [row for _, row in pending.values()]
+        return append_docs, sorted(replaced), metadata, vector_rows, \
+            {rep: tuple(members) for rep, members in clusters.items()}
+
+    def _append(self, docs: List[Dict[str, Any]], replaced_rows: Optional[List[int]] = None,
+                metadata: Optional[List[Dict[str, Set[Any]]]] = None, vector_rows: Optional[List[Optional[int]]] = None,
+                clusters: Optional[Dict[str, Tuple[str, ...]]] = None):
+        # Caller holds _compaction_lock. The slow parts (metadata extraction, encoding) run before taking the
+        # state lock, so queries are only blocked while the new rows are linked in.
+        # vector_rows: Per document, an indexed row whose vector it reuses instead of being encoded (or None).
+        # clusters: Near-duplicate clusters that change along with the rows (see _fold()).
+        if not docs and not replaced_rows:
+            return
+        ids = [doc['id'] for doc in docs]
+        texts = [doc['text'] for doc in docs]
+        if metadata is None:
+            metadata = [self._doc_metadata(doc) for doc in docs]
+        tokens = [self._tokenize(text) for text in texts]
+        embeddings = self._new_embeddings(texts, vector_rows or [None] * len(docs)) if docs else None
+        # Append-only: rows past the ones queries know about are invisible until linked in below
+        self.corpus_texts.append(texts)
+        with self._state_lock.write():
+            if replaced_rows:
+                self._tombstone(replaced_rows)
+            if docs:
+                rows = self.bm25.add_documents(tokens)
+                self.metadata_index.extend(metadata)
+                self.embedding_segments.append(embeddings)
+                self.corpus_ids.extend(ids)
+                self._deleted = np.concatenate([self._deleted, np.zeros(len(docs), dtype=bool)])
+                self._row_of.update(zip(ids, rows.tolist()))
+                self._update_live_rows()
+            self.bm25.refresh()
+            for rep, members in (clusters or {}).items():
+                if members:
+                    self.duplicates[rep] = members
+                else:
+                    self.duplicates.pop(rep, None)
+        logger.info(f"Added {len(docs)} documents ({len(self.embedding_segments)} segments, "
+                    f"{int(self._deleted.sum())} deleted rows).")
+
+    def _new_embeddings(self, texts: List[str], vector_rows: List[Optional[int]]) -> np.ndarray:
+        # Same precision as the stored matrix, so scores match a rebuild that reads the vectors back
+        dtype = self.embedding_store.dtype if self.embedding_store is not None else np.float32
+        known = [i for i, row in enumerate(vector_rows) if row is not None]
+        if not known:
+            return np.asarray(self._encode(texts), dtype=np.float32).astype(dtype)
+        embeddings = np.empty((len(texts), self.corpus_embeddings.shape[1]), dtype=dtype)
+        embeddings[known] = self._embedding_rows([vector_rows[i] for i in known])
+        missing = [i for i, row in enumerate(vector_rows) if row is None]
+        if missing:
+            embeddings[missing] = np.asarray(self._encode([texts[i] for i in missing]), dtype=np.float32)
+        return embeddings
+
+    def _tombstone(self, rows: List[int]):
+        # Caller holds the state write lock
+        self.bm25.delete_documents(rows)
+        self._deleted[rows] = True
+        for row in rows:
+            del self._row_of[self.corpus_ids[row]]
+        self._update_live_rows()
+
+    def _update_live_rows(self):
+        self._live_rows = np.flatnonzero(~self._deleted) if self._deleted.any() else None
+
+    def _maybe_compact(self):
+        if self._compaction_thread is not None and self._compaction_thread.is_alive():
+            return
+        too_many_segments = self.max_segments is not None and len(self.embedding_segments) > self.max_segments
+        too_many_deleted = self.max_deleted_fraction is not None and \
+            self._deleted.sum() > self.max_deleted_fraction * len(self._deleted)
+        if too_many_segments or too_many_deleted:
+            self.compact(background=True)
+
+    def compact(self, background: bool = False) -> Optional[threading.Thread]:
+        """
+        Rebuilds BM25, metadata, embeddings and dense index over the live documents (in row order), dropping
+        tombstones and merging the appended segments into the base matrix (and the embedding store, if any).
+        Queries keep running on the old state until the rebuilt one is swapped in; mutations wait.
+        background: Run in a daemon thread and return it.
+        """
+        if background:
+            self._compaction_thread = threading.Thread(target=self.compact, name="rag-compaction", daemon=True)
+            self._compaction_thread.start()
+            return self._compaction_thread
+        with self._compaction_lock:
+            if not self.embedding_segments and self._live_rows is None:
+                return None
+            start = time.perf_counter()
+            live = np.flatnonzero(~self._deleted)
+            ids = [self.corpus_ids[row] for row in live]
+            texts = self.corpus_texts.texts(live)
+            bm25 = BM25Index(self._tokenize(text) for text in texts)
+            metadata_index = self.metadata_index.take(live)
+            if self.embedding_store is not None:
+                row_of_hash = {content_hash(text): row for text, row in zip(texts, live)}
+
+                def known_vectors(missing_texts: List[str]) -> np.ndarray:
+                    # Every live text was embedded when it was added; only vectors the store lacks are asked for
+                    return self._embedding_rows([row_of_hash[content_hash(text)] for text in missing_texts])
+
+                embeddings = self.embedding_store.sync(ids, texts, known_vectors)
+            else:
+                embeddings = self._embedding_rows(live)
+            dense_index = self._build_dense_index(embeddings)
+            # Replaces the files atomically; results and queries still holding the old store keep reading it
+            document_store = DocumentStore.build(texts, self._document_store_path())
+            with self._state_lock.write():
+                self.corpus_ids, self.corpus_texts = ids, document_store
+                self.bm25, self.metadata_index = bm25, metadata_index
+                self.corpus_embeddings, self.dense_index = embeddings, dense_index
+                self.embedding_segments = []
+                self._deleted = np.zeros(len(ids), dtype=bool)
+                self._live_rows = None
+                self._row_of = {doc_id: row for row, doc_id in enumerate(ids)}
+            self.build_seconds["compaction"] = time.perf_counter() - start
+            logger.info(f"Compacted index to {len(ids)} documents in {self.build_seconds['compaction']:.2f}s.")
+        return None
+
 class AdvancedReranker:
     """
     Implements Multi-Stage Reranking (2nd Place Strategy) or ColBERT (1st Place).
     """
-    def __init__(self, model_name: str = 'cross-encoder/ms-marco-MiniLM-L-12-v2'):
+    def __init__(self, model_name: str = 'cross-encoder/ms-marco-MiniLM-L-12-v2', cache: Optional[RerankScoreCache] = None,
+                 batch_size: int = 32, length_bucketing: bool = True, model: Optional[Any] = None):
+        """
+        cache: Optional score cache keyed on (model, normalized query, doc_id); see rerank_cache.py.
+        length_bucketing: Sort uncached pairs by length before predict() so each batch holds passages of
+                          similar length and wastes little padding.
+        model: Prebuilt scorer with a CrossEncoder-compatible predict(pairs, batch_size). When None, model_name is
+               loaded through model_registry the first time pairs need scoring. model_name still keys the score cache.
+        """
         # Note: 1st place used ColBERT, 2nd place used jina-reranker-v2
         # Using a standard CrossEncoder here for demonstration. 
-        # For ColBERT, we would need the 'ragatouille' library or similar.
-        logger.info(f"Loading reranker model: {model_name}")
-        self.reranker = CrossEncoder(model_name)
+        # ColBERT-style late interaction is in late_interaction.py (LateInteractionReranker).
+        self.model_name = model_name
+        self._model = model
+        self.cache = cache
+        self.batch_size = batch_size
+        self.length_bucketing = length_bucketing
+        self.pairs_requested = 0
+        self.pairs_scored = 0
+
+    @property
+    def reranker(self):
+        # Loaded on first use: fully cached pairs are answered without the model
+        if self._model is None:
+            self._model = get_model(CROSS_ENCODER, self.model_name)
+        return self._model
+
+    @reranker.setter
+    def reranker(self, model):
+        self._model = model
+
+    def _score_pairs(self, queries: List[str], docs: List[RetrievalResult], batch_size: int) -> np.ndarray:
+        """
+        Cross-encoder scores of (queries[i], docs[i]) pairs.
+        Duplicate pairs and cached pairs are not sent to the model.
+        """
+        self.pairs_requested += len(docs)
+        if self.cache is None:
+            keys = [(q, doc.doc_id, doc.text) for q, doc in zip(queries, docs)]
+            cached = {}
+        else:
+            keys = [rerank_cache_key(self.model_name, q, doc.doc_id, doc.text) for q, doc in zip(queries, docs)]
+            cached = self.cache.get_many(set(keys))
+
+        # One model call per distinct uncached pair
+        todo: Dict[Any, int] = {}
+        for i, key in enumerate(keys):
+            if key not in cached and key not in todo:
+                todo[key] = i
+        todo_idx = list(todo.values())
+        if self.length_bucketing:
+            todo_idx.sort(key=lambda i: len(queries[i]) + len(docs[i].text))
+
+        scores_by_key = dict(cached)
+        if todo_idx:
+            predicted = self.reranker.predict([[queries[i], docs[i].text] for i in todo_idx], batch_size=batch_size)
+            new_scores = [(keys[i], float(s)) for i, s in zip(todo_idx, predicted)]
+            scores_by_key.update(new_scores)
+            if self.cache is not None:
+                self.cache.put_many(new_scores)
+        self.pairs_scored += len(todo_idx)
+        logger.debug(f"Reranker: {len(docs)} pairs requested, {len(todo_idx)} scored by the model.")
+        return np.array([scores_by_key[key] for key in keys], dtype=np.float32)
+
+    def stats(self) -> Dict[str, float]:
+        """
+        Pairs requested vs. actually sent to the model, plus cache statistics when a cache is configured.
+        """
+        stats = {
+            "pairs_requested": self.pairs_requested,
+            "pairs_scored": self.pairs_scored,
+            "pairs_saved": self.pairs_requested - self.pairs_scored,
+        }
+        if self.cache is not None:
+            stats.update({f"cache_{k}": v for k, v in self.cache.stats().items()})
+        return stats
 
     def rerank(self, query: str, results: List[RetrievalResult], top_k: int = 10) -> List[RetrievalResult]:
         """
@@ -152,8 +1002,7 @@ class AdvancedReranker:
         if not results:
             return []
             
-        pairs = [[query, doc.text] for doc in results]
-        scores = self.reranker.predict(pairs)
+        scores = self._score_pairs([query] * len(results), results, self.batch_size)
         
         # Update scores and resort
         for doc, score in zip(results, scores):
@@ -162,33 +1011,301 @@ class AdvancedReranker:
         results.sort(key=lambda x: x.score, reverse=True)
         return results[:top_k]
 
+    def rerank_batch(self, queries: List[str], results_list: List[List[RetrievalResult]], top_k: int = 10,
+                     batch_size: Optional[int] = None) -> List[List[RetrievalResult]]:
+        """
+        Reranks the candidates of many queries at once.
+        Pairs from all queries are packed into one predict() call so every cross-encoder batch is full.
+        """
+        pair_queries = [query for query, results in zip(queries, results_list) for _ in results]
+        docs = [doc for results in results_list for doc in results]
+        scores = self._score_pairs(pair_queries, docs, batch_size or self.batch_size) if docs else []
+
+        reranked = []
+        offset = 0
+        for results in results_list:
+            for doc, score in zip(results, scores[offset:offset + len(results)]):
+                doc.score = float(score)
+            offset += len(results)
+            results.sort(key=lambda x: x.score, reverse=True)
+            reranked.append(results[:top_k])
+        return reranked
+
+@dataclass
+class RerankStage:
+    """
+    One stage of a RerankCascade: scores the top `candidates` results of the previous stage.
+    """
+    model_name: str
+    candidates: int
+    batch_size: int = 32
+    # Prebuilt reranker (AdvancedReranker, late_interaction.LateInteractionReranker, or anything with
+    # rerank_batch() and stats()); a cross-encoder loaded from model_name when None
+    reranker: Optional[Any] = None
+
+class RerankCascade:
+    """
+    Budgeted N-stage reranking: cheap models on wide candidate lists, expensive models on narrow ones.
+
+    latency_budget_ms: Optional per-query budget. Each stage keeps a running estimate of its cost per pair;
+                       later stages are shrunk to what still fits the remaining budget and skipped when
+                       fewer than top_k candidates would fit. The first stage always runs in full.
+    early_exit_margin: If the first stage's top-1 score beats its top-2 score by at least this margin,
+                       the remaining stages are skipped for that query.
+    """
+    def __init__(self, stages: List[RerankStage], latency_budget_ms: Optional[float] = None,
+                 early_exit_margin: Optional[float] = None, cache: Optional[RerankScoreCache] = None,
+                 tracer: Optional[Tracer] = None):
+        if not stages:
+            raise ValueError("A rerank cascade needs at least one stage.")
+        for stage in stages:
+            if stage.reranker is None:
+                stage.reranker = AdvancedReranker(model_name=stage.model_name, cache=cache, batch_size=stage.batch_size)
+        self.stages = stages
+        self.latency_budget_ms = latency_budget_ms
+        self.early_exit_margin = early_exit_margin
+        self.ms_per_pair: List[Optional[float]] = [None] * len(stages)
+        self.stage_runs = [0] * len(stages)
+        self.early_exits = 0
+        self.tracer = tracer or Tracer()
+
+    @property
+    def candidates(self) -> int:
+        return self.stages[0].candidates
+
+    def index_corpus(self, corpus: List[Dict[str, str]]):
+        """
+        Lets stages that precompute document representations (e.g. late interaction) index the corpus.
+        """
+        for stage in self.stages:
+            if hasattr(stage.reranker, "index_corpus"):
+                stage.reranker.index_corpus(corpus)
+
+    def _stage_size(self, i: int, n_results: int, elapsed_ms: float, top_k: int) -> int:
+        n = min(self.stages[i].candidates, n_results)
+        if i == 0 or self.latency_budget_ms is None or self.ms_per_pair[i] is None:
+            return n
+        affordable = int((self.latency_budget_ms - elapsed_ms) / max(self.ms_per_pair[i], 1e-6))
+        n = min(n, affordable)
+        return n if n >= min(top_k, n_results) else 0
+
+    def _record_cost(self, i: int, elapsed_ms: float, pairs: int):
+        if pairs:
+            observed = elapsed_ms / pairs
+            previous = self.ms_per_pair[i]
+            self.ms_per_pair[i] = observed if previous is None else 0.8 * previous + 0.2 * observed
+
+    def _decisive(self, results: List[RetrievalResult]) -> bool:
+        return (self.early_exit_margin is not None and len(results) > 1
+                and results[0].score - results[1].score >= self.early_exit_margin)
+
+    def rerank(self, query: str, results: List[RetrievalResult], top_k: int = 10) -> List[RetrievalResult]:
+        return self.rerank_batch([query], [results], top_k=top_k)[0]
+
+    def rerank_batch(self, queries: List[str], results_list: List[List[RetrievalResult]], top_k: int = 10,
+                     batch_size: Optional[int] = None) -> List[List[RetrievalResult]]:
+        """
+        Runs the cascade over many queries; each stage packs all still-active queries into one batch.
+        Stage latency is amortized over the queries of the batch when checking the budget.
+        """
+        current = [list(results) for results in results_list]
+        active = list(range(len(queries)))
+        elapsed_ms = [0.0] * len(queries)
+        for i, stage in enumerate(self.stages):
+            sizes = {q: self._stage_size(i, len(current[q]), elapsed_ms[q], top_k) for q in active}
+            active = [q for q in active if sizes[q] > 0]
+            if not active:
+                break
+            start = time.perf_counter()
+            with self.tracer.stage(f"rerank_{i}", model=stage.model_name, queries=len(active),
+                                   candidates=sum(sizes[q] for q in active)):
+                # Intermediate stages hand all their candidates on; the last one only needs the final top_k
+                last = i == len(self.stages) - 1
+                reranked = stage.reranker.rerank_batch([queries[q] for q in active],
+                                                       [current[q][:sizes[q]] for q in active],
+                                                       top_k=top_k if last else max(sizes.values()),
+                                                       batch_size=stage.batch_size)
+            stage_ms = 1000 * (time.perf_counter() - start)
+            self._record_cost(i, stage_ms, sum(sizes[q] for q in active))
+            self.stage_runs[i] += len(active)
+            for q, head in zip(active, reranked):
+                # Candidates this stage did not score keep their previous order behind the reranked ones
+                current[q] = head + current[q][sizes[q]:]
+                elapsed_ms[q] += stage_ms / len(active)
+            if i == 0 and self.early_exit_margin is not None:
+                exiting = [q for q in active if self._decisive(current[q])]
+                self.early_exits += len(exiting)
+                active = [q for q in active if q not in set(exiting)]
+        return [results[:top_k] for results in current]
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "stage_runs": list(self.stage_runs),
+            "ms_per_pair": list(self.ms_per_pair),
+            "early_exits": self.early_exits,
+            "stages": [stage.reranker.stats() for stage in self.stages],
+        }
+
 class FinanceRAGSystem:
-    def __init__(self):
-        self.query_processor = QueryProcessor()
+    def __init__(self, embedding_store_dir: Optional[str] = None, fusion: str = 'weighted',
+                 rerank_cache: Optional[RerankScoreCache] = None, rerank_stages: Optional[List[RerankStage]] = None,
+                 rerank_latency_budget_ms: Optional[float] = None, early_exit_margin: Optional[float] = None,
+                 lexicon: Optional[FinancialLexicon] = None, auto_filter: bool = True,
+                 embedding_model_name: str = 'BAAI/bge-m3', encoder: Optional[Any] = None, dense_index: str = 'flat',
+                 dense_index_params: Optional[Dict[str, Any]] = None, tracer: Optional[Tracer] = None,
+                 shards: Optional[int] = None, alpha: float = 0.5, candidates: Optional[int] = None,
+                 dedup_threshold: Optional[float] = None):
+        """
+        rerank_stages: Reranking cascade (see RerankCascade). Defaults to a single cross-encoder over the top 200;
+                       an empty list answers with the retrieval ranking alone.
+        alpha: Dense weight of the hybrid retrieval (see HybridRetriever.retrieve).
+        candidates: Documents retrieved per query for reranking (default: the first rerank stage's candidates,
+                    or 200 without reranking).
+        encoder, dense_index, dense_index_params: Passed to HybridRetriever.
+        tracer: Per-stage timing hooks shared by every component (see instrumentation.py); results of answer()
+                and answer_batch() carry their trace as .trace.
+        shards: If set, retrieval runs on this many worker processes (see ShardedHybridRetriever); flat dense index only.
+        auto_filter: Restrict retrieval to documents matching the company / fiscal period spans of the query
+                     (non-strict: documents without that metadata are kept) unless explicit filters are given.
+                     Only period-shaped spans (FY2019, Q3 2019, fiscal 2019) set a year, never a bare number.
+                     On by default because finance questions usually name the filer and period, and retrieving
+                     another company's or year's filing is the most common wrong answer; a filter that
+                     selects nothing falls back to the whole corpus, so a wrong guess costs little.
+        dedup_threshold: Index one representative per cluster of near-duplicate documents (see HybridRetriever);
+                         answers then hold one result per cluster, see expand_duplicates() for all source ids.
+                         candidates counts source documents: a cluster fills as many slots as it has members,
+                         so each text is reranked once and rerank work falls with the duplication.
+        """
+        self.query_processor = QueryProcessor(lexicon=lexicon)
+        self.auto_filter = auto_filter
+        self.dedup_threshold = dedup_threshold
+        self.alpha = alpha
+        self.tracer = tracer or Tracer()
         # Using BAAI/bge-m3 as it supports dense, sparse, and colbert-style (multi-vector)
         # But here we treat it as a dense model for simplicity in this hybrid setup
-        self.retriever = HybridRetriever(embedding_model_name='BAAI/bge-m3') 
-        self.reranker = AdvancedReranker(model_name='cross-encoder/ms-marco-MiniLM-L-12-v2')
+        if shards:
+            if dense_index != 'flat':
+                raise ValueError("Sharded retrieval scores the dense side exactly; use dense_index='flat'.")
+            if dedup_threshold is not None:
+                raise ValueError("Near-duplicate folding is not supported by sharded retrieval.")
+            from sharded_retriever import ShardedHybridRetriever
+            self.retriever = ShardedHybridRetriever(n_shards=shards, embedding_model_name=embedding_model_name,
+                                                    store_dir=embedding_store_dir, fusion=fusion,
+                                                    lexicon=self.query_processor.lexicon, encoder=encoder,
+                                                    tracer=self.tracer)
+        else:
+            self.retriever = HybridRetriever(embedding_model_name=embedding_model_name, store_dir=embedding_store_dir,
+                                             fusion=fusion, lexicon=self.query_processor.lexicon, encoder=encoder,
+                                             dense_index=dense_index, dense_index_params=dense_index_params,
+                                             tracer=self.tracer, dedup_threshold=dedup_threshold)
+        if rerank_stages is None:
+            rerank_stages = [RerankStage(model_name='cross-encoder/ms-marco-MiniLM-L-12-v2', candidates=200)]
+        self.reranker = RerankCascade(rerank_stages, latency_budget_ms=rerank_latency_budget_ms,
+                                      early_exit_margin=early_exit_margin, cache=rerank_cache,
+                                      tracer=self.tracer) if rerank_stages else None
+        self.candidates = candidates or (self.reranker.candidates if self.reranker is not None else 200)
 
     def index_data(self, corpus: List[Dict[str, str]]):
         self.retriever.index_corpus(corpus)
+        if self.reranker is not None:
+            # Folded near-duplicates are never retrieved, so rerankers only need the representatives
+            if isinstance(self.retriever, HybridRetriever):
+                corpus = self.retriever.representatives(corpus)
+            self.reranker.index_corpus(corpus)
 
-    def answer(self, query: str) -> List[RetrievalResult]:
-        # 1. Process Query
-        spans = self.query_processor.extract_query_spans(query)
-        # expanded_query = self.query_processor.expand_query(query)
-        
-        print(f"Original Query: {query}")
-        print(f"Extracted Spans: {spans}")
-        
-        # 2. Retrieve (Hybrid)
-        # Pass extracted spans to boost sparse retrieval
-        retrieved_docs = self.retriever.retrieve(query, query_spans=spans, top_k=200)
-        
-        # 3. Rerank
-        top_docs = self.reranker.rerank(query, retrieved_docs, top_k=10)
-        
-        return top_docs
+    def _filters(self, query: str, filters: Optional[Dict[str, Any]]) -> Tuple[Optional[Dict[str, Any]], bool]:
+        # Explicit filters are strict; filters derived from query spans are only a hint
+        if filters is not None:
+            return filters, True
+        if not self.auto_filter:
+            return None, True
+        return MetadataIndex.filters_from_spans(self.query_processor.extract_typed_spans(query)), False
+
+    def _rerank_candidates(self, docs: List[RetrievalResult]) -> List[RetrievalResult]:
+        # Shortest prefix of the retrieved clusters covering `candidates` source documents
+        if self.dedup_threshold is None:
+            return docs
+        covered = 0
+        for i, doc in enumerate(docs):
+            covered += 1 + len(doc.duplicate_ids)
+            if covered >= self.candidates:
+                return docs[:i + 1]
+        return docs
+
+    def _rerank_batch(self, queries: List[str], retrieved: List[List[RetrievalResult]],
+                      top_k: int) -> List[List[RetrievalResult]]:
+        if self.reranker is None:
+            return [docs[:top_k] for docs in retrieved]
+        return self.reranker.rerank_batch(queries, retrieved, top_k=top_k)
+
+    def answer(self, query: str, filters: Optional[Dict[str, Any]] = None, top_k: int = 10) -> List[RetrievalResult]:
+        """
+        filters: Optional metadata predicates (see HybridRetriever.retrieve); derived from the query when None.
+        The returned list carries per-stage timings and candidate counts as .trace (see instrumentation.py).
+        """
+        with self.tracer.trace("answer", query=query) as trace:
+            # 1. Process Query
+            with self.tracer.stage("span_extraction") as stage:
+                spans = self.query_processor.extract_query_spans(query)
+                filters, strict = self._filters(query, filters)
+                stage.set(candidates=len(spans))
+            # expanded_query = self.query_processor.expand_query(query)
+            trace.attrs["spans"] = spans
+
+            # 2. Retrieve (Hybrid)
+            # Pass extracted spans to boost sparse retrieval
+            retrieved_docs = self.retriever.retrieve(query, query_spans=spans, top_k=self.candidates, alpha=self.alpha,
+                                                     filters=filters, strict_filters=strict)
+            retrieved_docs = self._rerank_candidates(retrieved_docs)
+
+            # 3. Rerank
+            with self.tracer.stage("rerank") as stage:
+                top_docs = self._rerank_batch([query], [retrieved_docs], top_k)[0]
+                stage.set(candidates=len(retrieved_docs))
+
+        return TracedResults(top_docs, trace)
+
+    def answer_batch(self, queries: List[str], batch_size: int = 32,
+                     filters: Optional[List[Optional[Dict[str, Any]]]] = None,
+                     top_k: int = 10) -> List[List[RetrievalResult]]:
+        """
+        Answers many queries at once; returns the same top_k as answer() for each query, in input order.
+        batch_size bounds how many queries are scored against the corpus together
+        (memory: batch_size x corpus size scores) and the cross-encoder batch size.
+        filters: Optional explicit metadata filters, one entry per query.
+        Stage timings in each result's .trace cover the whole batch the query was answered in.
+        """
+        all_results = []
+        for start in range(0, len(queries), batch_size):
+            batch_queries = queries[start:start + batch_size]
+            batch_filters = filters[start:start + batch_size] if filters is not None else [None] * len(batch_queries)
+
+            with self.tracer.trace("answer_batch", queries=len(batch_queries)) as trace:
+                # 1. Process Queries
+                with self.tracer.stage("span_extraction", queries=len(batch_queries)) as stage:
+                    spans = [self.query_processor.extract_query_spans(q) for q in batch_queries]
+                    resolved = [self._filters(q, f) for q, f in zip(batch_queries, batch_filters)]
+                    stage.set(candidates=sum(len(s) for s in spans))
+
+                # 2. Retrieve (Hybrid)
+                retrieved_docs = []
+                for strict in (True, False):
+                    idx = [i for i, (_, s) in enumerate(resolved) if s == strict]
+                    if idx:
+                        docs = self.retriever.retrieve_batch([batch_queries[i] for i in idx], [spans[i] for i in idx],
+                                                             top_k=self.candidates, alpha=self.alpha,
+                                                             batch_size=batch_size,
+                                                             filters=[resolved[i][0] for i in idx],
+                                                             strict_filters=strict)
+                        retrieved_docs.extend(zip(idx, docs))
+                retrieved_docs = [self._rerank_candidates(docs) for _, docs in sorted(retrieved_docs, key=lambda x: x[0])]
+
+                # 3. Rerank
+                with self.tracer.stage("rerank", queries=len(batch_queries)) as stage:
+                    reranked = self._rerank_batch(batch_queries, retrieved_docs, top_k)
+                    stage.set(candidates=sum(len(docs) for docs in retrieved_docs))
+            all_results.extend(TracedResults(results, trace) for results in reranked)
+        return all_results
 
 if __name__ == "__main__":
     # Dummy Data for Testing
@@ -209,3 +1326,6 @@ if __name__ == "__main__":
     print("\nTop Results:")
     for r in results:
         print(f"[{r.score:.4f}] {r.text}")
+    print("\nStage Timings:")
+    for stage in results.trace.stages:
+        print(f"{stage.name:<16} {stage.ms:8.2f} ms  {stage.attrs}")
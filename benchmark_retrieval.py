@@ -0,0 +1,442 @@
+"""
+Offline Scale Benchmark for the Hybrid Retrieval Pipeline
+Generates synthetic financial-filing corpora and queries (10k / 100k / 1M documents by default) and measures,
+for each stage (indexing, hybrid retrieval, reranking, end-to-end answer, and the traced stages inside answer):
+1. Index build time
+2. Peak RSS
+3. Index size on disk
+4. p50 / p95 / p99 query latency
+
+Runs fully offline: the default encoder and reranker are deterministic stubs; a locally cached model can be
+used instead (--encoder / --reranker with a model name, loaded with HF_HUB_OFFLINE=1).
+Each scale runs in its own subprocess so peak RSS is measured per scale. Results are written as JSON.
+
+--startup instead measures cold-start time in fresh interpreters: importing the package, constructing
+FinanceRAGSystem, reopening a persisted index and answering BM25 / span-extraction queries (which must not load
+any neural model), and the first full answer.
+
+Usage:
+    python benchmark_retrieval.py --scales 10000 100000 1000000 --output benchmark_results.json
+    python benchmark_retrieval.py --startup --output startup_results.json
+"""
+import argparse
+import json
+import logging
+import os
+import platform
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from model_registry import CROSS_ENCODER, ENCODER, load_encoder, load_reranker_model
+
+DEFAULT_SCALES = [10000, 100000, 1000000]
+YEARS = list(range(2015, 2024))
+FILING_TYPES = ["10-K", "10-Q", "8-K"]
+METRICS = ["revenue", "net income", "gross margin", "effective tax rate", "total assets", "total liabilities",
+           "fixed asset turnover", "inventory turnover", "EBITDA", "free cash flow", "capital expenditures",
+           "earnings per share", "return on equity", "operating margin"]
+QUERY_TEMPLATES = [
+    "What was the {metric} of {company} in FY{year}?",
+    "How did {company} {metric} change in Q{quarter} {year}?",
+    "Report the {metric} for {ticker} in fiscal {year}",
+]
+
+
+def _percentiles(latencies_ms: List[float]) -> Dict[str, float]:
+    values = np.asarray(latencies_ms, dtype=np.float64)
+    return {
+        "p50_ms": float(np.percentile(values, 50)),
+        "p95_ms": float(np.percentile(values, 95)),
+        "p99_ms": float(np.percentile(values, 99)),
+        "mean_ms": float(values.mean()),
+        "n": int(values.size),
+    }
+
+
+def _peak_rss_mb() -> float:
+    # ru_maxrss is in KiB on Linux and bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def _dir_size(path: str) -> int:
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            total += os.path.getsize(os.path.join(root, name))
+    return total
+
+
+def _git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+# ---------------------------------------------------------------------------
+# Synthetic data
+# ---------------------------------------------------------------------------
+
+def make_companies(n: int, seed: int = 0) -> List[Tuple[str, str]]:
+    """
+    (company name, ticker) pairs, deterministic for a given seed.
+    """
+    rng = np.random.default_rng(seed)
+    syllables = ["al", "bor", "cen", "dra", "el", "fin", "gal", "hex", "ion", "jor", "kal", "lum", "mer", "nov",
+                 "or", "pra", "quin", "ros", "sol", "tek", "ul", "ver", "wex", "xan", "yor", "zen"]
+    suffixes = ["Corp.", "Inc.", "Holdings", "Group", "Industries", "Systems"]
+    companies, seen = [], set()
+    while len(companies) < n:
+        stem = "".join(rng.choice(syllables, size=rng.integers(2, 4))).capitalize()
+        if stem in seen:
+            continue
+        seen.add(stem)
+        companies.append((f"{stem} {rng.choice(suffixes)}", stem[:4].upper()))
+    return companies
+
+
+def make_corpus(n_docs: int, n_companies: int = 500, words_per_doc: int = 60, vocab_size: int = 20000,
+                seed: int = 0, duplicate_fraction: float = 0.0) -> Tuple[List[Dict[str, Any]], List[Tuple[str, str]]]:
+    """
+    Synthetic filing excerpts: a header sentence naming company, filing type, period and metric values,
+    followed by Zipf-distributed filler words. Returns (corpus, companies).
+    duplicate_fraction: Share of documents replaced by a near-copy (one word appended) of another document,
+                        as boilerplate repeated across filings.
+    """
+    rng = np.random.default_rng(seed)
+    companies = make_companies(n_companies, seed)
+    vocab = np.array([f"w{i}" for i in range(vocab_size)])
+    company_idx = rng.integers(0, n_companies, n_docs)
+    years = rng.choice(YEARS, n_docs)
+    quarters = rng.integers(1, 5, n_docs)
+    filings = rng.choice(FILING_TYPES, n_docs)
+    metric_idx = rng.integers(0, len(METRICS), (n_docs, 2))
+    values = rng.uniform(0.1, 500.0, (n_docs, 2))
+    filler = vocab[np.minimum(rng.zipf(1.3, (n_docs, words_per_doc)) - 1, vocab_size - 1)]
+
+    corpus = []
+    for i in range(n_docs):
+        name, _ = companies[company_idx[i]]
+        period = f"Q{quarters[i]} {years[i]}" if filings[i] == "10-Q" else f"FY{years[i]}"
+        text = (f"{name} {filings[i]} {period}: {METRICS[metric_idx[i, 0]]} was ${values[i, 0]:.1f} million and "
+                f"{METRICS[metric_idx[i, 1]]} was {values[i, 1]:.1f}. " + " ".join(filler[i]))
+        corpus.append({"id": f"doc{i}", "text": text})
+    if duplicate_fraction:
+        dup_rng = np.random.default_rng(seed + 7)
+        order = dup_rng.permutation(n_docs)
+        n_dup = int(n_docs * duplicate_fraction)
+        for i, source in zip(order[:n_dup], dup_rng.choice(order[n_dup:], n_dup)):
+            corpus[i]["text"] = corpus[source]["text"] + " restated"
+    return corpus, companies
+
+
+def make_queries(corpus: List[Dict[str, Any]], companies: List[Tuple[str, str]], n_queries: int,
+                 seed: int = 1) -> List[Tuple[str, str]]:
+    """
+    (query, source doc id) pairs, each asking about the company / metric / period of one corpus document.
+    """
+    rng = np.random.default_rng(seed)
+    tickers = dict(companies)
+    queries = []
+    for doc_idx in rng.integers(0, len(corpus), n_queries):
+        doc = corpus[doc_idx]
+        header = doc["text"].split(":")[0]
+        name = next(n for n, _ in companies if header.startswith(n))
+        year = header.split()[-1][-4:]
+        quarter = header.split()[-2][1] if header.split()[-2].startswith("Q") else "4"
+        metric = doc["text"].split(": ")[1].split(" was ")[0]
+        template = QUERY_TEMPLATES[int(rng.integers(0, len(QUERY_TEMPLATES)))]
+        queries.append((template.format(metric=metric, company=name, ticker=tickers[name], year=year,
+                                        quarter=quarter), doc["id"]))
+    return queries
+
+
+# ---------------------------------------------------------------------------
+# Benchmark
+# ---------------------------------------------------------------------------
+
+def run_scale(n_docs: int, args: argparse.Namespace) -> Dict[str, Any]:
+    """
+    Builds the system over a synthetic corpus of n_docs documents and times every stage.
+    Meant to run in a fresh process (see main) so peak RSS belongs to this scale only.
+    """
+    from advanced_rag_architecture import AdvancedReranker, FinanceRAGSystem, RerankStage
+    from financial_lexicon import FinancialLexicon
+
+    result: Dict[str, Any] = {"n_docs": n_docs, "stages": {}}
+    start = time.perf_counter()
+    corpus, companies = make_corpus(n_docs, n_companies=args.companies, words_per_doc=args.words_per_doc,
+                                    seed=args.seed, duplicate_fraction=args.duplicate_fraction)
+    queries = make_queries(corpus, companies, args.queries, seed=args.seed + 1)
+    result["corpus_generation_s"] = time.perf_counter() - start
+    result["rss_after_corpus_mb"] = _peak_rss_mb()
+
+    lexicon = FinancialLexicon()
+    for name, ticker in companies:
+        lexicon.add_entity(name, [ticker])
+
+    store_dir = tempfile.mkdtemp(prefix="rag_bench_")
+    try:
+        if args.late_interaction:
+            from late_interaction import LateInteractionReranker
+            reranker = LateInteractionReranker(model_name=args.encoder, encoder=load_encoder(args.encoder),
+                                               store_dir=store_dir, batch_size=args.rerank_batch_size,
+                                               prune=None if args.late_interaction == "none" else args.late_interaction)
+        else:
+            reranker = AdvancedReranker(model_name=args.reranker, batch_size=args.rerank_batch_size,
+                                        model=load_reranker_model(args.reranker, args.rerank_cost_ms))
+        system = FinanceRAGSystem(
+            embedding_store_dir=store_dir, lexicon=lexicon, embedding_model_name=args.encoder,
+            encoder=load_encoder(args.encoder), dense_index=args.dense_index,
+            dense_index_params=json.loads(args.dense_index_params) if args.dense_index_params else None,
+            rerank_stages=[RerankStage(model_name=args.reranker, candidates=args.rerank_candidates,
+                                       batch_size=args.rerank_batch_size, reranker=reranker)],
+            dedup_threshold=args.dedup_threshold)
+        retriever = system.retriever
+
+        start = time.perf_counter()
+        system.index_data(corpus)
+        build_s = time.perf_counter() - start
+        bm25_bytes = retriever.bm25.nbytes
+        metadata_bytes = sum(rows.nbytes for values in retriever.metadata_index.postings.values()
+                             for rows in values.values())
+        result["stages"]["index"] = {
+            "build_s": build_s,
+            "build_s_by_component": dict(retriever.build_seconds),
+            "indexed_docs": retriever.num_docs,
+            "peak_rss_mb": _peak_rss_mb(),
+            "disk_bytes": {"embedding_store": _dir_size(retriever.embedding_store.path),
+                           "document_store": _dir_size(retriever.corpus_texts.path)},
+            "memory_bytes": {"bm25": bm25_bytes, "metadata": metadata_bytes,
+                             "dense_index": retriever.dense_index.nbytes},
+        }
+
+        # Warm-up (first-call allocations, lazy lexicon compile)
+        for query, _ in queries[:min(5, len(queries))]:
+            system.answer(query)
+
+        retrieve_ms, rerank_ms, answer_ms, rerank_pairs = [], [], [], []
+        hits = 0
+        for query, source_id in queries:
+            spans = system.query_processor.extract_query_spans(query)
+            filters, strict = system._filters(query, None)
+            start = time.perf_counter()
+            docs = retriever.retrieve(query, query_spans=spans, top_k=system.candidates,
+                                      filters=filters, strict_filters=strict)
+            retrieve_ms.append(1000 * (time.perf_counter() - start))
+            docs = system._rerank_candidates(docs)
+            rerank_pairs.append(len(docs))
+            start = time.perf_counter()
+            top = system.reranker.rerank(query, docs, top_k=10)
+            rerank_ms.append(1000 * (time.perf_counter() - start))
+            hits += any(doc.doc_id == source_id or source_id in doc.duplicate_ids for doc in top)
+        stage_ms: Dict[str, List[float]] = {}
+        stage_candidates: Dict[str, List[float]] = {}
+        for query, _ in queries:
+            start = time.perf_counter()
+            traced = system.answer(query)
+            answer_ms.append(1000 * (time.perf_counter() - start))
+            for name in {s.name for s in traced.trace.stages}:
+                stage_ms.setdefault(name, []).append(traced.trace.stage_ms(name))
+            for s in traced.trace.stages:
+                if "candidates" in s.attrs:
+                    stage_candidates.setdefault(s.name, []).append(s.attrs["candidates"])
+
+        start = time.perf_counter()
+        system.answer_batch([q for q, _ in queries], batch_size=args.batch_size)
+        batch_s = time.perf_counter() - start
+
+        result["stages"]["retrieve"] = {**_percentiles(retrieve_ms), "peak_rss_mb": _peak_rss_mb()}
+        result["stages"]["rerank"] = {**_percentiles(rerank_ms), "candidates": args.rerank_candidates,
+                                      "mean_pairs": float(np.mean(rerank_pairs)) if rerank_pairs else None,
+                                      "peak_rss_mb": _peak_rss_mb()}
+        result["stages"]["answer"] = {
+            **_percentiles(answer_ms), "peak_rss_mb": _peak_rss_mb(),
+            # Per-stage breakdown from the traces attached to answer() results
+            "by_stage": {name: {**_percentiles(ms), "mean_candidates": float(np.mean(stage_candidates[name]))
+                                if name in stage_candidates else None}
+                         for name, ms in stage_ms.items()},
+        }
+        result["stages"]["answer_batch"] = {"queries_per_s": len(queries) / batch_s if batch_s else None,
+                                            "batch_size": args.batch_size, "peak_rss_mb": _peak_rss_mb()}
+        result["source_doc_in_top10"] = hits / len(queries) if queries else None
+        result["reranker"] = system.reranker.stats()
+    finally:
+        shutil.rmtree(store_dir, ignore_errors=True)
+    result["peak_rss_mb"] = _peak_rss_mb()
+    return result
+
+
+STARTUP_PHASES = ["import", "construct", "reopen", "first_answer"]
+HEAVY_MODULES = ["torch", "transformers", "sentence_transformers"]
+
+
+def run_startup_phase(phase: str, store_dir: str, args: argparse.Namespace) -> Dict[str, Any]:
+    """
+    One cold-start phase, timed from a fresh interpreter (see main). Each phase repeats the previous ones:
+        import        import advanced_rag_architecture
+        construct     FinanceRAGSystem() with the configured model names; no model may be loaded
+        reopen        index_data() over a corpus whose embeddings are already in store_dir, then BM25 and
+                      span-extraction queries; still no model may be loaded
+        first_answer  one answer() through the encoder and reranker
+    The 'prepare' phase fills store_dir first.
+    """
+    import model_registry
+
+    result: Dict[str, Any] = {"phase": phase, "seconds": {}}
+    if phase in ("prepare", "reopen", "first_answer"):
+        corpus, companies = make_corpus(args.startup_docs, n_companies=args.companies,
+                                        words_per_doc=args.words_per_doc, seed=args.seed)
+        query = make_queries(corpus, companies, 1, seed=args.seed + 1)[0][0]
+    if phase in ("prepare", "first_answer"):
+        # Models are resolved by name through the registry, as they would be without prebuilt instances
+        model_registry.register(ENCODER, args.encoder, load_encoder(args.encoder))
+        model_registry.register(CROSS_ENCODER, args.reranker, load_reranker_model(args.reranker, 0.0))
+    phases = ["prepare"] if phase == "prepare" else STARTUP_PHASES[:STARTUP_PHASES.index(phase) + 1]
+
+    start = time.perf_counter()
+    from advanced_rag_architecture import FinanceRAGSystem, RerankStage
+    result["seconds"]["import"] = time.perf_counter() - start
+    if phases != ["import"]:
+        start = time.perf_counter()
+        system = FinanceRAGSystem(embedding_store_dir=store_dir, embedding_model_name=args.encoder,
+                                  rerank_stages=[RerankStage(model_name=args.reranker, candidates=50)])
+        result["seconds"]["construct"] = time.perf_counter() - start
+    if "reopen" in phases or phase == "prepare":
+        start = time.perf_counter()
+        system.index_data(corpus)
+        result["seconds"]["index_data"] = time.perf_counter() - start
+        start = time.perf_counter()
+        scores = system.retriever.bm25.get_scores(system.retriever._tokenize(query))
+        system.retriever.corpus_texts[int(np.argmax(scores))]
+        result["seconds"]["bm25_query"] = time.perf_counter() - start
+        start = time.perf_counter()
+        system.query_processor.extract_typed_spans(query)
+        result["seconds"]["span_extraction"] = time.perf_counter() - start
+    if "first_answer" in phases:
+        start = time.perf_counter()
+        system.answer(query)
+        result["seconds"]["first_answer"] = time.perf_counter() - start
+    result["total_s"] = sum(result["seconds"].values())
+    result["models_loaded"] = [f"{kind}:{name}" for kind, name in model_registry.loaded()]
+    result["heavy_modules"] = [name for name in HEAVY_MODULES if name in sys.modules]
+    result["peak_rss_mb"] = _peak_rss_mb()
+    return result
+
+
+def run_startup(argv: List[str], args: argparse.Namespace) -> List[Dict[str, Any]]:
+    """
+    Runs every startup phase in its own interpreter; wall_s includes interpreter startup.
+    """
+    store_dir = tempfile.mkdtemp(prefix="rag_startup_")
+    results = []
+    try:
+        for phase in ["prepare"] + STARTUP_PHASES:
+            start = time.perf_counter()
+            proc = subprocess.run([sys.executable, os.path.abspath(__file__), *argv, "--startup-phase", phase,
+                                   "--startup-store", store_dir], capture_output=True, text=True)
+            wall_s = time.perf_counter() - start
+            if proc.returncode != 0:
+                print(proc.stderr[-2000:])
+                results.append({"phase": phase, "error": proc.stderr.strip().splitlines()[-1:]})
+                continue
+            result = {**json.loads(proc.stdout.strip().splitlines()[-1]), "wall_s": wall_s}
+            if phase != "prepare":
+                results.append(result)
+                print(f"  {phase:<13} {result['total_s'] * 1000:8.1f}ms in-process | {wall_s * 1000:8.1f}ms wall | "
+                      f"models loaded: {', '.join(result['models_loaded']) or 'none'}")
+    finally:
+        shutil.rmtree(store_dir, ignore_errors=True)
+    return results
+
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Offline scale benchmark for the hybrid retrieval pipeline.")
+    parser.add_argument("--scales", type=int, nargs="+", default=DEFAULT_SCALES, help="Corpus sizes to benchmark.")
+    parser.add_argument("--queries", type=int, default=200, help="Timed queries per scale.")
+    parser.add_argument("--companies", type=int, default=500)
+    parser.add_argument("--words-per-doc", type=int, default=60)
+    parser.add_argument("--duplicate-fraction", type=float, default=0.0,
+                        help="Share of the corpus replaced by near-copies of other documents.")
+    parser.add_argument("--dedup-threshold", type=float, default=None,
+                        help="Fold near-duplicates at index time (see near_duplicates.py), e.g. 0.8.")
+    parser.add_argument("--encoder", default="stub", help="'stub' or a locally cached SentenceTransformer name.")
+    parser.add_argument("--reranker", default="stub", help="'stub' or a locally cached CrossEncoder name.")
+    parser.add_argument("--rerank-cost-ms", type=float, default=0.0, help="Simulated stub reranker cost per pair.")
+    parser.add_argument("--rerank-candidates", type=int, default=200)
+    parser.add_argument("--late-interaction", default=None, choices=["none", "exact", "centroid"],
+                        help="Rerank with late interaction over the encoder's token embeddings instead of the "
+                             "cross-encoder, with this pruning mode.")
+    parser.add_argument("--rerank-batch-size", type=int, default=32)
+    parser.add_argument("--dense-index", default="flat", choices=["flat", "ivf", "graph", "int8", "binary"])
+    parser.add_argument("--dense-index-params", default=None, help='JSON, e.g. \'{"n_lists": 1024, "n_probe": 16}\'')
+    parser.add_argument("--batch-size", type=int, default=32, help="Batch size for the answer_batch throughput run.")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default="benchmark_results.json")
+    parser.add_argument("--startup", action="store_true", help="Benchmark cold-start time instead of the scales.")
+    parser.add_argument("--startup-docs", type=int, default=2000, help="Corpus size of the startup benchmark.")
+    parser.add_argument("--single-scale", type=int, default=None, help=argparse.SUPPRESS)
+    parser.add_argument("--startup-phase", default=None, help=argparse.SUPPRESS)
+    parser.add_argument("--startup-store", default=None, help=argparse.SUPPRESS)
+    return parser.parse_args(argv)
+
+
+def main(argv: Optional[List[str]] = None):
+    args = parse_args(argv)
+    if args.single_scale is not None:
+        # Child process: one scale, result as JSON on stdout
+        logging.disable(logging.INFO)
+        os.environ.setdefault("TQDM_DISABLE", "1")
+        print(json.dumps(run_scale(args.single_scale, args)))
+        return
+    if args.startup_phase is not None:
+        logging.disable(logging.INFO)
+        os.environ.setdefault("TQDM_DISABLE", "1")
+        print(json.dumps(run_startup_phase(args.startup_phase, args.startup_store, args)))
+        return
+
+    argv = list(sys.argv[1:] if argv is None else argv)
+    report = {
+        "commit": _git_commit(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "config": {k: v for k, v in vars(args).items()
+                   if k not in ("single_scale", "startup_phase", "startup_store", "output")},
+        "results": [],
+    }
+    if args.startup:
+        print(f"Benchmarking startup ({args.startup_docs} documents)...")
+        report["startup"] = run_startup(argv, args)
+        args.scales = []
+    for n_docs in args.scales:
+        print(f"Benchmarking {n_docs} documents...")
+        proc = subprocess.run([sys.executable, os.path.abspath(__file__), *argv, "--single-scale", str(n_docs)],
+                              capture_output=True, text=True)
+        if proc.returncode != 0:
+            print(proc.stderr[-2000:])
+            report["results"].append({"n_docs": n_docs, "error": proc.stderr.strip().splitlines()[-1:]})
+            continue
+        scale_result = json.loads(proc.stdout.strip().splitlines()[-1])
+        report["results"].append(scale_result)
+        stages = scale_result["stages"]
+        print(f"  build {stages['index']['build_s']:.1f}s | retrieve p50 {stages['retrieve']['p50_ms']:.1f}ms "
+              f"p99 {stages['retrieve']['p99_ms']:.1f}ms | answer p50 {stages['answer']['p50_ms']:.1f}ms | "
+              f"peak RSS {scale_result['peak_rss_mb']:.0f}MB")
+
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    print(f"Results written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
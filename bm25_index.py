@@ -0,0 +1,287 @@
+import logging
+import math
+from array import array
+import numpy as np
+from dataclasses import dataclass
+from scipy import sparse
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class BM25Stats:
+    """
+    Corpus statistics BM25 depends on: document count, total length and per-term document frequency.
+    doc_freq keeps first-occurrence order, so merging the stats of consecutive corpus partitions reproduces
+    the term order (and therefore the idf floor) of an index built over the whole corpus.
+    """
+    corpus_size: int
+    total_len: int
+    doc_freq: Dict[str, int]
+
+    @classmethod
+    def from_corpus(cls, corpus: Iterable[Sequence[str]]) -> "BM25Stats":
+        doc_freq: Dict[str, int] = {}
+        corpus_size, total_len = 0, 0
+        for document in corpus:
+            corpus_size += 1
+            total_len += len(document)
+            for token in dict.fromkeys(document):
+                doc_freq[token] = doc_freq.get(token, 0) + 1
+        return cls(corpus_size, total_len, doc_freq)
+
+    @classmethod
+    def merge(cls, parts: Iterable["BM25Stats"]) -> "BM25Stats":
+        """
+        Global statistics of consecutive partitions, given in corpus order.
+        """
+        corpus_size, total_len, doc_freq = 0, 0, {}
+        for part in parts:
+            corpus_size += part.corpus_size
+            total_len += part.total_len
+            for token, df in part.doc_freq.items():
+                doc_freq[token] = doc_freq.get(token, 0) + df
+        return cls(corpus_size, total_len, doc_freq)
+
+    @property
+    def avgdl(self) -> float:
+        return float(self.total_len) / self.corpus_size
+
+
+class BM25Index:
+    """
+    Okapi BM25 over a CSR/CSC term-document matrix with precomputed term weights.
+
+    Scores are identical to rank_bm25.BM25Okapi for the same tokens (same k1/b/epsilon and the
+    same epsilon * average_idf floor for negative idf), but a query only touches the postings of
+    its own terms instead of looping over every document in Python.
+
+    The index is mutable: add_documents() appends a segment of term frequencies and delete_documents()
+    tombstones rows. Document frequencies and lengths are maintained over live rows only, and the weights
+    of every segment are recomputed lazily on the next query, so scores equal those of an index built over
+    the live documents alone. Deleted rows keep a score slot (callers exclude them) until the index is rebuilt.
+
+    corpus: Tokenized documents; any iterable, so documents can be tokenized one at a time. Tokens are interned
+            into int32 term ids as they are read, no token list is kept.
+    global_stats: Statistics of a larger corpus this one is a shard of (see BM25Stats.merge). idf and avgdl
+                  are then taken from them, so shard scores equal the scores of one index over the whole corpus.
+    """
+    def __init__(self, corpus: Iterable[Sequence[str]], k1: float = 1.5, b: float = 0.75, epsilon: float = 0.25,
+                 global_stats: Optional[BM25Stats] = None):
+        self.k1 = k1
+        self.b = b
+        self.epsilon = epsilon
+        self.global_stats = global_stats
+        self.vocab: Dict[str, int] = {}
+        self.doc_len = np.zeros(0, dtype=np.int64)
+        self.live = np.zeros(0, dtype=bool)
+        self.doc_freq = np.zeros(0, dtype=np.int64)  # per term, over live rows
+        self.total_len = 0  # over live rows
+        self._segments: List[Tuple[int, sparse.csc_matrix]] = []  # (first row, term frequencies)
+        self._segment_weights: List[sparse.csc_matrix] = []
+        self._stale = True
+        self._append(corpus)
+        if self.corpus_size == 0:
+            raise ValueError("Cannot build a BM25 index over an empty corpus.")
+        self.refresh()
+        logger.info(f"BM25 index: {self.corpus_size} docs, {len(self.vocab)} terms, {self.num_postings} postings.")
+
+    @property
+    def corpus_size(self) -> int:
+        """
+        Number of rows (score slots), including deleted ones.
+        """
+        return len(self.doc_len)
+
+    @property
+    def num_live(self) -> int:
+        return int(self.live.sum())
+
+    @property
+    def num_segments(self) -> int:
+        return len(self._segments)
+
+    @property
+    def num_postings(self) -> int:
+        return sum(tf.nnz for _, tf in self._segments)
+
+    @property
+    def nbytes(self) -> int:
+        self.refresh()
+        return sum(m.data.nbytes + m.indices.nbytes + m.indptr.nbytes
+                   for m in [tf for _, tf in self._segments] + self._segment_weights)
+
+    def _append(self, corpus: Iterable[Sequence[str]]) -> np.ndarray:
+        start = self.corpus_size
+
+        # 1. Intern tokens as int32 term ids (the only per-token Python loop)
+        term_ids = array("i")
+        lengths = array("q")
+        for document in corpus:
+            term_ids.extend([self.vocab.setdefault(token, len(self.vocab)) for token in document])
+            lengths.append(len(document))
+        doc_len = np.frombuffer(lengths, dtype=np.int64) if lengths else np.zeros(0, dtype=np.int64)
+        n_docs = len(doc_len)
+        if n_docs == 0:
+            return np.zeros(0, dtype=np.int64)
+
+        # 2. Term frequencies as a (n_docs, n_terms) int32 matrix; duplicates are summed by tocsc()
+        rows = np.repeat(np.arange(n_docs, dtype=np.int32), doc_len)
+        cols = np.frombuffer(term_ids, dtype=np.int32) if term_ids else np.zeros(0, dtype=np.int32)
+        tf = sparse.coo_matrix((np.ones(len(cols), dtype=np.int32), (rows, cols)),
+                               shape=(n_docs, len(self.vocab))).tocsc()
+        tf.sum_duplicates()
+
+        self.doc_len = np.concatenate([self.doc_len, doc_len])
+        self.live = np.concatenate([self.live, np.ones(n_docs, dtype=bool)])
+        self.doc_freq = np.concatenate([self.doc_freq, np.zeros(len(self.vocab) - len(self.doc_freq), dtype=np.int64)])
+        self.doc_freq[:tf.shape[1]] += np.diff(tf.indptr)
+        self.total_len += int(doc_len.sum())
+        self._segments.append((start, tf))
+        self._stale = True
+        return np.arange(start, start + n_docs)
+
+    def add_documents(self, corpus: Iterable[Sequence[str]]) -> np.ndarray:
+        """
+        Appends tokenized documents as a new segment; returns their row ids.
+        """
+        if self.global_stats is not None:
+            raise ValueError("A shard index built with global_stats cannot be modified.")
+        return self._append(corpus)
+
+    def delete_documents(self, rows: Sequence[int]):
+        """
+        Tombstones rows: they no longer count towards document frequencies or the average length.
+        """
+        if self.global_stats is not None:
+            raise ValueError("A shard index built with global_stats cannot be modified.")
+        rows = np.unique(np.asarray(rows, dtype=np.int64))
+        rows = rows[self.live[rows]]
+        if len(rows) == 0:
+            return
+        for start, tf in self._segments:
+            local = rows[(rows >= start) & (rows < start + tf.shape[0])] - start
+            if len(local):
+                terms = tf[local].tocoo().col
+                self.doc_freq[:tf.shape[1]] -= np.bincount(terms, minlength=tf.shape[1])
+        self.total_len -= int(self.doc_len[rows].sum())
+        self.live[rows] = False
+        self._stale = True
+
+    def refresh(self):
+        """
+        Recomputes idf and per-posting weights from the live statistics; a no-op unless the index changed.
+        Queries call it on demand, concurrent readers should call it once after a batch of changes.
+        """
+        if not self._stale:
+            return
+        if self.global_stats is not None:
+            self.avgdl = self.global_stats.avgdl
+            global_idf = self._calc_idf(np.fromiter(self.global_stats.doc_freq.values(), dtype=np.int64,
+                                                    count=len(self.global_stats.doc_freq)),
+                                        self.global_stats.corpus_size)
+            position = {token: i for i, token in enumerate(self.global_stats.doc_freq)}
+            self.idf = global_idf[[position[token] for token in self.vocab]]
+        else:
+            num_live = self.num_live
+            self.avgdl = float(self.total_len) / num_live if num_live else 0.0
+            # Terms that only occur in deleted rows are not part of the live vocabulary
+            present = np.flatnonzero(self.doc_freq > 0)
+            self.idf = np.zeros(len(self.vocab), dtype=np.float64)
+            self.idf[present] = self._calc_idf(self.doc_freq[present], num_live)
+        self._segment_weights = [self._calc_weights(tf, start) for start, tf in self._segments]
+        self._stale = False
+
+    def _calc_idf(self, doc_freq: np.ndarray, corpus_size: int) -> np.ndarray:
+        if len(doc_freq) == 0:
+            return np.zeros(0, dtype=np.float64)
+        idf = np.array([math.log(corpus_size - f + 0.5) - math.log(f + 0.5) for f in doc_freq.tolist()])
+        self.average_idf = sum(idf.tolist()) / len(idf)
+        idf[idf < 0] = self.epsilon * self.average_idf
+        return idf
+
+    def _calc_weights(self, tf: sparse.csc_matrix, start: int = 0) -> sparse.csc_matrix:
+        # Same expression (and evaluation order) as BM25Okapi.get_scores, evaluated once per posting
+        weights = tf.astype(np.float64)
+        q_freq = weights.data
+        term_of_posting = np.repeat(np.arange(tf.shape[1]), np.diff(tf.indptr))
+        doc_len = self.doc_len[start + tf.indices]
+        weights.data = self.idf[term_of_posting] * (q_freq * (self.k1 + 1) /
+                                                    (q_freq + self.k1 * (1 - self.b + self.b * doc_len / self.avgdl)))
+        return weights
+
+    @property
+    def num_terms(self) -> int:
+        return len(self.vocab)
+
+    def get_scores(self, query: Sequence[str], doc_ids: Optional[np.ndarray] = None) -> np.ndarray:
+        """
+        BM25 scores of one tokenized query against every row,
+        or only against doc_ids (sorted row ids) when given.
+        """
+        self.refresh()
+        if doc_ids is not None:
+            return self._get_subset_scores(query, doc_ids)
+        scores = np.zeros(self.corpus_size)
+        term_ids = [self.vocab.get(token) for token in query]
+        for (start, _), weights in zip(self._segments, self._segment_weights):
+            indptr, indices, data = weights.indptr, weights.indices, weights.data
+            for t in term_ids:
+                if t is None or t >= weights.shape[1]:
+                    continue
+                lo, hi = indptr[t], indptr[t + 1]
+                scores[start + indices[lo:hi]] += data[lo:hi]
+        return scores
+
+    def _get_subset_scores(self, query: Sequence[str], doc_ids: np.ndarray) -> np.ndarray:
+        # Postings are sorted by row, so each term's hits inside the subset are found by binary search
+        doc_ids = np.asarray(doc_ids)
+        scores = np.zeros(len(doc_ids))
+        if len(doc_ids) == 0:
+            return scores
+        term_ids = [self.vocab.get(token) for token in query]
+        for (start, tf), weights in zip(self._segments, self._segment_weights):
+            first, last = np.searchsorted(doc_ids, [start, start + tf.shape[0]])
+            if first == last:
+                continue
+            local_ids = doc_ids[first:last] - start
+            indptr, indices, data = weights.indptr, weights.indices, weights.data
+            for t in term_ids:
+                if t is None or t >= weights.shape[1]:
+                    continue
+                lo, hi = indptr[t], indptr[t + 1]
+                postings = indices[lo:hi]
+                pos = np.minimum(np.searchsorted(local_ids, postings), len(local_ids) - 1)
+                hit = local_ids[pos] == postings
+                scores[first + pos[hit]] += data[lo:hi][hit]
+        return scores
+
+    def get_batch_scores(self, query: Sequence[str], doc_ids: Sequence[int]) -> List[float]:
+        """
+        BM25 scores between one query and a subset of documents (BM25Okapi-compatible).
+        """
+        doc_ids = np.asarray(doc_ids, dtype=np.int64)
+        return self.get_scores(query)[doc_ids].tolist()
+
+    def query_matrix(self, queries: Sequence[Sequence[str]]) -> sparse.csr_matrix:
+        """
+        Bag-of-terms counts of tokenized queries as a (n_queries, n_terms) CSR matrix.
+        """
+        rows, cols = [], []
+        for i, query in enumerate(queries):
+            for token in query:
+                t = self.vocab.get(token)
+                if t is not None:
+                    rows.append(i)
+                    cols.append(t)
+        return sparse.csr_matrix((np.ones(len(cols)), (rows, cols)), shape=(len(queries), self.num_terms))
+
+    def get_scores_batch(self, queries: Sequence[Sequence[str]]) -> np.ndarray:
+        """
+        Scores a batch of tokenized queries with one sparse matrix product per segment.
+        Returns a dense (n_queries, n_docs) array.
+        """
+        self.refresh()
+        q = self.query_matrix(queries)
+        return np.hstack([(q[:, :weights.shape[1]] @ weights.T).toarray() for weights in self._segment_weights])
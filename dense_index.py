@@ -0,0 +1,518 @@
+import heapq
+import json
+import logging
+import os
+import time
+import numpy as np
+from typing import Dict, Optional, Tuple
+
+from embedding_store import dot_blocks
+
+logger = logging.getLogger(__name__)
+
+
+def top_k_rows(scores: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Row-wise top-k of a (n_queries, n) score matrix using argpartition, sorted by descending score.
+    Returns (scores, indices), both (n_queries, min(k, n)).
+    """
+    k = min(k, scores.shape[1])
+    if k == 0:
+        return scores[:, :0], np.zeros((scores.shape[0], 0), dtype=np.int64)
+    part = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+    part_scores = np.take_along_axis(scores, part, axis=1)
+    order = np.argsort(-part_scores, axis=1, kind="stable")
+    return np.take_along_axis(part_scores, order, axis=1), np.take_along_axis(part, order, axis=1)
+
+
+def _as_float32(rows: np.ndarray) -> np.ndarray:
+    return np.asarray(rows, dtype=np.float32)
+
+
+class DenseIndex:
+    """
+    Base class of the dense search backends. All backends search L2-normalized vectors by inner product
+    (= cosine similarity) and read vectors from the corpus embedding matrix (possibly memory-mapped),
+    so an index only stores its own structure, not a second copy of the vectors.
+    """
+    kind = "base"
+    exact = False
+    # Parameters that only affect search, so they can be changed on a loaded index without a rebuild
+    query_params = ()
+
+    def __init__(self):
+        self.embeddings = None
+
+    def build(self, embeddings: np.ndarray) -> "DenseIndex":
+        self.embeddings = embeddings
+        return self
+
+    def search(self, queries: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        queries: (n_queries, dim). Returns (scores, ids) of shape (n_queries, k), best first.
+        Rows with fewer than k hits are padded with score -inf and id -1.
+        """
+        raise NotImplementedError()
+
+    def params(self) -> Dict:
+        return {}
+
+    def _arrays(self) -> Dict[str, np.ndarray]:
+        return {}
+
+    @property
+    def nbytes(self) -> int:
+        """
+        Memory held by the index structure itself (vectors read from the embedding matrix not included).
+        """
+        return sum(int(a.nbytes) for a in self._arrays().values() if a is not None)
+
+    def save(self, path: str, fingerprint: Optional[str] = None):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        meta = {"kind": self.kind, "params": self.params(), "n_rows": int(self.embeddings.shape[0]),
+                "fingerprint": fingerprint}
+        # Per-process temporary name: parallel workers may save the same index at once
+        tmp = f"{path}.{os.getpid()}.tmp.npz"
+        np.savez(tmp, meta=np.array(json.dumps(meta)), **self._arrays())
+        os.replace(tmp, path)
+
+    @staticmethod
+    def _pad(scores: np.ndarray, ids: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        out_scores = np.full(k, -np.inf, dtype=np.float32)
+        out_ids = np.full(k, -1, dtype=np.int64)
+        out_scores[:len(scores)] = scores
+        out_ids[:len(ids)] = ids
+        return out_scores, out_ids
+
+
+class FlatIndex(DenseIndex):
+    """
+    Exact search: scores every corpus vector. Default backend.
+    """
+    kind = "flat"
+    exact = True
+
+    def score_all(self, queries: np.ndarray) -> np.ndarray:
+        return dot_blocks(self.embeddings, queries)
+
+    def search(self, queries: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        queries = np.atleast_2d(queries)
+        scores, ids = top_k_rows(self.score_all(queries), k)
+        if scores.shape[1] < k:
+            padded = [self._pad(s, i, k) for s, i in zip(scores, ids)]
+            return np.stack([p[0] for p in padded]), np.stack([p[1] for p in padded])
+        return scores, ids
+
+
+def spherical_kmeans(vectors: np.ndarray, n_clusters: int, n_iter: int = 10, seed: int = 0) -> np.ndarray:
+    """
+    k-means on the unit sphere (assignment by inner product). Returns (n_clusters, dim) unit centroids.
+    """
+    rng = np.random.default_rng(seed)
+    centroids = vectors[rng.choice(len(vectors), n_clusters, replace=False)].copy()
+    for _ in range(n_iter):
+        assign = np.argmax(vectors @ centroids.T, axis=1)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assign, vectors)
+        counts = np.bincount(assign, minlength=n_clusters)
+        # Re-seed empty clusters with random points
+        empty = np.where(counts == 0)[0]
+        if len(empty):
+            sums[empty] = vectors[rng.choice(len(vectors), len(empty), replace=False)]
+        norms = np.linalg.norm(sums, axis=1, keepdims=True)
+        centroids = sums / np.maximum(norms, 1e-12)
+    return centroids.astype(np.float32)
+
+
+class IVFIndex(DenseIndex):
+    """
+    Inverted-file index: vectors are clustered with spherical k-means and a query only scores the
+    members of its n_probe nearest clusters.
+    Knobs: n_lists (clusters; default 4 * sqrt(N)), n_probe (recall/latency trade-off at query time).
+    """
+    kind = "ivf"
+    query_params = ("n_probe",)
+
+    def __init__(self, n_lists: Optional[int] = None, n_probe: int = 8, n_iter: int = 10,
+                 train_size: int = 100000, seed: int = 0, block_rows: int = 65536):
+        super().__init__()
+        self.n_lists = n_lists
+        self.n_probe = n_probe
+        self.n_iter = n_iter
+        self.train_size = train_size
+        self.seed = seed
+        self.block_rows = block_rows
+        self.centroids = None
+        self.list_offsets = None
+        self.list_ids = None
+
+    def params(self) -> Dict:
+        return {"n_lists": self.n_lists, "n_probe": self.n_probe, "n_iter": self.n_iter,
+                "train_size": self.train_size, "seed": self.seed}
+
+    def _arrays(self) -> Dict[str, np.ndarray]:
+        return {"centroids": self.centroids, "list_offsets": self.list_offsets, "list_ids": self.list_ids}
+
+    def assign(self, vectors: np.ndarray) -> np.ndarray:
+        """
+        Nearest centroid of every row, computed block by block.
+        """
+        assign = np.empty(len(vectors), dtype=np.int64)
+        for start in range(0, len(vectors), self.block_rows):
+            block = _as_float32(vectors[start:start + self.block_rows])
+            assign[start:start + len(block)] = np.argmax(block @ self.centroids.T, axis=1)
+        return assign
+
+    def build(self, embeddings: np.ndarray) -> "IVFIndex":
+        super().build(embeddings)
+        n = embeddings.shape[0]
+        if self.n_lists is None:
+            self.n_lists = max(1, int(4 * np.sqrt(n)))
+        rng = np.random.default_rng(self.seed)
+        sample = np.sort(rng.choice(n, min(n, max(self.train_size, self.n_lists)), replace=False))
+        self.n_lists = min(self.n_lists, len(sample))
+        self.centroids = spherical_kmeans(_as_float32(embeddings[sample]), self.n_lists, self.n_iter, self.seed)
+
+        assign = self.assign(embeddings)
+        self.list_ids = np.argsort(assign, kind="stable").astype(np.int64)
+        self.list_offsets = np.zeros(self.n_lists + 1, dtype=np.int64)
+        np.cumsum(np.bincount(assign, minlength=self.n_lists), out=self.list_offsets[1:])
+        logger.info(f"IVF index built: {n} vectors in {self.n_lists} lists.")
+        return self
+
+    def probe_lists(self, queries: np.ndarray, n_probe: Optional[int] = None) -> np.ndarray:
+        n_probe = min(n_probe or self.n_probe, self.n_lists)
+        return top_k_rows(np.atleast_2d(queries) @ self.centroids.T, n_probe)[1]
+
+    def candidates(self, lists: np.ndarray) -> np.ndarray:
+        return np.concatenate([self.list_ids[self.list_offsets[c]:self.list_offsets[c + 1]] for c in lists])
+
+    def search(self, queries: np.ndarray, k: int, n_probe: Optional[int] = None) -> Tuple[np.ndarray, np.ndarray]:
+        queries = _as_float32(np.atleast_2d(queries))
+        probes = self.probe_lists(queries, n_probe)
+        all_scores = np.empty((len(queries), k), dtype=np.float32)
+        all_ids = np.empty((len(queries), k), dtype=np.int64)
+        for i, q in enumerate(queries):
+            cand = np.sort(self.candidates(probes[i]))
+            scores = _as_float32(self.embeddings[cand]) @ q
+            top_scores, top = top_k_rows(scores[None, :], k)
+            all_scores[i], all_ids[i] = self._pad(top_scores[0], cand[top[0]], k)
+        return all_scores, all_ids
+
+
+class GraphIndex(DenseIndex):
+    """
+    Proximity-graph index (single-layer HNSW/NSW style).
+    Each vector keeps up to 2*M neighbours (its M nearest plus reverse edges); a query runs a
+    best-first beam search of width ef_search. Instead of HNSW's upper layers, the search starts from
+    the representatives of the entry_probe partitions whose centroids are closest to the query.
+    The neighbour lists are found with an internal IVF partition, so building stays sub-quadratic.
+    Knobs: M (graph degree, build time), ef_search (recall/latency trade-off at query time).
+    """
+    kind = "graph"
+    query_params = ("ef_search", "entry_probe")
+
+    def __init__(self, M: int = 16, ef_search: int = 64, build_probe: int = 4, entry_probe: int = 4,
+                 seed: int = 0):
+        super().__init__()
+        self.M = M
+        self.ef_search = ef_search
+        self.build_probe = build_probe
+        self.entry_probe = entry_probe
+        self.seed = seed
+        self.neighbors = None
+        self.entry_centroids = None
+        self.entry_points = None
+
+    def params(self) -> Dict:
+        return {"M": self.M, "ef_search": self.ef_search, "build_probe": self.build_probe,
+                "entry_probe": self.entry_probe, "seed": self.seed}
+
+    def _arrays(self) -> Dict[str, np.ndarray]:
+        return {"neighbors": self.neighbors, "entry_centroids": self.entry_centroids, "entry_points": self.entry_points}
+
+    def build(self, embeddings: np.ndarray) -> "GraphIndex":
+        super().build(embeddings)
+        n = embeddings.shape[0]
+        ivf = IVFIndex(n_probe=self.build_probe, seed=self.seed).build(embeddings)
+        M = min(self.M, n - 1)
+
+        # 1. M nearest neighbours of every vector, searched within the build_probe nearest lists of its cluster
+        knn = np.full((n, max(M, 0)), -1, dtype=np.int64)
+        knn_scores = np.full((n, max(M, 0)), -np.inf, dtype=np.float32)
+        cluster_probes = ivf.probe_lists(ivf.centroids, self.build_probe)
+        for c in range(ivf.n_lists):
+            members = ivf.list_ids[ivf.list_offsets[c]:ivf.list_offsets[c + 1]]
+            if len(members) == 0 or M == 0:
+                continue
+            pool = np.sort(ivf.candidates(cluster_probes[c]))
+            sims = _as_float32(embeddings[members]) @ _as_float32(embeddings[pool]).T
+            sims[members[:, None] == pool[None, :]] = -np.inf
+            top_scores, top = top_k_rows(sims, M)
+            knn[members, :top.shape[1]] = pool[top]
+            knn_scores[members, :top.shape[1]] = top_scores
+
+        # 2. Add reverse edges and keep the best 2*M neighbours per node
+        src = np.repeat(np.arange(n), knn.shape[1])
+        dst = knn.ravel()
+        sim = knn_scores.ravel()
+        valid = dst >= 0
+        src, dst, sim = np.concatenate([src[valid], dst[valid]]), np.concatenate([dst[valid], src[valid]]), \
+            np.concatenate([sim[valid], sim[valid]])
+        order = np.lexsort((dst, src))
+        src, dst, sim = src[order], dst[order], sim[order]
+        keep = np.ones(len(src), dtype=bool)
+        keep[1:] = (src[1:] != src[:-1]) | (dst[1:] != dst[:-1])
+        src, dst, sim = src[keep], dst[keep], sim[keep]
+        order = np.lexsort((-sim, src))
+        src, dst = src[order], dst[order]
+        starts = np.searchsorted(src, np.arange(n))
+        rank = np.arange(len(src)) - starts[src]
+        width = 2 * max(M, 1)
+        within = rank < width
+        self.neighbors = np.full((n, width), -1, dtype=np.int32)
+        self.neighbors[src[within], rank[within]] = dst[within]
+
+        # 3. Entry points: the member closest to each non-empty partition centroid
+        centroids, entries = [], []
+        for c in range(ivf.n_lists):
+            members = ivf.list_ids[ivf.list_offsets[c]:ivf.list_offsets[c + 1]]
+            if len(members):
+                centroids.append(ivf.centroids[c])
+                entries.append(members[np.argmax(_as_float32(embeddings[members]) @ ivf.centroids[c])])
+        self.entry_centroids = np.asarray(centroids, dtype=np.float32)
+        self.entry_points = np.asarray(entries, dtype=np.int64)
+        logger.info(f"Graph index built: {n} vectors, degree <= {width}.")
+        return self
+
+    def _search_one(self, q: np.ndarray, k: int, ef: int) -> Tuple[np.ndarray, np.ndarray]:
+        n_entry = min(self.entry_probe, len(self.entry_points))
+        entry = np.sort(self.entry_points[top_k_rows((self.entry_centroids @ q)[None, :], n_entry)[1][0]])
+        entry_scores = _as_float32(self.embeddings[entry]) @ q
+        visited = set(entry.tolist())
+        # candidates: max-heap on score; best: min-heap of the ef best found so far
+        candidates = [(-s, i) for s, i in zip(entry_scores.tolist(), entry.tolist())]
+        heapq.heapify(candidates)
+        best = [(s, i) for s, i in zip(entry_scores.tolist(), entry.tolist())]
+        heapq.heapify(best)
+        while candidates:
+            neg_score, node = heapq.heappop(candidates)
+            if len(best) >= ef and -neg_score < best[0][0]:
+                break
+            nbrs = [int(x) for x in self.neighbors[node] if x >= 0 and int(x) not in visited]
+            if not nbrs:
+                continue
+            visited.update(nbrs)
+            nbr_scores = _as_float32(self.embeddings[np.sort(nbrs)]) @ q
+            for s, i in zip(nbr_scores.tolist(), sorted(nbrs)):
+                if len(best) < ef or s > best[0][0]:
+                    heapq.heappush(candidates, (-s, i))
+                    heapq.heappush(best, (s, i))
+                    if len(best) > ef:
+                        heapq.heappop(best)
+        top = heapq.nlargest(k, best)
+        return self._pad(np.array([s for s, _ in top], dtype=np.float32),
+                         np.array([i for _, i in top], dtype=np.int64), k)
+
+    def search(self, queries: np.ndarray, k: int, ef_search: Optional[int] = None) -> Tuple[np.ndarray, np.ndarray]:
+        queries = _as_float32(np.atleast_2d(queries))
+        ef = max(ef_search or self.ef_search, k)
+        results = [self._search_one(q, k, ef) for q in queries]
+        return np.stack([r[0] for r in results]), np.stack([r[1] for r in results])
+
+
+class QuantizedIndex(DenseIndex):
+    """
+    Base class of the compressed-code backends: every vector is also stored as a compact code, a query scans
+    all codes with an approximate score, and only the best `rescore` candidates are rescored exactly against
+    the float vectors (memory-mapped from the embedding store, or in memory). The float matrix is then only
+    touched at those rows, so it can stay on disk while the codes are resident.
+    Knob: rescore (candidates rescored per query, at least k).
+    """
+    query_params = ("rescore",)
+
+    def __init__(self, rescore: int = 100, block_rows: int = 16384):
+        super().__init__()
+        self.rescore = rescore
+        self.block_rows = block_rows
+
+    def params(self) -> Dict:
+        return {"rescore": self.rescore}
+
+    def approx_scores(self, queries: np.ndarray) -> np.ndarray:
+        """
+        (n_queries, n) scores from the codes alone; only their order matters.
+        """
+        raise NotImplementedError()
+
+    def search(self, queries: np.ndarray, k: int, rescore: Optional[int] = None) -> Tuple[np.ndarray, np.ndarray]:
+        queries = _as_float32(np.atleast_2d(queries))
+        n_rescore = max(rescore or self.rescore, k)
+        _, cand_ids = top_k_rows(self.approx_scores(queries), n_rescore)
+        all_scores = np.empty((len(queries), k), dtype=np.float32)
+        all_ids = np.empty((len(queries), k), dtype=np.int64)
+        for i, q in enumerate(queries):
+            # Sorted rows: sequential reads when the float matrix is memory-mapped
+            cand = np.sort(cand_ids[i])
+            scores = _as_float32(self.embeddings[cand]) @ q
+            top_scores, top = top_k_rows(scores[None, :], k)
+            all_scores[i], all_ids[i] = self._pad(top_scores[0], cand[top[0]], k)
+        return all_scores, all_ids
+
+
+class Int8Index(QuantizedIndex):
+    """
+    Per-dimension scalar quantization: each dimension is mapped linearly from its [min, max] range over the
+    corpus onto int8, i.e. 1 byte per dimension (4x smaller than float32). Codes are scored by an inner product
+    with the query scaled per dimension, which ranks like the dot product with the dequantized vectors.
+    """
+    kind = "int8"
+
+    def __init__(self, rescore: int = 100, block_rows: int = 16384):
+        super().__init__(rescore, block_rows)
+        self.codes = None
+        self.offset = None
+        self.scale = None
+
+    def _arrays(self) -> Dict[str, np.ndarray]:
+        return {"codes": self.codes, "offset": self.offset, "scale": self.scale}
+
+    def build(self, embeddings: np.ndarray) -> "Int8Index":
+        super().build(embeddings)
+        n, dim = embeddings.shape
+        low = np.full(dim, np.inf, dtype=np.float32)
+        high = np.full(dim, -np.inf, dtype=np.float32)
+        for start in range(0, n, self.block_rows):
+            block = _as_float32(embeddings[start:start + self.block_rows])
+            low, high = np.minimum(low, block.min(axis=0)), np.maximum(high, block.max(axis=0))
+        self.offset = low
+        self.scale = np.maximum(high - low, 1e-12).astype(np.float32) / 255
+        self.codes = np.empty((n, dim), dtype=np.int8)
+        for start in range(0, n, self.block_rows):
+            block = _as_float32(embeddings[start:start + self.block_rows])
+            self.codes[start:start + len(block)] = np.clip(np.rint((block - self.offset) / self.scale), 0, 255) - 128
+        logger.info(f"int8 index built: {n} vectors, {self.codes.nbytes / 2 ** 20:.1f} MiB of codes.")
+        return self
+
+    def approx_scores(self, queries: np.ndarray) -> np.ndarray:
+        # q . (offset + scale * (code + 128)) = const(q) + (q * scale) . code
+        scaled = queries * self.scale
+        out = np.empty((len(queries), len(self.codes)), dtype=np.float32)
+        for start in range(0, len(self.codes), self.block_rows):
+            block = self.codes[start:start + self.block_rows].astype(np.float32)
+            out[:, start:start + len(block)] = scaled @ block.T
+        return out
+
+
+_POPCOUNT = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+
+
+def _popcount_rows(bits: np.ndarray) -> np.ndarray:
+    # Set bits per row of a (n, n_bytes) uint8 array
+    if hasattr(np, "bitwise_count"):
+        return np.bitwise_count(bits).sum(axis=1, dtype=np.int32)
+    return _POPCOUNT[bits].sum(axis=1, dtype=np.int32)
+
+
+class BinaryIndex(QuantizedIndex):
+    """
+    Sign codes: one bit per dimension (32x smaller than float32), searched by Hamming distance
+    between the sign bits of the query and of every vector. Coarser than int8, so it needs a
+    larger rescore list for the same recall.
+    """
+    kind = "binary"
+
+    def __init__(self, rescore: int = 200, block_rows: int = 65536):
+        super().__init__(rescore, block_rows)
+        self.codes = None
+
+    def _arrays(self) -> Dict[str, np.ndarray]:
+        return {"codes": self.codes}
+
+    def build(self, embeddings: np.ndarray) -> "BinaryIndex":
+        super().build(embeddings)
+        n, dim = embeddings.shape
+        self.codes = np.empty((n, (dim + 7) // 8), dtype=np.uint8)
+        for start in range(0, n, self.block_rows):
+            block = _as_float32(embeddings[start:start + self.block_rows])
+            self.codes[start:start + len(block)] = np.packbits(block > 0, axis=1)
+        logger.info(f"Binary index built: {n} vectors, {self.codes.nbytes / 2 ** 20:.1f} MiB of codes.")
+        return self
+
+    def approx_scores(self, queries: np.ndarray) -> np.ndarray:
+        query_codes = np.packbits(queries > 0, axis=1)
+        out = np.empty((len(queries), len(self.codes)), dtype=np.float32)
+        for start in range(0, len(self.codes), self.block_rows):
+            block = self.codes[start:start + self.block_rows]
+            for i, q in enumerate(query_codes):
+                out[i, start:start + len(block)] = -_popcount_rows(block ^ q)
+        return out
+
+
+DENSE_INDEX_TYPES = {
+    "flat": FlatIndex,
+    "ivf": IVFIndex,
+    "graph": GraphIndex,
+    "int8": Int8Index,
+    "binary": BinaryIndex,
+}
+
+
+def make_dense_index(kind: str, **params) -> DenseIndex:
+    if kind not in DENSE_INDEX_TYPES:
+        raise ValueError(f"Unknown dense index type: {kind} (expected one of {list(DENSE_INDEX_TYPES)})")
+    return DENSE_INDEX_TYPES[kind](**params)
+
+
+def load_dense_index(path: str, embeddings: np.ndarray, kind: str, params: Optional[Dict] = None,
+                     fingerprint: Optional[str] = None) -> Optional[DenseIndex]:
+    """
+    Loads an index saved with DenseIndex.save().
+    Returns None (caller rebuilds) if it was built for other embeddings or with different build parameters;
+    query-time parameters (e.g. n_probe, ef_search) from params are applied to the loaded index.
+    """
+    if not os.path.exists(path):
+        return None
+    params = params or {}
+    with np.load(path) as data:
+        meta = json.loads(str(data["meta"]))
+        if meta["kind"] != kind or meta["n_rows"] != embeddings.shape[0] or meta.get("fingerprint") != fingerprint:
+            return None
+        index = make_dense_index(kind, **meta["params"])
+        if any(meta["params"].get(k) != v for k, v in params.items() if k not in index.query_params):
+            return None
+        for name in index._arrays():
+            setattr(index, name, data[name])
+    for k in index.query_params:
+        if k in params:
+            setattr(index, k, params[k])
+    index.embeddings = embeddings
+    return index
+
+
+def measure_recall(index: DenseIndex, embeddings: np.ndarray, queries: np.ndarray, k: int = 10) -> Dict[str, float]:
+    """
+    recall@k of an index against exact (flat) search, plus mean per-query latency of both
+    and the memory of the index next to that of the vectors as a float32 matrix.
+    """
+    queries = _as_float32(np.atleast_2d(queries))
+    exact = FlatIndex().build(embeddings)
+    t0 = time.perf_counter()
+    _, exact_ids = exact.search(queries, k)
+    t1 = time.perf_counter()
+    _, approx_ids = index.search(queries, k)
+    t2 = time.perf_counter()
+    hits = sum(len(set(a[a >= 0].tolist()) & set(e[e >= 0].tolist())) for a, e in zip(approx_ids, exact_ids))
+    total = sum(int((e >= 0).sum()) for e in exact_ids)
+    recall = hits / max(total, 1)
+    float32_bytes = int(embeddings.shape[0]) * int(embeddings.shape[1]) * 4
+    return {
+        f"recall@{k}": recall,
+        f"recall@{k}_delta": recall - 1.0,
+        "exact_ms_per_query": 1000 * (t1 - t0) / len(queries),
+        "index_ms_per_query": 1000 * (t2 - t1) / len(queries),
+        "index_bytes": index.nbytes,
+        "float32_bytes": float32_bytes,
+        # Resident memory saved when the float vectors used for rescoring stay on disk (memory-mapped store)
+        **({"memory_saved_bytes": float32_bytes - index.nbytes} if isinstance(index, QuantizedIndex) else {}),
+    }
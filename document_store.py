@@ -0,0 +1,138 @@
+import json
+import logging
+import os
+import numpy as np
+from typing import Iterable, Iterator, List, Optional, Sequence
+
+logger = logging.getLogger(__name__)
+
+
+class DocumentStore:
+    """
+    Compact, read-mostly store for document texts: one UTF-8 blob plus an int64 offsets array,
+    row i being blob[offsets[i]:offsets[i + 1]]. A text is only decoded into a str when it is read.
+
+    Layout under <path>/ when persisted:
+        texts.bin    concatenated UTF-8 texts
+        offsets.npy  (N + 1,) int64 byte offsets
+        meta.json    row and byte counts, written last: the commit point of build() and append()
+
+    The blob is opened with mmap_mode 'r', so its pages live in the OS page cache (shared between processes
+    on the same host) rather than on the Python heap. Without a path the blob is kept in memory.
+    """
+    def __init__(self, path: Optional[str] = None):
+        self.path = path
+        self._blob = np.zeros(0, dtype=np.uint8)
+        self._offsets = np.zeros(1, dtype=np.int64)
+
+    @property
+    def blob_path(self) -> str:
+        return os.path.join(self.path, "texts.bin")
+
+    @property
+    def offsets_path(self) -> str:
+        return os.path.join(self.path, "offsets.npy")
+
+    @property
+    def meta_path(self) -> str:
+        return os.path.join(self.path, "meta.json")
+
+    @classmethod
+    def build(cls, texts: Iterable[str], path: Optional[str] = None) -> "DocumentStore":
+        """
+        Writes texts (streamed, in row order) to a new store at path, or to memory when path is None.
+        An existing store at path is replaced file by file: blob, then offsets, then meta.json. Readers of the old
+        store keep a consistent mapping (they hold the replaced files); open() during the swap sees files that
+        disagree with meta.json and returns None.
+        """
+        store = cls(path)
+        if path is None:
+            encoded = [text.encode("utf-8") for text in texts]
+            store._offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+            np.cumsum([len(b) for b in encoded], out=store._offsets[1:])
+            store._blob = np.frombuffer(b"".join(encoded), dtype=np.uint8)
+            return store
+        os.makedirs(path, exist_ok=True)
+        # Per-process temporary names: several processes may rebuild the same store at once
+        tmp_blob = f"{store.blob_path}.{os.getpid()}.tmp"
+        lengths = []
+        with open(tmp_blob, "wb") as f:
+            for text in texts:
+                data = text.encode("utf-8")
+                f.write(data)
+                lengths.append(len(data))
+        offsets = np.zeros(len(lengths) + 1, dtype=np.int64)
+        np.cumsum(lengths, out=offsets[1:])
+        os.replace(tmp_blob, store.blob_path)
+        store._write_offsets(offsets)
+        store._open()
+        return store
+
+    @classmethod
+    def open(cls, path: str) -> Optional["DocumentStore"]:
+        """
+        Opens an existing store, or returns None if there is none (or it is inconsistent).
+        """
+        store = cls(path)
+        if not all(os.path.exists(p) for p in (store.blob_path, store.offsets_path, store.meta_path)):
+            return None
+        store._open()
+        with open(store.meta_path, "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        if meta["rows"] != len(store) or store._offsets[-1] != len(store._blob) \
+                or meta.get("bytes", len(store._blob)) != len(store._blob):
+            logger.warning(f"Document store at {path} is inconsistent, ignoring it.")
+            return None
+        return store
+
+    def _write_offsets(self, offsets: np.ndarray):
+        tmp_offsets = f"{self.offsets_path}.{os.getpid()}.tmp.npy"
+        np.save(tmp_offsets, offsets)
+        os.replace(tmp_offsets, self.offsets_path)
+        tmp_meta = f"{self.meta_path}.{os.getpid()}.tmp"
+        with open(tmp_meta, "w", encoding="utf-8") as f:
+            json.dump({"rows": len(offsets) - 1, "bytes": int(offsets[-1])}, f)
+        os.replace(tmp_meta, self.meta_path)
+
+    def _open(self):
+        self._offsets = np.load(self.offsets_path)
+        # A zero-length file cannot be memory-mapped
+        self._blob = np.memmap(self.blob_path, dtype=np.uint8, mode="r") if os.path.getsize(self.blob_path) \
+            else np.zeros(0, dtype=np.uint8)
+
+    def append(self, texts: Sequence[str]):
+        """
+        Appends texts as new rows. The blob file only grows, so existing mappings stay valid.
+        """
+        encoded = [text.encode("utf-8") for text in texts]
+        if not encoded:
+            return
+        offsets = np.concatenate([self._offsets, self._offsets[-1] + np.cumsum([len(b) for b in encoded])])
+        if self.path is None:
+            self._blob = np.concatenate([self._blob, np.frombuffer(b"".join(encoded), dtype=np.uint8)])
+            self._offsets = offsets
+            return
+        with open(self.blob_path, "ab") as f:
+            f.write(b"".join(encoded))
+        self._write_offsets(offsets)
+        self._open()
+
+    def __len__(self) -> int:
+        return len(self._offsets) - 1
+
+    def __getitem__(self, row: int) -> str:
+        if not -len(self) <= row < len(self):
+            raise IndexError(f"Document row {row} out of range ({len(self)} documents)")
+        row = row % len(self)
+        return self._blob[self._offsets[row]:self._offsets[row + 1]].tobytes().decode("utf-8")
+
+    def __iter__(self) -> Iterator[str]:
+        for row in range(len(self)):
+            yield self[row]
+
+    def texts(self, rows: Iterable[int]) -> List[str]:
+        return [self[int(row)] for row in rows]
+
+    @property
+    def nbytes(self) -> int:
+        return int(self._blob.nbytes + self._offsets.nbytes)
@@ -0,0 +1,171 @@
+import hashlib
+import json
+import logging
+import os
+import re
+import numpy as np
+from typing import Callable, Dict, List, Optional, Sequence
+
+logger = logging.getLogger(__name__)
+
+SUPPORTED_DTYPES = ("float16", "float32")
+
+
+def content_hash(text: str) -> str:
+    """
+    Stable content fingerprint used to decide whether a document must be re-embedded.
+    """
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()
+
+
+def _model_slug(model_name: str) -> str:
+    return re.sub(r"[^A-Za-z0-9._-]+", "__", model_name)
+
+
+def dot_blocks(matrix: np.ndarray, queries: np.ndarray, block_rows: int = 65536) -> np.ndarray:
+    """
+    Computes queries @ matrix.T block by block.
+    Avoids materializing a float32 copy of a float16 (memory-mapped) matrix for every query.
+    queries: (dim,) or (n_queries, dim). Returns (n_docs,) or (n_queries, n_docs).
+    """
+    queries = np.asarray(queries, dtype=np.float32)
+    single = queries.ndim == 1
+    q = queries[None, :] if single else queries
+    if matrix.dtype == np.float32:
+        out = q @ matrix.T
+    else:
+        out = np.empty((q.shape[0], matrix.shape[0]), dtype=np.float32)
+        for start in range(0, matrix.shape[0], block_rows):
+            block = np.asarray(matrix[start:start + block_rows], dtype=np.float32)
+            out[:, start:start + block.shape[0]] = q @ block.T
+    return out[0] if single else out
+
+
+class EmbeddingStore:
+    """
+    Persistent, memory-mapped store for corpus embeddings.
+
+    Layout under <root_dir>/<model-slug>/:
+        embeddings.<generation>.npy  contiguous (N, dim) float16/float32 matrix, one row per document
+        ids.json                     row table: [{"id": doc_id, "hash": content_hash}, ...] plus store metadata,
+                                     including the generation of the matrix it describes
+
+    Rows are keyed by content hash, so on reload only new or edited documents are encoded.
+    sync() writes each matrix under a fresh generation and then swaps ids.json, the single commit point:
+    a reader sees either the old table and matrix or the new ones, never a new matrix with an old table.
+    The matrix is opened with mmap_mode='r': worker processes on the same host share the page cache.
+    """
+    COPY_BLOCK_ROWS = 65536
+
+    def __init__(self, root_dir: str, model_name: str, dtype: str = "float16"):
+        if dtype not in SUPPORTED_DTYPES:
+            raise ValueError(f"Unsupported embedding dtype: {dtype} (expected one of {SUPPORTED_DTYPES})")
+        self.model_name = model_name
+        self.dtype = dtype
+        self.path = os.path.join(root_dir, _model_slug(model_name))
+        self.table_path = os.path.join(self.path, "ids.json")
+        # Matrix of the last loaded or synced table (stores written before generations used embeddings.npy)
+        self.matrix_path = self._matrix_file(None)
+        self.fingerprint = None
+
+    def _matrix_file(self, generation: Optional[str]) -> str:
+        return os.path.join(self.path, f"embeddings.{generation}.npy" if generation else "embeddings.npy")
+
+    def exists(self) -> bool:
+        return os.path.exists(self.table_path)
+
+    def load(self):
+        """
+        Returns (ids, hashes, memory-mapped matrix) or None if the store is empty.
+        """
+        for _ in range(3):
+            if not self.exists():
+                return None
+            with open(self.table_path, "r", encoding="utf-8") as f:
+                table = json.load(f)
+            if table.get("model") != self.model_name:
+                logger.warning(f"Embedding store at {self.path} was built with {table.get('model')}, ignoring it.")
+                return None
+            matrix_path = self._matrix_file(table.get("generation"))
+            try:
+                matrix = np.load(matrix_path, mmap_mode="r")
+                break
+            except FileNotFoundError:
+                # A concurrent sync() committed a new table and dropped this matrix; read the new table
+                continue
+        else:
+            logger.warning(f"Embedding store at {self.path} keeps changing or lost its matrix, ignoring it.")
+            return None
+        self.matrix_path = matrix_path
+        rows = table["rows"]
+        if matrix.shape[0] != len(rows):
+            logger.warning(f"Embedding store at {self.path} is inconsistent, ignoring it.")
+            return None
+        return [r["id"] for r in rows], [r["hash"] for r in rows], matrix
+
+    def sync(self, ids: Sequence[str], texts: Sequence[str],
+             encode_fn: Callable[[List[str]], np.ndarray]) -> np.ndarray:
+        """
+        Makes the store match (ids, texts) and returns the memory-mapped matrix, row-aligned with ids.
+        encode_fn is only called for documents whose content hash is not already stored.
+        """
+        hashes = [content_hash(t) for t in texts]
+        # Identifies this exact row table; derived indexes saved next to the matrix are keyed on it
+        self.fingerprint = content_hash("\n".join(hashes))
+        loaded = self.load()
+        if loaded is not None:
+            stored_ids, stored_hashes, stored = loaded
+            if stored_ids == list(ids) and stored_hashes == hashes and stored.dtype == np.dtype(self.dtype):
+                logger.info(f"Loaded {len(ids)} embeddings from {self.matrix_path} (memory-mapped).")
+                return stored
+            row_of_hash: Dict[str, int] = {h: i for i, h in enumerate(stored_hashes)}
+        else:
+            stored = None
+            row_of_hash = {}
+
+        missing = [i for i, h in enumerate(hashes) if h not in row_of_hash]
+        logger.info(f"Embedding store: {len(ids) - len(missing)} reused, {len(missing)} to encode.")
+        new_vectors = None
+        if missing:
+            new_vectors = np.asarray(encode_fn([texts[i] for i in missing]), dtype=np.float32)
+        dim = stored.shape[1] if stored is not None else (new_vectors.shape[1] if new_vectors is not None else 0)
+
+        # Write a new generation of the matrix; nothing refers to it until ids.json is swapped below
+        os.makedirs(self.path, exist_ok=True)
+        generation = os.urandom(8).hex()
+        matrix_path = self._matrix_file(generation)
+        out = np.lib.format.open_memmap(matrix_path, mode="w+", dtype=self.dtype, shape=(len(ids), dim))
+        if missing:
+            out[np.asarray(missing)] = new_vectors
+        reused_dst = np.asarray([i for i, h in enumerate(hashes) if h in row_of_hash], dtype=np.int64)
+        reused_src = np.asarray([row_of_hash[hashes[i]] for i in reused_dst], dtype=np.int64)
+        for start in range(0, len(reused_dst), self.COPY_BLOCK_ROWS):
+            end = start + self.COPY_BLOCK_ROWS
+            out[reused_dst[start:end]] = stored[reused_src[start:end]]
+        out.flush()
+        del out
+        stored = loaded = None
+        tmp_table = f"{self.table_path}.{os.getpid()}.tmp"
+        with open(tmp_table, "w", encoding="utf-8") as f:
+            json.dump({
+                "model": self.model_name,
+                "dtype": self.dtype,
+                "dim": dim,
+                "generation": generation,
+                "rows": [{"id": doc_id, "hash": h} for doc_id, h in zip(ids, hashes)],
+            }, f)
+        os.replace(tmp_table, self.table_path)
+        self.matrix_path = matrix_path
+        self._remove_stale_matrices()
+        return np.load(matrix_path, mmap_mode="r")
+
+    def _remove_stale_matrices(self):
+        # Earlier generations (and matrices of syncs that died before committing their table). Open memory maps
+        # keep their pages; a reader that read the old table just before the swap retries in load().
+        for name in os.listdir(self.path):
+            path = os.path.join(self.path, name)
+            if name.startswith("embeddings.") and name.endswith(".npy") and path != self.matrix_path:
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
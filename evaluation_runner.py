@@ -0,0 +1,451 @@
+"""
+Resumable bulk evaluation of FinanceRAGSystem on FinanceRAG-style tasks
+(data/<task>/corpus.jsonl, queries.jsonl, qrels.tsv).
+
+Every configuration of a sweep (alpha x candidates x reranker x fusion) gets its own run directory. Answered
+queries are appended to JSONL checkpoint files as each batch completes, so a crashed or interrupted run resumes
+after its last completed batch and finished configurations are skipped. The index is built once per process
+and reused by every configuration; nDCG@10 and recall@k are accumulated as results come in.
+
+    python evaluation_runner.py --task FinDER --alpha 0.3 0.5 0.7 --candidates 100 200 \\
+        --reranker cross-encoder/ms-marco-MiniLM-L-12-v2 none --workers 4
+
+Run directory layout (<out-dir>/<config id>/; --out-dir defaults to results/eval/<task>):
+    config.json        configuration and index settings; resuming with different settings is refused
+    part-<i>.jsonl     one line per answered query, appended by worker i: {"query_id", "results": [[doc_id, score]]}
+    metrics.json       final metrics, written once every query is answered
+"""
+import argparse
+import itertools
+import json
+import logging
+import math
+import multiprocessing
+import os
+import time
+from dataclasses import asdict, dataclass
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from embedding_store import content_hash
+from model_registry import load_encoder, load_reranker_model, preload
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_RERANKER = 'cross-encoder/ms-marco-MiniLM-L-12-v2'
+
+
+# ---------------------------------------------------------------------------
+# Task data
+# ---------------------------------------------------------------------------
+
+def read_jsonl(path: str) -> Iterator[Dict[str, Any]]:
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+
+def load_corpus(path: str) -> List[Dict[str, str]]:
+    """
+    corpus.jsonl rows ({"_id", "title", "text"}) as index_corpus() documents; the title is prepended to the text.
+    """
+    corpus = []
+    for row in read_jsonl(path):
+        text = " ".join(part for part in (row.get("title"), row.get("text")) if part)
+        corpus.append({"id": str(row.get("_id", row.get("id"))), "text": text})
+    return corpus
+
+
+def load_queries(path: str) -> List[Tuple[str, str]]:
+    return [(str(row.get("_id", row.get("id"))), row["text"]) for row in read_jsonl(path)]
+
+
+def load_qrels(path: str) -> Dict[str, Dict[str, int]]:
+    """
+    qrels.tsv (query_id, corpus_id, score; optional header) as {query_id: {doc_id: relevance}}.
+    """
+    qrels: Dict[str, Dict[str, int]] = {}
+    if not os.path.exists(path):
+        return qrels
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            fields = line.rstrip("\n").split("\t")
+            if len(fields) < 3:
+                continue
+            try:
+                relevance = int(float(fields[2]))
+            except ValueError:
+                continue  # header
+            qrels.setdefault(fields[0], {})[fields[1]] = relevance
+    return qrels
+
+
+def load_task(task_dir: str, limit: Optional[int] = None):
+    """
+    (corpus, queries, qrels) of a task directory; limit keeps only the first queries.
+    """
+    corpus = load_corpus(os.path.join(task_dir, "corpus.jsonl"))
+    queries = load_queries(os.path.join(task_dir, "queries.jsonl"))
+    if limit:
+        queries = queries[:limit]
+    return corpus, queries, load_qrels(os.path.join(task_dir, "qrels.tsv"))
+
+
+# ---------------------------------------------------------------------------
+# Metrics
+# ---------------------------------------------------------------------------
+
+def ndcg_at_k(ranked: List[str], relevance: Dict[str, int], k: int = 10) -> float:
+    """
+    nDCG@k with linear gains (as trec_eval's ndcg_cut, used by the FinanceRAG evaluation).
+    """
+    dcg = sum(relevance.get(doc_id, 0) / math.log2(i + 2) for i, doc_id in enumerate(ranked[:k]))
+    ideal = sorted((r for r in relevance.values() if r > 0), reverse=True)[:k]
+    idcg = sum(r / math.log2(i + 2) for i, r in enumerate(ideal))
+    return dcg / idcg if idcg > 0 else 0.0
+
+
+def recall_at_k(ranked: List[str], relevance: Dict[str, int], k: int) -> float:
+    relevant = {doc_id for doc_id, r in relevance.items() if r > 0}
+    if not relevant:
+        return 0.0
+    return len(relevant.intersection(ranked[:k])) / len(relevant)
+
+
+class MetricAccumulator:
+    """
+    Running means of nDCG@10 and recall@k over the queries that have relevance judgments.
+    """
+    def __init__(self, qrels: Dict[str, Dict[str, int]], recall_k: Tuple[int, ...] = (10, 100)):
+        self.qrels = qrels
+        self.recall_k = recall_k
+        self.sums: Dict[str, float] = {"ndcg@10": 0.0, **{f"recall@{k}": 0.0 for k in recall_k}}
+        self.judged = 0
+        self.answered = 0
+
+    def add(self, query_id: str, ranked: List[str]):
+        self.answered += 1
+        relevance = self.qrels.get(query_id)
+        if not relevance or not any(r > 0 for r in relevance.values()):
+            return
+        self.judged += 1
+        self.sums["ndcg@10"] += ndcg_at_k(ranked, relevance, 10)
+        for k in self.recall_k:
+            self.sums[f"recall@{k}"] += recall_at_k(ranked, relevance, k)
+
+    def summary(self) -> Dict[str, Any]:
+        return {"answered": self.answered, "judged": self.judged,
+                **{name: total / self.judged if self.judged else 0.0 for name, total in self.sums.items()}}
+
+
+# ---------------------------------------------------------------------------
+# Configurations and checkpoints
+# ---------------------------------------------------------------------------
+
+@dataclass(frozen=True)
+class EvalConfig:
+    """
+    Settings that can change between runs over the same index.
+    reranker: Cross-encoder name ('stub' for the benchmark's stand-in), or None to evaluate retrieval alone.
+    """
+    alpha: float = 0.5
+    candidates: int = 200
+    reranker: Optional[str] = DEFAULT_RERANKER
+    fusion: str = 'weighted'
+
+    @property
+    def config_id(self) -> str:
+        return content_hash(json.dumps(asdict(self), sort_keys=True))[:12]
+
+
+@dataclass(frozen=True)
+class IndexSettings:
+    """
+    Settings of the index shared by every configuration of a sweep.
+    """
+    encoder: str = 'BAAI/bge-m3'
+    dense_index: str = 'flat'
+    store_dir: Optional[str] = None
+    top_k: int = 100
+    batch_size: int = 32
+    rerank_batch_size: int = 32
+    dedup_threshold: Optional[float] = None
+
+
+def _run_dir(out_dir: str, config: EvalConfig) -> str:
+    return os.path.join(out_dir, config.config_id)
+
+
+def prepare_run(out_dir: str, config: EvalConfig, settings: IndexSettings) -> str:
+    """
+    Creates (or checks) the run directory of a configuration; refuses to mix results of different settings.
+    """
+    run_dir = _run_dir(out_dir, config)
+    os.makedirs(run_dir, exist_ok=True)
+    # Unset optional settings are left out, so runs started before such a setting existed still resume
+    meta = {"config": asdict(config),
+            "settings": {k: v for k, v in asdict(settings).items() if k != "store_dir" and v is not None}}
+    path = os.path.join(run_dir, "config.json")
+    if os.path.exists(path):
+        with open(path, "r", encoding="utf-8") as f:
+            existing = json.load(f)
+        if existing != meta:
+            raise ValueError(f"Run directory {run_dir} holds results for other settings: {existing}")
+    else:
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(meta, f, indent=2)
+    return run_dir
+
+
+def _repair_part(path: str):
+    # A crash can leave a partially written last line; cut it so appends start on a fresh line
+    with open(path, "rb+") as f:
+        data = f.read()
+        end = data.rfind(b"\n") + 1
+        if end != len(data):
+            logger.warning(f"Dropping incomplete last record of {path}.")
+            f.truncate(end)
+
+
+def load_checkpoint(run_dir: str) -> Dict[str, List[List[Any]]]:
+    """
+    Answered queries of a run, from all its part files: {query_id: [[doc_id, score], ...]}.
+    """
+    answered: Dict[str, List[List[Any]]] = {}
+    for name in sorted(os.listdir(run_dir)):
+        if not (name.startswith("part-") and name.endswith(".jsonl")):
+            continue
+        with open(os.path.join(run_dir, name), "r", encoding="utf-8") as f:
+            for line in f:
+                if not line.endswith("\n"):
+                    break  # incomplete record, repaired by its writer on resume
+                record = json.loads(line)
+                answered.setdefault(record["query_id"], record["results"])
+    return answered
+
+
+# ---------------------------------------------------------------------------
+# Evaluation
+# ---------------------------------------------------------------------------
+
+def build_system(corpus: List[Dict[str, str]], settings: IndexSettings):
+    """
+    Indexes the corpus once; configurations are applied to the built system with configure().
+    """
+    from advanced_rag_architecture import FinanceRAGSystem
+
+    system = FinanceRAGSystem(embedding_store_dir=settings.store_dir, embedding_model_name=settings.encoder,
+                              encoder=load_encoder(settings.encoder), dense_index=settings.dense_index,
+                              rerank_stages=[], dedup_threshold=settings.dedup_threshold)
+    system.index_data(corpus)
+    return system
+
+
+def configure(system, config: EvalConfig, settings: IndexSettings, rerankers: Dict[str, Any]):
+    """
+    Points a built system at one configuration. Reranker models are loaded once and kept in rerankers.
+    """
+    from advanced_rag_architecture import AdvancedReranker, RerankCascade, RerankStage
+
+    system.alpha = config.alpha
+    system.candidates = config.candidates
+    system.retriever.fusion = config.fusion
+    if config.reranker is None:
+        system.reranker = None
+        return
+    if config.reranker not in rerankers:
+        rerankers[config.reranker] = AdvancedReranker(model_name=config.reranker,
+                                                      batch_size=settings.rerank_batch_size,
+                                                      model=load_reranker_model(config.reranker, 0.0))
+    stage = RerankStage(model_name=config.reranker, candidates=config.candidates,
+                        batch_size=settings.rerank_batch_size, reranker=rerankers[config.reranker])
+    system.reranker = RerankCascade([stage], tracer=system.tracer)
+
+
+def remaining_queries(run_dir: str, queries: List[Tuple[str, str]]) -> List[Tuple[str, str]]:
+    answered = load_checkpoint(run_dir)
+    return [q for q in queries if q[0] not in answered]
+
+
+def evaluate_config(system, config: EvalConfig, settings: IndexSettings, run_dir: str,
+                    todo: List[Tuple[str, str]], qrels: Dict[str, Dict[str, int]], worker: int = 0,
+                    recall_k: Tuple[int, ...] = (10, 100)) -> Dict[str, Any]:
+    """
+    Answers the queries in todo, appending each batch to this worker's part file as it completes.
+    Returns running metrics over the whole checkpoint (resumed results, other workers' and new ones).
+    Results of folded near-duplicates are expanded to every source document before they are recorded.
+    """
+    from advanced_rag_architecture import expand_duplicates
+
+    accumulator = MetricAccumulator(qrels, recall_k)
+    for query_id, results in load_checkpoint(run_dir).items():
+        accumulator.add(query_id, [doc_id for doc_id, _ in results])
+    if not todo:
+        return accumulator.summary()
+
+    part_path = os.path.join(run_dir, f"part-{worker}.jsonl")
+    if os.path.exists(part_path):
+        _repair_part(part_path)
+    start = time.perf_counter()
+    with open(part_path, "a", encoding="utf-8") as f:
+        for offset in range(0, len(todo), settings.batch_size):
+            batch = todo[offset:offset + settings.batch_size]
+            results = system.answer_batch([text for _, text in batch], batch_size=settings.batch_size,
+                                          top_k=settings.top_k)
+            for (query_id, _), docs in zip(batch, results):
+                docs = expand_duplicates(docs)
+                f.write(json.dumps({"query_id": query_id,
+                                    "results": [[doc.doc_id, round(float(doc.score), 6)] for doc in docs]}) + "\n")
+                accumulator.add(query_id, [doc.doc_id for doc in docs])
+            f.flush()
+            os.fsync(f.fileno())
+            done = offset + len(batch)
+            summary = accumulator.summary()
+            logger.info(f"[{config.config_id} worker {worker}] {done}/{len(todo)} queries "
+                        f"({done / (time.perf_counter() - start):.1f}/s), nDCG@10 {summary['ndcg@10']:.4f} "
+                        f"over {summary['judged']} judged")
+    return accumulator.summary()
+
+
+def _evaluate_share(system, out_dir: str, work: List[Tuple[EvalConfig, List[Tuple[str, str]]]],
+                    settings: IndexSettings, qrels: Dict[str, Dict[str, int]], worker: int, n_workers: int,
+                    recall_k: Tuple[int, ...]):
+    rerankers: Dict[str, Any] = {}
+    for config, todo in work:
+        configure(system, config, settings, rerankers)
+        evaluate_config(system, config, settings, _run_dir(out_dir, config), todo[worker::n_workers], qrels, worker,
+                        recall_k)
+
+
+def _worker_main(task_dir: str, out_dir: str, work: List[Tuple[EvalConfig, List[Tuple[str, str]]]],
+                 settings: IndexSettings, worker: int, n_workers: int, recall_k: Tuple[int, ...]):
+    logging.basicConfig(level=logging.INFO)
+    corpus, _, qrels = load_task(task_dir)
+    system = build_system(corpus, settings)
+    del corpus
+    _evaluate_share(system, out_dir, work, settings, qrels, worker, n_workers, recall_k)
+
+
+def finalize(run_dir: str, queries: List[Tuple[str, str]], qrels: Dict[str, Dict[str, int]],
+             recall_k: Tuple[int, ...]) -> Dict[str, Any]:
+    """
+    Metrics of a run from its checkpoint; written to metrics.json once every query is answered.
+    """
+    answered = load_checkpoint(run_dir)
+    accumulator = MetricAccumulator(qrels, recall_k)
+    for query_id, _ in queries:
+        if query_id in answered:
+            accumulator.add(query_id, [doc_id for doc_id, _ in answered[query_id]])
+    summary = {**accumulator.summary(), "complete": accumulator.answered == len(queries)}
+    if summary["complete"]:
+        with open(os.path.join(run_dir, "metrics.json"), "w", encoding="utf-8") as f:
+            json.dump(summary, f, indent=2)
+    return summary
+
+
+def run_sweep(task_dir: str, out_dir: str, configs: List[EvalConfig], settings: IndexSettings,
+              n_workers: int = 1, recall_k: Tuple[int, ...] = (10, 100), limit: Optional[int] = None,
+              start_method: str = "spawn") -> List[Dict[str, Any]]:
+    """
+    Evaluates every configuration, skipping finished ones and resuming partial ones.
+    With n_workers > 1 the remaining queries are split over worker processes; this process indexes the corpus
+    first (filling the embedding store the workers then memory-map) and works as worker 0.
+    start_method: 'spawn' (default) or 'fork'. Forked workers inherit the models this process preloads and
+                  share their weights copy-on-write instead of each loading a copy; fork is unsafe with some
+                  torch / CUDA setups once the parent has used them.
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    if settings.store_dir is None:
+        settings = IndexSettings(**{**asdict(settings), "store_dir": os.path.join(out_dir, "store")})
+    corpus, queries, qrels = load_task(task_dir, limit)
+    # Remaining queries are listed once, before any worker starts, so the split stays fixed while workers append;
+    # a resumed sweep may use a different number of workers
+    work = []
+    for config in configs:
+        run_dir = prepare_run(out_dir, config, settings)
+        todo = remaining_queries(run_dir, queries)
+        if todo:
+            work.append((config, todo))
+        else:
+            logger.info(f"[{config.config_id}] already complete, skipping.")
+
+    if work:
+        system = build_system(corpus, settings)
+        processes = []
+        if start_method == "fork" and n_workers > 1:
+            preload(cross_encoders={config.reranker for config, _ in work if config.reranker not in (None, "stub")})
+        context = multiprocessing.get_context(start_method)
+        for worker in range(1, n_workers):
+            process = context.Process(target=_worker_main, args=(task_dir, out_dir, work, settings, worker, n_workers,
+                                                                 recall_k))
+            process.start()
+            processes.append(process)
+        _evaluate_share(system, out_dir, work, settings, qrels, 0, n_workers, recall_k)
+        for process in processes:
+            process.join()
+        failed = [p.exitcode for p in processes if p.exitcode != 0]
+        if failed:
+            raise RuntimeError(f"{len(failed)} evaluation worker(s) failed (exit codes {failed}); "
+                               f"re-run to resume.")
+
+    report = []
+    for config in configs:
+        summary = finalize(_run_dir(out_dir, config), queries, qrels, recall_k)
+        report.append({"config_id": config.config_id, "config": asdict(config), "metrics": summary})
+    with open(os.path.join(out_dir, "sweep.json"), "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    return report
+
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Resumable evaluation sweeps of FinanceRAGSystem.")
+    parser.add_argument("--data-dir", default="data")
+    parser.add_argument("--task", default="FinDER")
+    parser.add_argument("--out-dir", default=None, help="Default: results/eval/<task>.")
+    parser.add_argument("--alpha", type=float, nargs="+", default=[0.5])
+    parser.add_argument("--candidates", type=int, nargs="+", default=[200], help="Retrieved documents per query.")
+    parser.add_argument("--reranker", nargs="+", default=[DEFAULT_RERANKER],
+                        help="Cross-encoder names, 'stub', or 'none' for retrieval only.")
+    parser.add_argument("--fusion", nargs="+", default=["weighted"], choices=["weighted", "rrf", "zscore"])
+    parser.add_argument("--encoder", default="BAAI/bge-m3", help="SentenceTransformer name or 'stub'.")
+    parser.add_argument("--dense-index", default="flat", choices=["flat", "ivf", "graph", "int8", "binary"])
+    parser.add_argument("--store-dir", default=None, help="Embedding store (default: <out-dir>/store).")
+    parser.add_argument("--dedup-threshold", type=float, default=None,
+                        help="Index one representative per cluster of near-duplicate documents (e.g. 0.8).")
+    parser.add_argument("--top-k", type=int, default=100, help="Results kept per query.")
+    parser.add_argument("--recall-k", type=int, nargs="+", default=[10, 100])
+    parser.add_argument("--batch-size", type=int, default=32)
+    parser.add_argument("--rerank-batch-size", type=int, default=32)
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument("--start-method", default="spawn", choices=["spawn", "fork"],
+                        help="'fork' shares the parent's preloaded models with the workers copy-on-write.")
+    parser.add_argument("--limit", type=int, default=None, help="Only the first N queries (smoke tests).")
+    return parser.parse_args(argv)
+
+
+def main(argv: Optional[List[str]] = None):
+    logging.basicConfig(level=logging.INFO)
+    args = parse_args(argv)
+    if max(args.recall_k) > args.top_k:
+        raise ValueError(f"--top-k ({args.top_k}) must cover the largest --recall-k ({max(args.recall_k)}).")
+    configs = [EvalConfig(alpha=alpha, candidates=candidates, reranker=None if reranker == "none" else reranker,
+                          fusion=fusion)
+               for alpha, candidates, reranker, fusion in itertools.product(args.alpha, args.candidates,
+                                                                            args.reranker, args.fusion)]
+    settings = IndexSettings(encoder=args.encoder, dense_index=args.dense_index, store_dir=args.store_dir,
+                             top_k=args.top_k, batch_size=args.batch_size, rerank_batch_size=args.rerank_batch_size,
+                             dedup_threshold=args.dedup_threshold)
+    out_dir = args.out_dir or os.path.join("results", "eval", args.task)
+    report = run_sweep(os.path.join(args.data_dir, args.task), out_dir, configs, settings, n_workers=args.workers,
+                       recall_k=tuple(args.recall_k), limit=args.limit, start_method=args.start_method)
+    for entry in report:
+        config, metrics = entry["config"], entry["metrics"]
+        recalls = " ".join(f"R@{k} {metrics[f'recall@{k}']:.4f}" for k in args.recall_k)
+        print(f"{entry['config_id']}  alpha={config['alpha']:<4} candidates={config['candidates']:<4} "
+              f"fusion={config['fusion']:<8} reranker={config['reranker']}  nDCG@10 {metrics['ndcg@10']:.4f} "
+              f"{recalls}{'' if metrics['complete'] else '  (incomplete)'}")
+    print(f"Sweep written to {os.path.join(out_dir, 'sweep.json')}")
+
+
+if __name__ == "__main__":
+    main()
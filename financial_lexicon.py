@@ -0,0 +1,280 @@
+import csv
+import gc
+import hashlib
+import json
+import logging
+import os
+import pickle
+import re
+from collections import deque
+from dataclasses import dataclass
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+logger = logging.getLogger(__name__)
+
+SPAN_TYPES = ("entity", "metric", "period")
+
+# Built-in metric lexicon; the first entry of each tuple is the canonical name
+DEFAULT_METRICS = [
+    ("revenue", "revenues", "net sales", "total revenue"),
+    ("profit", "net income", "net profit", "earnings"),
+    ("margin", "gross margin", "operating margin", "net margin"),
+    ("tax", "tax rate", "effective tax rate", "income tax"),
+    ("asset", "assets", "total assets", "fixed assets"),
+    ("liability", "liabilities", "total liabilities"),
+    ("turnover", "asset turnover", "fixed asset turnover", "inventory turnover"),
+    ("ebitda",),
+    ("roic", "return on invested capital"),
+    ("roe", "return on equity"),
+    ("eps", "earnings per share"),
+    ("free cash flow", "fcf"),
+    ("capex", "capital expenditure", "capital expenditures"),
+    ("p/e ratio", "price to earnings", "price-to-earnings"),
+]
+
+# Fiscal periods are open-ended (any year), so they are matched by one compiled regex, not the automaton
+PERIOD_PATTERN = re.compile(
+    r"\b(?:FY\s?'?\d{2,4}|Q[1-4]\s?(?:FY)?\s?'?\d{2,4}|(?:first|second|third|fourth)\s+quarter(?:\s+of)?\s+(?:fiscal\s+)?\d{4}"
+    r"|fiscal(?:\s+year)?\s+\d{4}|(?:19|20)\d{2})\b",
+    re.IGNORECASE,
+)
+
+
+@dataclass
+class LexiconSpan:
+    start: int
+    end: int
+    text: str
+    type: str
+    canonical: str
+
+
+class AhoCorasick:
+    """
+    Multi-pattern automaton: finds every occurrence of every pattern in one linear pass over the text.
+    Transitions are stored per state as dicts; outputs are (pattern length, payload id) pairs.
+    """
+    def __init__(self):
+        self.goto: List[Dict[str, int]] = [{}]
+        self.fail: List[int] = [0]
+        self.out: List[List[Tuple[int, int]]] = [[]]
+
+    def add(self, pattern: str, payload: int):
+        state = 0
+        for ch in pattern:
+            nxt = self.goto[state].get(ch)
+            if nxt is None:
+                nxt = len(self.goto)
+                self.goto[state][ch] = nxt
+                self.goto.append({})
+                self.fail.append(0)
+                self.out.append([])
+            state = nxt
+        self.out[state].append((len(pattern), payload))
+
+    def finalize(self):
+        # Breadth-first pass to compute failure links and merge outputs along them
+        queue = deque(self.goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for ch, nxt in self.goto[state].items():
+                queue.append(nxt)
+                f = self.fail[state]
+                while f and ch not in self.goto[f]:
+                    f = self.fail[f]
+                self.fail[nxt] = self.goto[f].get(ch, 0)
+                self.out[nxt] = self.out[nxt] + self.out[self.fail[nxt]]
+
+    def iter_matches(self, text: str):
+        """
+        Yields (start, end, payload) for every match, in order of end position.
+        """
+        goto, fail, out = self.goto, self.fail, self.out
+        state = 0
+        for i, ch in enumerate(text):
+            while state and ch not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(ch, 0)
+            for length, payload in out[state]:
+                yield i + 1 - length, i + 1, payload
+
+    @property
+    def num_states(self) -> int:
+        return len(self.goto)
+
+
+def _is_word_char(ch: str) -> bool:
+    return ch.isalnum() or ch == "_"
+
+
+def _casefold_same_length(text: str) -> str:
+    # Lowercasing must keep offsets aligned with the original text
+    lowered = text.lower()
+    if len(lowered) == len(text):
+        return lowered
+    return "".join(c.lower() if len(c.lower()) == 1 else c for c in text)
+
+
+class FinancialLexicon:
+    """
+    Compiled lexicon of entities (tickers, company names and aliases), metrics and fiscal periods.
+
+    Entity and metric entries are compiled once into an Aho-Corasick automaton; tag() returns typed,
+    non-overlapping spans with character offsets in one pass over the text (case-insensitive, whole words).
+    Compiled lexicons can be cached on disk with save()/load() or load_or_compile().
+    """
+    def __init__(self, include_defaults: bool = True):
+        self.terms: Dict[str, Tuple[str, str]] = {}  # lowercased surface form -> (type, canonical)
+        self._automaton: Optional[AhoCorasick] = None
+        self._payloads: List[Tuple[str, str]] = []
+        if include_defaults:
+            for names in DEFAULT_METRICS:
+                self.add_terms(names, "metric", canonical=names[0])
+
+    def add_terms(self, terms: Iterable[str], span_type: str, canonical: Optional[str] = None):
+        """
+        Adds surface forms of one type. If canonical is None each term is its own canonical form.
+        """
+        if span_type not in SPAN_TYPES:
+            raise ValueError(f"Unknown span type: {span_type} (expected one of {SPAN_TYPES})")
+        for term in terms:
+            term = term.strip()
+            if term:
+                self.terms[term.lower()] = (span_type, canonical or term)
+        self._automaton = None
+
+    def add_entity(self, name: str, aliases: Sequence[str] = ()):
+        """
+        Adds a company with its aliases (e.g. ticker, short names); all map to `name`.
+        """
+        self.add_terms([name, *aliases], "entity", canonical=name)
+
+    def load_file(self, path: str, span_type: Optional[str] = None):
+        """
+        Loads entries from a file:
+        .txt          one term per line (span_type required)
+        .csv / .tsv   columns: term[, type][, canonical]
+        .jsonl        {"term": ..., "type": ..., "canonical": ..., "aliases": [...]}
+        """
+        ext = os.path.splitext(path)[1].lower()
+        with open(path, "r", encoding="utf-8") as f:
+            if ext == ".txt":
+                if span_type is None:
+                    raise ValueError(f"span_type is required for plain-text lexicon {path}")
+                self.add_terms((line for line in f), span_type)
+            elif ext in (".csv", ".tsv"):
+                for row in csv.reader(f, delimiter="\t" if ext == ".tsv" else ","):
+                    if not row or not row[0].strip():
+                        continue
+                    row_type = row[1].strip() if len(row) > 1 and row[1].strip() else span_type
+                    canonical = row[2].strip() if len(row) > 2 and row[2].strip() else None
+                    self.add_terms([row[0]], row_type, canonical=canonical)
+            elif ext == ".jsonl":
+                for line in f:
+                    if line.strip():
+                        entry = json.loads(line)
+                        self.add_terms([entry["term"], *entry.get("aliases", [])], entry.get("type", span_type),
+                                       canonical=entry.get("canonical", entry["term"]))
+            else:
+                raise ValueError(f"Unsupported lexicon file type: {path}")
+        self._automaton = None
+
+    def compile(self) -> "FinancialLexicon":
+        automaton = AhoCorasick()
+        self._payloads = []
+        for surface, entry in self.terms.items():
+            automaton.add(surface, len(self._payloads))
+            self._payloads.append(entry)
+        automaton.finalize()
+        self._automaton = automaton
+        logger.info(f"Lexicon compiled: {len(self.terms)} terms, {automaton.num_states} states.")
+        return self
+
+    def fingerprint(self) -> str:
+        digest = hashlib.sha1()
+        for surface in sorted(self.terms):
+            digest.update(f"{surface}\x1f{self.terms[surface][0]}\x1f{self.terms[surface][1]}\n".encode("utf-8"))
+        return digest.hexdigest()
+
+    def save(self, path: str):
+        if self._automaton is None:
+            self.compile()
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        tmp = path + ".tmp"
+        with open(tmp, "wb") as f:
+            pickle.dump({"fingerprint": self.fingerprint(), "terms": self.terms,
+                         "automaton": self._automaton, "payloads": self._payloads}, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp, path)
+
+    @staticmethod
+    def _read_cache(path: str) -> Dict:
+        # The automaton is millions of small containers; the cyclic GC would rescan them during unpickling
+        gc_was_enabled = gc.isenabled()
+        gc.disable()
+        try:
+            with open(path, "rb") as f:
+                return pickle.load(f)
+        finally:
+            if gc_was_enabled:
+                gc.enable()
+
+    @classmethod
+    def load(cls, path: str) -> "FinancialLexicon":
+        data = cls._read_cache(path)
+        lexicon = cls(include_defaults=False)
+        lexicon.terms = data["terms"]
+        lexicon._automaton = data["automaton"]
+        lexicon._payloads = data["payloads"]
+        return lexicon
+
+    def load_or_compile(self, cache_path: str) -> "FinancialLexicon":
+        """
+        Returns the cached compiled lexicon if it was built from the same entries, else compiles and caches it.
+        """
+        if os.path.exists(cache_path):
+            data = self._read_cache(cache_path)
+            if data.get("fingerprint") == self.fingerprint():
+                self._automaton = data["automaton"]
+                self._payloads = data["payloads"]
+                return self
+        self.compile()
+        self.save(cache_path)
+        return self
+
+    def tag(self, text: str, types: Sequence[str] = SPAN_TYPES) -> List[LexiconSpan]:
+        """
+        Typed spans in text, sorted by offset. Overlapping matches resolve leftmost-longest.
+        """
+        if self._automaton is None:
+            self.compile()
+        matches = []
+        if "entity" in types or "metric" in types:
+            folded = _casefold_same_length(text)
+            n = len(text)
+            for start, end, payload in self._automaton.iter_matches(folded):
+                # Whole-word matches only
+                if (start > 0 and _is_word_char(text[start - 1]) and _is_word_char(text[start])) or \
+                        (end < n and _is_word_char(text[end]) and _is_word_char(text[end - 1])):
+                    continue
+                span_type, canonical = self._payloads[payload]
+                if span_type in types:
+                    matches.append((start, end, span_type, canonical))
+        if "period" in types:
+            for m in PERIOD_PATTERN.finditer(text):
+                matches.append((m.start(), m.end(), "period", m.group(0)))
+
+        # Leftmost-longest, non-overlapping
+        matches.sort(key=lambda m: (m[0], -(m[1] - m[0])))
+        spans: List[LexiconSpan] = []
+        last_end = 0
+        for start, end, span_type, canonical in matches:
+            if start >= last_end:
+                spans.append(LexiconSpan(start, end, text[start:end], span_type, canonical))
+                last_end = end
+        return spans
+
+    def tag_corpus(self, texts: Iterable[str], types: Sequence[str] = SPAN_TYPES) -> List[List[LexiconSpan]]:
+        """
+        Tags many documents with the same compiled automaton.
+        """
+        return [self.tag(text, types) for text in texts]
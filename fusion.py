@@ -0,0 +1,96 @@
+import numpy as np
+from dataclasses import dataclass
+from typing import Iterable
+
+FUSION_STRATEGIES = ("weighted", "rrf", "zscore")
+
+
+@dataclass
+class ScoreStats:
+    """
+    Summary of one retriever's score distribution, used to normalize candidate scores.
+    Mergeable, so statistics computed on corpus partitions combine into the global ones.
+    """
+    count: int
+    total: float
+    total_sq: float
+    min: float
+    max: float
+
+    @classmethod
+    def from_scores(cls, scores: np.ndarray) -> "ScoreStats":
+        scores = np.asarray(scores, dtype=np.float64)
+        if scores.size == 0:
+            return cls(0, 0.0, 0.0, 0.0, 0.0)
+        return cls(int(scores.size), float(scores.sum()), float(np.dot(scores, scores)),
+                   float(scores.min()), float(scores.max()))
+
+    @classmethod
+    def merge(cls, parts: Iterable["ScoreStats"]) -> "ScoreStats":
+        parts = [p for p in parts if p.count]
+        if not parts:
+            return cls(0, 0.0, 0.0, 0.0, 0.0)
+        return cls(sum(p.count for p in parts), sum(p.total for p in parts), sum(p.total_sq for p in parts),
+                   min(p.min for p in parts), max(p.max for p in parts))
+
+    @property
+    def mean(self) -> float:
+        return self.total / self.count if self.count else 0.0
+
+    @property
+    def std(self) -> float:
+        if not self.count:
+            return 0.0
+        return float(np.sqrt(max(self.total_sq / self.count - self.mean ** 2, 0.0)))
+
+
+def top_candidates(scores: np.ndarray, k: int) -> np.ndarray:
+    """
+    Indices of the k highest scores, best first, in O(N + k log k) using argpartition.
+    Ties are broken by lower index, so the result does not depend on how the array was partitioned
+    (a sharded search picks the same documents as a single index).
+    """
+    k = min(k, len(scores))
+    if k <= 0:
+        return np.zeros(0, dtype=np.int64)
+    part = np.argpartition(-scores, k - 1)[:k]
+    kth = scores[part].min()
+    above = part[scores[part] > kth]
+    ties = np.flatnonzero(scores == kth)[:k - len(above)]
+    top = np.concatenate([above, ties])
+    return top[np.lexsort((top, -scores[top]))]
+
+
+def candidate_ranks(candidates: np.ndarray, ranked: np.ndarray) -> np.ndarray:
+    """
+    1-based rank of each (sorted) candidate in a retriever's ranked list; inf if it is not in the list.
+    """
+    ranks = np.full(len(candidates), np.inf)
+    ranks[np.searchsorted(candidates, ranked)] = np.arange(1, len(ranked) + 1)
+    return ranks
+
+
+def fuse_scores(strategy: str, dense: np.ndarray, sparse: np.ndarray, dense_stats: ScoreStats,
+                sparse_stats: ScoreStats, dense_ranks: np.ndarray, sparse_ranks: np.ndarray,
+                alpha: float = 0.5, rrf_k: int = 60) -> np.ndarray:
+    """
+    Fuses dense and sparse scores of a candidate set.
+    weighted: alpha * minmax(dense) + (1 - alpha) * minmax(sparse), min/max over the whole scored set.
+    zscore:   alpha * z(dense) + (1 - alpha) * z(sparse), mean/std over the whole scored set.
+    rrf:      alpha / (rrf_k + rank_dense) + (1 - alpha) / (rrf_k + rank_sparse), ranks from each top-k' list.
+    """
+    if strategy == "weighted":
+        def normalize(scores, stats):
+            if stats.max == stats.min:
+                return scores
+            return (scores - stats.min) / (stats.max - stats.min)
+        return alpha * normalize(dense, dense_stats) + (1 - alpha) * normalize(sparse, sparse_stats)
+    if strategy == "zscore":
+        def standardize(scores, stats):
+            if stats.std == 0:
+                return np.zeros_like(scores, dtype=np.float64)
+            return (scores - stats.mean) / stats.std
+        return alpha * standardize(dense, dense_stats) + (1 - alpha) * standardize(sparse, sparse_stats)
+    if strategy == "rrf":
+        return alpha / (rrf_k + dense_ranks) + (1 - alpha) / (rrf_k + sparse_ranks)
+    raise ValueError(f"Unknown fusion strategy: {strategy} (expected one of {FUSION_STRATEGIES})")
@@ -0,0 +1,391 @@
+import json
+import logging
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, Iterable, List, Optional, Sequence
+
+logger = logging.getLogger(__name__)
+
+# Upper bounds (seconds) of the latency histogram buckets
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class StageRecord:
+    """
+    Timing of one pipeline stage. attrs holds stage facts such as candidates (items the stage produced).
+    """
+    __slots__ = ("name", "ms", "attrs")
+
+    def __init__(self, name: str, attrs: Optional[Dict[str, Any]] = None):
+        self.name = name
+        self.ms = 0.0
+        self.attrs = attrs or {}
+
+    def set(self, **attrs):
+        self.attrs.update(attrs)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {"stage": self.name, "ms": self.ms, **self.attrs}
+
+
+class QueryTrace:
+    """
+    Ordered stage records of one answer() call (or one answer_batch() batch).
+    """
+    def __init__(self, name: str, attrs: Optional[Dict[str, Any]] = None):
+        self.name = name
+        self.attrs = attrs or {}
+        self.stages: List[StageRecord] = []
+        self.total_ms = 0.0
+
+    def stage_ms(self, name: str) -> float:
+        """
+        Total time spent in stages with this name (a stage may run more than once, e.g. per filter group).
+        """
+        return sum(s.ms for s in self.stages if s.name == name)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {"trace": self.name, "total_ms": self.total_ms, **self.attrs,
+                "stages": [s.to_dict() for s in self.stages]}
+
+    def __repr__(self) -> str:
+        parts = ", ".join(f"{s.name}={s.ms:.2f}ms" for s in self.stages)
+        return f"QueryTrace({self.name}, total={self.total_ms:.2f}ms: {parts}; {self.attrs})"
+
+
+class TracedResults(list):
+    """
+    Result list with the QueryTrace of the call that produced it attached as .trace.
+    """
+    def __init__(self, results: Iterable = (), trace: Optional[QueryTrace] = None):
+        super().__init__(results)
+        self.trace = trace
+
+
+class Tracer:
+    """
+    Records per-stage timings of the pipeline and forwards them to pluggable hooks.
+
+    A hook is any object with an on_trace(trace) and/or on_stage(trace, stage) method
+    (see MetricsRegistry, LoggingHook). Traces are kept per thread, so one tracer can be shared by
+    concurrent callers. Stages opened outside a trace are timed but not recorded.
+    profiler: Optional SamplingProfiler; started with the first trace, its samples are tagged with
+              the active stage of the sampled thread.
+    """
+    def __init__(self, hooks: Sequence[Any] = (), profiler: Optional["SamplingProfiler"] = None):
+        self.hooks = list(hooks)
+        self.profiler = profiler
+        self._local = threading.local()
+        self.active_stages: Dict[int, str] = {}  # thread id -> innermost open stage (read by the profiler)
+
+    def add_hook(self, hook: Any):
+        self.hooks.append(hook)
+
+    @property
+    def current(self) -> Optional[QueryTrace]:
+        return getattr(self._local, "trace", None)
+
+    @contextmanager
+    def trace(self, name: str, **attrs):
+        """
+        Opens a trace for one request. Nested calls record into the outer trace.
+        """
+        outer = self.current
+        if outer is not None:
+            yield outer
+            return
+        if self.profiler is not None and not self.profiler.running:
+            self.profiler.start(stage_of=self.active_stages.get)
+        trace = QueryTrace(name, attrs)
+        self._local.trace = trace
+        start = time.perf_counter()
+        try:
+            yield trace
+        finally:
+            trace.total_ms = 1000 * (time.perf_counter() - start)
+            self._local.trace = None
+            for hook in self.hooks:
+                on_trace = getattr(hook, "on_trace", None)
+                if on_trace is not None:
+                    on_trace(trace)
+
+    @contextmanager
+    def stage(self, name: str, **attrs):
+        """
+        Times one stage of the current trace; call .set(candidates=...) on the yielded record to attach counts.
+        """
+        record = StageRecord(name, attrs)
+        trace = self.current
+        thread_id = threading.get_ident()
+        previous = self.active_stages.get(thread_id)
+        if self.profiler is not None:
+            self.active_stages[thread_id] = name
+        start = time.perf_counter()
+        try:
+            yield record
+        finally:
+            record.ms = 1000 * (time.perf_counter() - start)
+            if self.profiler is not None:
+                if previous is None:
+                    self.active_stages.pop(thread_id, None)
+                else:
+                    self.active_stages[thread_id] = previous
+            if trace is not None:
+                trace.stages.append(record)
+                for hook in self.hooks:
+                    on_stage = getattr(hook, "on_stage", None)
+                    if on_stage is not None:
+                        on_stage(trace, record)
+
+
+class LoggingHook:
+    """
+    Logs every finished trace (at DEBUG by default), e.g. to find slow queries in production logs.
+    slow_ms: If set, traces slower than this are logged at WARNING regardless of level.
+    """
+    def __init__(self, level: int = logging.DEBUG, slow_ms: Optional[float] = None):
+        self.level = level
+        self.slow_ms = slow_ms
+
+    def on_trace(self, trace: QueryTrace):
+        level = logging.WARNING if self.slow_ms is not None and trace.total_ms > self.slow_ms else self.level
+        if logger.isEnabledFor(level):
+            logger.log(level, repr(trace))
+
+
+class _Histogram:
+    __slots__ = ("counts", "count", "total")
+
+    def __init__(self, n_buckets: int):
+        self.counts = [0] * n_buckets
+        self.count = 0
+        self.total = 0.0
+
+
+class MetricsRegistry:
+    """
+    Tracer hook aggregating stage latencies into histograms and candidate counts into sums.
+    Export with write_json(), prometheus_text() or serve_prometheus().
+    """
+    def __init__(self, buckets: Sequence[float] = DEFAULT_BUCKETS, namespace: str = "finance_rag"):
+        self.buckets = tuple(buckets)
+        self.namespace = namespace
+        self._lock = threading.Lock()
+        self._latency: Dict[str, _Histogram] = {}
+        self._candidates: Dict[str, List[float]] = {}  # stage -> [sum, observations]
+        self.traces = 0
+
+    def _observe(self, stage: str, seconds: float):
+        hist = self._latency.get(stage)
+        if hist is None:
+            hist = self._latency[stage] = _Histogram(len(self.buckets))
+        for i, bound in enumerate(self.buckets):
+            if seconds <= bound:
+                hist.counts[i] += 1
+                break
+        hist.count += 1
+        hist.total += seconds
+
+    def on_trace(self, trace: QueryTrace):
+        with self._lock:
+            self.traces += 1
+            self._observe(trace.name, trace.total_ms / 1000)
+            for stage in trace.stages:
+                self._observe(stage.name, stage.ms / 1000)
+                candidates = stage.attrs.get("candidates")
+                if candidates is not None:
+                    acc = self._candidates.setdefault(stage.name, [0.0, 0])
+                    acc[0] += candidates
+                    acc[1] += 1
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            stages = {}
+            for name, hist in self._latency.items():
+                cumulative, running = {}, 0
+                for bound, count in zip(self.buckets, hist.counts):
+                    running += count
+                    cumulative[str(bound)] = running
+                stages[name] = {"count": hist.count, "total_s": hist.total,
+                                "mean_ms": 1000 * hist.total / hist.count if hist.count else 0.0,
+                                "buckets": cumulative}
+                if name in self._candidates:
+                    total, n = self._candidates[name]
+                    stages[name]["mean_candidates"] = total / n if n else 0.0
+            return {"timestamp": time.time(), "traces": self.traces, "stages": stages}
+
+    def write_json(self, path: str):
+        """
+        Writes the current snapshot to a local metrics file (atomically, so readers never see a partial file).
+        """
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        tmp = path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(self.snapshot(), f, indent=2)
+        os.replace(tmp, path)
+
+    def prometheus_text(self) -> str:
+        """
+        Metrics in the Prometheus text exposition format.
+        """
+        ns = self.namespace
+        lines = [f"# HELP {ns}_stage_duration_seconds Time spent per pipeline stage.",
+                 f"# TYPE {ns}_stage_duration_seconds histogram"]
+        with self._lock:
+            for name, hist in sorted(self._latency.items()):
+                running = 0
+                for bound, count in zip(self.buckets, hist.counts):
+                    running += count
+                    lines.append(f'{ns}_stage_duration_seconds_bucket{{stage="{name}",le="{bound}"}} {running}')
+                lines.append(f'{ns}_stage_duration_seconds_bucket{{stage="{name}",le="+Inf"}} {hist.count}')
+                lines.append(f'{ns}_stage_duration_seconds_sum{{stage="{name}"}} {hist.total}')
+                lines.append(f'{ns}_stage_duration_seconds_count{{stage="{name}"}} {hist.count}')
+            lines += [f"# HELP {ns}_stage_candidates Items produced per stage.",
+                      f"# TYPE {ns}_stage_candidates summary"]
+            for name, (total, n) in sorted(self._candidates.items()):
+                lines.append(f'{ns}_stage_candidates_sum{{stage="{name}"}} {total}')
+                lines.append(f'{ns}_stage_candidates_count{{stage="{name}"}} {n}')
+            lines += [f"# HELP {ns}_traces_total Traced requests.", f"# TYPE {ns}_traces_total counter",
+                      f"{ns}_traces_total {self.traces}"]
+        return "\n".join(lines) + "\n"
+
+
+def serve_prometheus(registry: MetricsRegistry, port: int = 9108, host: str = "127.0.0.1") -> ThreadingHTTPServer:
+    """
+    Serves registry.prometheus_text() at http://host:port/metrics from a daemon thread.
+    Call .shutdown() on the returned server to stop it.
+    """
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?")[0] != "/metrics":
+                self.send_error(404)
+                return
+            body = registry.prometheus_text().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            logger.debug(format % args)
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    threading.Thread(target=server.serve_forever, name="prometheus-metrics", daemon=True).start()
+    logger.info(f"Serving metrics at http://{host}:{server.server_address[1]}/metrics")
+    return server
+
+
+class PeriodicJsonExporter:
+    """
+    Writes a MetricsRegistry snapshot to a local file every interval_s seconds from a daemon thread.
+    """
+    def __init__(self, registry: MetricsRegistry, path: str, interval_s: float = 10.0):
+        self.registry = registry
+        self.path = path
+        self.interval_s = interval_s
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self) -> "PeriodicJsonExporter":
+        self._thread = threading.Thread(target=self._run, name="metrics-exporter", daemon=True)
+        self._thread.start()
+        return self
+
+    def _run(self):
+        while not self._stop.wait(self.interval_s):
+            self.registry.write_json(self.path)
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        self.registry.write_json(self.path)
+
+
+class SamplingProfiler:
+    """
+    Low-overhead statistical profiler: a background thread snapshots the Python stacks of all other
+    threads every interval_ms. Stacks are stored collapsed (root;...;leaf) and, when used through a
+    Tracer, prefixed with the pipeline stage the thread was in.
+    Output: write_collapsed() for flame graph tools, top_functions() for a quick summary.
+    """
+    def __init__(self, interval_ms: float = 5.0, max_depth: int = 64):
+        self.interval_ms = interval_ms
+        self.max_depth = max_depth
+        self.samples: Counter = Counter()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._stage_of = None
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self, stage_of=None) -> "SamplingProfiler":
+        """
+        stage_of: Optional callable mapping a thread id to its current stage name (or None).
+        """
+        if self.running:
+            return self
+        self._stage_of = stage_of
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="sampling-profiler", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _run(self):
+        own_id = threading.get_ident()
+        interval = self.interval_ms / 1000
+        while not self._stop.wait(interval):
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id:
+                    continue
+                stack = []
+                while frame is not None and len(stack) < self.max_depth:
+                    code = frame.f_code
+                    stack.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+                    frame = frame.f_back
+                stage = self._stage_of(thread_id) if self._stage_of is not None else None
+                if stage is None and self._stage_of is not None:
+                    continue  # idle or not inside a traced stage
+                key = ";".join(reversed(stack))
+                self.samples[f"{stage};{key}" if stage else key] += 1
+
+    def top_functions(self, n: int = 20) -> List[Dict[str, Any]]:
+        """
+        Functions with the most samples at the top of the stack (self time), with their share of all samples.
+        """
+        total = sum(self.samples.values())
+        leaf = Counter()
+        for stack, count in self.samples.items():
+            leaf[stack.rsplit(";", 1)[-1]] += count
+        return [{"function": fn, "samples": c, "share": c / total} for fn, c in leaf.most_common(n)]
+
+    def stage_samples(self) -> Dict[str, int]:
+        """
+        Samples per pipeline stage (first element of each collapsed stack).
+        """
+        per_stage = Counter()
+        for stack, count in self.samples.items():
+            per_stage[stack.split(";", 1)[0]] += count
+        return dict(per_stage)
+
+    def write_collapsed(self, path: str):
+        """
+        Writes stacks in the collapsed format read by flamegraph.pl and speedscope.
+        """
+        with open(path, "w", encoding="utf-8") as f:
+            for stack, count in self.samples.most_common():
+                f.write(f"{stack} {count}\n")
@@ -0,0 +1,563 @@
+"""
+Late-interaction (ColBERT-style) reranking.
+
+Documents are stored as compressed token embeddings, ColBERTv2-style: every (L2-normalized) token vector is
+replaced by its nearest centroid id plus a residual quantized to residual_bits bits per dimension. A candidate
+is scored by MaxSim, sum over query tokens of the best inner product with any of its token vectors, computed
+for a block of candidates with a single matrix product over their decompressed tokens.
+
+Only the query is encoded at rerank time, so scoring hundreds of candidates costs one encoder call and a
+few matrix products instead of one cross-encoder forward pass per pair.
+
+Pruning: q . (c + r) <= q . c + |r| for a unit query token q, so per query the centroid scores plus each
+centroid's largest residual norm give an upper bound of every document's MaxSim from the (small) set of
+centroids its tokens use. Candidates are scored in decreasing order of that bound and scoring stops as soon
+as the bound of the next one falls below the current k-th best score: skipped documents cannot reach the top-k.
+"""
+import json
+import logging
+import os
+import time
+import numpy as np
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+
+from dense_index import spherical_kmeans
+from embedding_store import _model_slug, content_hash
+from model_registry import ENCODER, get_model
+
+logger = logging.getLogger(__name__)
+
+PRUNE_MODES = (None, "exact", "centroid")
+
+
+def _normalize(vectors: np.ndarray) -> np.ndarray:
+    vectors = np.asarray(vectors, dtype=np.float32)
+    return vectors / np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+
+
+def _ranges(offsets: np.ndarray, rows: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Concatenated positions offsets[r]:offsets[r + 1] for every row r, and the length of each range.
+    """
+    starts = offsets[rows]
+    lengths = offsets[rows + 1] - starts
+    ends = np.cumsum(lengths)
+    positions = np.arange(int(ends[-1]) if len(ends) else 0, dtype=np.int64)
+    positions += np.repeat(starts - (ends - lengths), lengths)
+    return positions, lengths
+
+
+def _segment_max_sum(scores: np.ndarray, lengths: np.ndarray) -> np.ndarray:
+    """
+    scores: (n_query_tokens, sum(lengths)) with the columns of each segment adjacent.
+    Returns per segment the sum over rows of the row maximum within the segment (0 for empty segments).
+    """
+    out = np.zeros(len(lengths), dtype=np.float32)
+    nonempty = lengths > 0
+    if nonempty.any():
+        starts = (np.cumsum(lengths) - lengths)[nonempty]
+        out[nonempty] = np.maximum.reduceat(scores, starts, axis=1).sum(axis=0)
+    return out
+
+
+class LateInteractionIndex:
+    """
+    Compressed token embeddings of a document collection, addressed by key (content hash of the text).
+
+    Arrays (T tokens, N documents, K centroids, d dimensions):
+        centroids       (K, d) unit centroids
+        bucket_cutoffs  (2^bits - 1,) residual quantization boundaries; bucket_weights (2^bits,) their values
+        radius          (K,) largest norm of a decompressed residual assigned to each centroid
+        codes           (T,) centroid id of every token
+        residuals       (T, d * bits / 8) packed residual codes
+        doc_offsets     (N + 1,) tokens of document i are rows doc_offsets[i]:doc_offsets[i + 1]
+        bag_codes       distinct centroid ids of each document, bag_offsets (N + 1,) delimiting them
+
+    n_centroids: Default 2^floor(log2(4 * sqrt(T))) (T estimated from the first build batch), at most one per
+                 16 training tokens.
+    residual_bits: 1, 2, 4 or 8 bits per dimension. 2 bits with 128-dimensional tokens is 32 bytes per token
+                   plus its code, against 256 for float16.
+    """
+    def __init__(self, n_centroids: Optional[int] = None, residual_bits: int = 2, n_iter: int = 10,
+                 train_size: int = 32768, seed: int = 0):
+        if residual_bits not in (1, 2, 4, 8):
+            raise ValueError(f"residual_bits must be 1, 2, 4 or 8, got {residual_bits}")
+        self.n_centroids = n_centroids
+        self.residual_bits = residual_bits
+        self.n_iter = n_iter
+        self.train_size = train_size
+        self.seed = seed
+        self.centroids: Optional[np.ndarray] = None
+        self.bucket_cutoffs: Optional[np.ndarray] = None
+        self.bucket_weights: Optional[np.ndarray] = None
+        self.radius: Optional[np.ndarray] = None
+        self.codes = np.zeros(0, dtype=np.int32)
+        self.residuals = np.zeros((0, 0), dtype=np.uint8)
+        self.doc_offsets = np.zeros(1, dtype=np.int64)
+        self.bag_codes = np.zeros(0, dtype=np.int32)
+        self.bag_offsets = np.zeros(1, dtype=np.int64)
+        self.keys: List[str] = []
+        self._row_of: Dict[str, int] = {}
+        self._decode_table: Optional[np.ndarray] = None
+
+    _ARRAYS = ("centroids", "bucket_cutoffs", "bucket_weights", "radius", "codes", "residuals", "doc_offsets",
+               "bag_codes", "bag_offsets")
+
+    def __len__(self) -> int:
+        return len(self.doc_offsets) - 1
+
+    @property
+    def trained(self) -> bool:
+        return self.centroids is not None
+
+    @property
+    def dim(self) -> int:
+        return int(self.centroids.shape[1])
+
+    @property
+    def num_tokens(self) -> int:
+        return int(self.doc_offsets[-1])
+
+    @property
+    def nbytes(self) -> int:
+        return sum(int(getattr(self, name).nbytes) for name in self._ARRAYS if getattr(self, name) is not None)
+
+    def params(self) -> Dict[str, Any]:
+        return {"n_centroids": self.n_centroids, "residual_bits": self.residual_bits, "n_iter": self.n_iter,
+                "train_size": self.train_size, "seed": self.seed}
+
+    # -- Compression ---------------------------------------------------------------------------------------
+
+    def train(self, vectors: np.ndarray, n_tokens_estimate: Optional[int] = None):
+        """
+        Fits centroids and residual buckets on a sample of (normalized) token vectors.
+        """
+        if vectors.shape[1] * self.residual_bits % 8:
+            raise ValueError(f"dim * residual_bits must be a multiple of 8 (dim {vectors.shape[1]}, "
+                             f"bits {self.residual_bits})")
+        vectors = _normalize(vectors)
+        rng = np.random.default_rng(self.seed)
+        if len(vectors) > self.train_size:
+            vectors = vectors[np.sort(rng.choice(len(vectors), self.train_size, replace=False))]
+        if self.n_centroids is None:
+            n_tokens = max(n_tokens_estimate or len(vectors), 1)
+            self.n_centroids = min(2 ** int(np.floor(np.log2(4 * np.sqrt(n_tokens)))), len(vectors) // 16)
+        self.n_centroids = max(1, min(self.n_centroids, len(vectors)))
+        self.centroids = spherical_kmeans(vectors, self.n_centroids, self.n_iter, self.seed)
+        residuals = (vectors - self.centroids[self._assign(vectors)]).ravel()
+        n_buckets = 1 << self.residual_bits
+        self.bucket_cutoffs = np.quantile(residuals, np.arange(1, n_buckets) / n_buckets).astype(np.float32)
+        self.bucket_weights = np.quantile(residuals, (np.arange(n_buckets) + 0.5) / n_buckets).astype(np.float32)
+        self.radius = np.zeros(self.n_centroids, dtype=np.float32)
+        self.codes = self.codes.astype(self._code_dtype)
+        self.bag_codes = self.bag_codes.astype(self._code_dtype)
+        self.residuals = np.zeros((0, self.dim * self.residual_bits // 8), dtype=np.uint8)
+        self._decode_table = None
+        logger.info(f"Late-interaction centroids trained: {self.n_centroids} centroids on {len(vectors)} tokens.")
+
+    @property
+    def _code_dtype(self):
+        return np.uint16 if self.n_centroids <= 1 << 16 else np.int32
+
+    def _assign(self, vectors: np.ndarray, block_rows: int = 65536) -> np.ndarray:
+        codes = np.empty(len(vectors), dtype=np.int64)
+        for start in range(0, len(vectors), block_rows):
+            codes[start:start + block_rows] = np.argmax(vectors[start:start + block_rows] @ self.centroids.T, axis=1)
+        return codes
+
+    @property
+    def decode_table(self) -> np.ndarray:
+        # Packed byte -> the residual values of the 8 / bits dimensions it holds
+        if self._decode_table is None:
+            bits = self.residual_bits
+            per_byte = 8 // bits
+            shifts = 8 - bits * (np.arange(per_byte) + 1)
+            codes = (np.arange(256)[:, None] >> shifts) & ((1 << bits) - 1)
+            self._decode_table = self.bucket_weights[codes].astype(np.float32)
+        return self._decode_table
+
+    def _compress(self, token_embeddings: Sequence[np.ndarray]) -> Dict[str, np.ndarray]:
+        lengths = np.array([len(t) for t in token_embeddings], dtype=np.int64)
+        vectors = _normalize(np.concatenate([t for t in token_embeddings if len(t)])) if lengths.sum() \
+            else np.zeros((0, self.dim), dtype=np.float32)
+        codes = self._assign(vectors)
+        bucket = np.searchsorted(self.bucket_cutoffs, vectors - self.centroids[codes]).astype(np.uint8)
+        per_byte = 8 // self.residual_bits
+        shifts = (8 - self.residual_bits * (np.arange(per_byte) + 1)).astype(np.uint8)
+        packed = np.bitwise_or.reduce(bucket.reshape(len(vectors), self.dim // per_byte, per_byte) << shifts,
+                                      axis=2).astype(np.uint8)
+
+        residual_norms = np.linalg.norm(self.decode_table[packed].reshape(len(vectors), self.dim), axis=1)
+        radius = np.zeros(self.n_centroids, dtype=np.float32)
+        np.maximum.at(radius, codes, residual_norms)
+
+        # Distinct centroids per document, from sorted (document, centroid) pairs
+        doc_of_token = np.repeat(np.arange(len(lengths), dtype=np.int64), lengths)
+        bag = np.unique(doc_of_token * self.n_centroids + codes)
+        bag_lengths = np.bincount(bag // self.n_centroids, minlength=len(lengths))
+        return {"codes": codes.astype(self._code_dtype), "residuals": packed, "lengths": lengths,
+                "bag_codes": (bag % self.n_centroids).astype(self._code_dtype), "bag_lengths": bag_lengths,
+                "radius": radius}
+
+    def _extend(self, keys: Sequence[str], parts: List[Dict[str, np.ndarray]]):
+        if not parts:
+            return
+        self.codes = np.concatenate([self.codes] + [p["codes"] for p in parts])
+        self.residuals = np.concatenate([self.residuals] + [p["residuals"] for p in parts])
+        self.bag_codes = np.concatenate([self.bag_codes] + [p["bag_codes"] for p in parts])
+        lengths = np.concatenate([p["lengths"] for p in parts])
+        bag_lengths = np.concatenate([p["bag_lengths"] for p in parts])
+        self.doc_offsets = np.concatenate([self.doc_offsets, self.doc_offsets[-1] + np.cumsum(lengths)])
+        self.bag_offsets = np.concatenate([self.bag_offsets, self.bag_offsets[-1] + np.cumsum(bag_lengths)])
+        self.radius = np.maximum.reduce([self.radius] + [p["radius"] for p in parts])
+        for key in keys:
+            self._row_of[key] = len(self.keys)
+            self.keys.append(key)
+
+    def build(self, keys: Sequence[str], batches: Iterable[List[np.ndarray]]) -> "LateInteractionIndex":
+        """
+        Compresses the token embeddings of len(keys) documents, streamed in batches (lists of (n_tokens, d)
+        arrays, in key order). Centroids are trained on the first batches, up to train_size tokens.
+        """
+        buffered: List[np.ndarray] = []
+        parts = []
+        for batch in batches:
+            if not self.trained:
+                buffered.extend(batch)
+                if sum(len(t) for t in buffered) < self.train_size:
+                    continue
+                batch, buffered = buffered, []
+                self.train(np.concatenate([t for t in batch if len(t)]),
+                           int(len(keys) * sum(len(t) for t in batch) / max(len(batch), 1)))
+            parts.append(self._compress(batch))
+        if buffered:
+            if not self.trained:
+                self.train(np.concatenate([t for t in buffered if len(t)]), sum(len(t) for t in buffered))
+            parts.append(self._compress(buffered))
+        if sum(len(p["lengths"]) for p in parts) != len(keys):
+            raise ValueError("Number of token embedding arrays does not match the number of keys.")
+        self._extend(keys, parts)
+        logger.info(f"Late-interaction index: {len(self)} documents, {self.num_tokens} tokens, "
+                    f"{self.nbytes / max(self.num_tokens, 1):.1f} bytes per token.")
+        return self
+
+    def add(self, keys: Sequence[str], token_embeddings: Sequence[np.ndarray]):
+        """
+        Appends documents, compressed against the existing centroids.
+        """
+        if not self.trained:
+            self.build(keys, [list(token_embeddings)])
+            return
+        if token_embeddings:
+            self._extend(keys, [self._compress(token_embeddings)])
+
+    def rows(self, keys: Sequence[str]) -> np.ndarray:
+        """
+        Row of every key, -1 for keys not in the index.
+        """
+        return np.array([self._row_of.get(key, -1) for key in keys], dtype=np.int64)
+
+    def take(self, rows: np.ndarray) -> "LateInteractionIndex":
+        """
+        Index over the given rows only (same centroids), e.g. to drop documents no longer in the corpus.
+        """
+        rows = np.asarray(rows, dtype=np.int64)
+        index = LateInteractionIndex(**self.params())
+        for name in ("centroids", "bucket_cutoffs", "bucket_weights", "radius"):
+            setattr(index, name, getattr(self, name))
+        tokens, lengths = _ranges(self.doc_offsets, rows)
+        bag, bag_lengths = _ranges(self.bag_offsets, rows)
+        index.codes = np.asarray(self.codes[tokens])
+        index.residuals = np.asarray(self.residuals[tokens])
+        index.bag_codes = np.asarray(self.bag_codes[bag])
+        index.doc_offsets = np.concatenate([[0], np.cumsum(lengths)]).astype(np.int64)
+        index.bag_offsets = np.concatenate([[0], np.cumsum(bag_lengths)]).astype(np.int64)
+        index.keys = [self.keys[row] for row in rows]
+        index._row_of = {key: row for row, key in enumerate(index.keys)}
+        return index
+
+    # -- Scoring -------------------------------------------------------------------------------------------
+
+    def _residual_vectors(self, tokens: np.ndarray) -> np.ndarray:
+        # np.take is several times faster than fancy indexing for these row gathers
+        return np.take(self.decode_table, self.residuals[tokens], axis=0).reshape(len(tokens), self.dim)
+
+    def decompress(self, tokens: np.ndarray) -> np.ndarray:
+        """
+        Approximate token vectors (centroid + dequantized residual) of the given token positions.
+        """
+        return np.take(self.centroids, self.codes[tokens], axis=0) + self._residual_vectors(tokens)
+
+    def maxsim(self, query: np.ndarray, rows: np.ndarray, centroid_scores: Optional[np.ndarray] = None) -> np.ndarray:
+        """
+        MaxSim score of every row for one query's (n_query_tokens, d) normalized token matrix.
+        centroid_scores: query @ centroids.T, if already computed.
+        """
+        if centroid_scores is None:
+            centroid_scores = query @ self.centroids.T
+        tokens, lengths = _ranges(self.doc_offsets, np.asarray(rows, dtype=np.int64))
+        # q . (c + r): the centroid part is looked up rather than decompressed
+        scores = np.take(centroid_scores, self.codes[tokens], axis=1)
+        scores += query @ self._residual_vectors(tokens).T
+        return _segment_max_sum(scores, lengths)
+
+    def _bag_scores(self, centroid_scores: np.ndarray, rows: np.ndarray) -> np.ndarray:
+        # Per row, sum over query tokens of the best score among the centroids its tokens use
+        bag, lengths = _ranges(self.bag_offsets, np.asarray(rows, dtype=np.int64))
+        return _segment_max_sum(np.take(centroid_scores, self.bag_codes[bag], axis=1), lengths)
+
+    def upper_bounds(self, query: np.ndarray, rows: np.ndarray) -> np.ndarray:
+        """
+        Upper bound of maxsim() for every row, from the centroids its tokens use.
+        """
+        # Small margin for float32 rounding of the exact scores
+        return self._bag_scores(query @ self.centroids.T + (self.radius + 1e-5), rows)
+
+    def search(self, query: np.ndarray, rows: np.ndarray, k: int, prune: Optional[str] = "exact",
+               centroid_keep: int = 4, block_docs: int = 64,
+               competing: Optional[np.ndarray] = None) -> Tuple[np.ndarray, int]:
+        """
+        MaxSim scores of the rows that may reach the top-k, -inf for the rows pruned without scoring.
+        prune: None scores every row.
+               'exact' scores rows in decreasing order of upper_bounds() until no remaining row can reach the
+               top-k; the top-k is the same as without pruning.
+               'centroid' (approximate, as PLAID) scores only the centroid_keep * k rows with the best
+               centroid-only MaxSim; much cheaper, but a document whose residuals matter can be missed.
+        competing: Scores of other candidates (e.g. scored outside the index) that also take top-k places.
+        Returns (scores aligned with rows, number of rows scored).
+        """
+        if prune not in PRUNE_MODES:
+            raise ValueError(f"Unknown pruning mode: {prune} (expected one of {PRUNE_MODES})")
+        rows = np.asarray(rows, dtype=np.int64)
+        centroid_scores = query @ self.centroids.T
+        if prune is None or len(rows) <= k:
+            return self.maxsim(query, rows, centroid_scores), len(rows)
+        scores = np.full(len(rows), -np.inf, dtype=np.float32)
+        if prune == "centroid":
+            keep = np.argsort(-self._bag_scores(centroid_scores, rows), kind="stable")[:centroid_keep * k]
+            scores[keep] = self.maxsim(query, rows[keep], centroid_scores)
+            return scores, len(keep)
+
+        bounds = self._bag_scores(centroid_scores + (self.radius + 1e-5), rows)
+        order = np.argsort(-bounds, kind="stable")
+        pool = [np.asarray(competing, dtype=np.float32)] if competing is not None else []
+        kth = -np.inf
+        done = 0
+        while done < len(order):
+            if bounds[order[done]] < kth:
+                break
+            block = order[done:done + (block_docs if done else max(k, block_docs))]
+            scores[block] = self.maxsim(query, rows[block], centroid_scores)
+            pool.append(scores[block])
+            done += len(block)
+            merged = np.concatenate(pool)
+            pool = [merged]
+            if len(merged) >= k:
+                kth = np.partition(merged, len(merged) - k)[len(merged) - k]
+        return scores, done
+
+    # -- Persistence ---------------------------------------------------------------------------------------
+
+    def save(self, path: str):
+        """
+        Writes the index as .npy files plus meta.json under path; meta.json is replaced last.
+        """
+        os.makedirs(path, exist_ok=True)
+        for name in self._ARRAYS:
+            tmp = os.path.join(path, f"{name}.{os.getpid()}.tmp.npy")
+            np.save(tmp, getattr(self, name))
+            os.replace(tmp, os.path.join(path, f"{name}.npy"))
+        tmp = os.path.join(path, f"meta.json.{os.getpid()}.tmp")
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump({"params": self.params(), "keys": self.keys}, f)
+        os.replace(tmp, os.path.join(path, "meta.json"))
+
+    @classmethod
+    def load(cls, path: str) -> Optional["LateInteractionIndex"]:
+        """
+        Loads a saved index (token arrays memory-mapped), or returns None if there is none or it is inconsistent.
+        """
+        meta_path = os.path.join(path, "meta.json")
+        if not os.path.exists(meta_path):
+            return None
+        with open(meta_path, "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        index = cls(**meta["params"])
+        try:
+            for name in cls._ARRAYS:
+                setattr(index, name, np.load(os.path.join(path, f"{name}.npy"), mmap_mode="r"))
+        except (OSError, ValueError):
+            return None
+        index.keys = meta["keys"]
+        if len(index) != len(index.keys) or index.num_tokens != len(index.codes):
+            logger.warning(f"Late-interaction index at {path} is inconsistent, ignoring it.")
+            return None
+        index._row_of = {key: row for row, key in enumerate(index.keys)}
+        return index
+
+
+class LateInteractionReranker:
+    """
+    Reranker scoring candidates by MaxSim against a LateInteractionIndex of the corpus.
+    Plugs into a RerankCascade as RerankStage(model_name, candidates, reranker=LateInteractionReranker(...));
+    FinanceRAGSystem.index_data() builds the index through index_corpus().
+
+    Candidates are looked up by the content hash of their text, so documents added or edited after
+    index_corpus() are still scored correctly: they are encoded at rerank time (counted as docs_encoded).
+    """
+    def __init__(self, model_name: str = 'BAAI/bge-m3', encoder: Optional[Any] = None,
+                 store_dir: Optional[str] = None, n_centroids: Optional[int] = None, residual_bits: int = 2,
+                 batch_size: int = 32, prune: Optional[str] = "exact", centroid_keep: int = 4,
+                 block_docs: int = 64):
+        """
+        model_name, encoder: Token encoder, with a SentenceTransformer-compatible
+                             encode(texts, output_value='token_embeddings'); loaded from model_name through
+                             model_registry on first use when None. The default reuses the dense retrieval model.
+        store_dir: If set, the index is persisted under <store_dir>/late_interaction/<model> and reused;
+                   only documents not in it are encoded.
+        prune, centroid_keep: Candidate pruning, see LateInteractionIndex.search(). 'exact' (default) never changes
+                              the top-k; 'centroid' fully scores only centroid_keep * top_k candidates.
+        block_docs: Candidates scored per matrix product.
+        """
+        self.model_name = model_name
+        self._encoder = encoder
+        self.store_dir = store_dir
+        self.batch_size = batch_size
+        if prune not in PRUNE_MODES:
+            raise ValueError(f"Unknown pruning mode: {prune} (expected one of {PRUNE_MODES})")
+        self.prune = prune
+        self.centroid_keep = centroid_keep
+        self.block_docs = block_docs
+        self.index = LateInteractionIndex(n_centroids=n_centroids, residual_bits=residual_bits)
+        self.pairs_requested = 0
+        self.docs_scored = 0
+        self.docs_encoded = 0
+        self.query_ms = 0.0
+        self.queries = 0
+
+    @property
+    def encoder(self):
+        if self._encoder is None:
+            self._encoder = get_model(ENCODER, self.model_name)
+        return self._encoder
+
+    @encoder.setter
+    def encoder(self, encoder):
+        self._encoder = encoder
+
+    @property
+    def index_path(self) -> Optional[str]:
+        return os.path.join(self.store_dir, "late_interaction", _model_slug(self.model_name)) if self.store_dir \
+            else None
+
+    def encode_tokens(self, texts: List[str], batch_size: Optional[int] = None) -> List[np.ndarray]:
+        """
+        Normalized (n_tokens, d) float32 token embeddings of every text.
+        """
+        if not texts:
+            return []
+        embeddings = self.encoder.encode(texts, batch_size=batch_size or self.batch_size,
+                                         output_value="token_embeddings", show_progress_bar=False)
+        out = []
+        for tokens in embeddings:
+            if hasattr(tokens, "detach"):  # torch tensor
+                tokens = tokens.detach().float().cpu().numpy()
+            out.append(_normalize(tokens))
+        return out
+
+    def index_corpus(self, corpus: List[Dict[str, str]], encode_batch_docs: int = 1024):
+        """
+        Encodes and compresses the token embeddings of the corpus documents not already in the index.
+        """
+        start = time.perf_counter()
+        texts = [doc['text'] for doc in corpus]
+        keys = [content_hash(text) for text in texts]
+        if self.index_path is not None and len(self.index) == 0:
+            self.index = LateInteractionIndex.load(self.index_path) or self.index
+        missing, seen = [], set()
+        for i, row in enumerate(self.index.rows(keys)):
+            # Repeated texts are encoded once
+            if row < 0 and keys[i] not in seen:
+                seen.add(keys[i])
+                missing.append(i)
+        logger.info(f"Late-interaction index: {len(keys) - len(missing)} documents reused, {len(missing)} to encode.")
+        if missing:
+            batches = (self.encode_tokens([texts[i] for i in missing[offset:offset + encode_batch_docs]])
+                       for offset in range(0, len(missing), encode_batch_docs))
+            if self.index.trained:
+                for offset, batch in zip(range(0, len(missing), encode_batch_docs), batches):
+                    self.index.add([keys[i] for i in missing[offset:offset + encode_batch_docs]], batch)
+            else:
+                self.index.build([keys[i] for i in missing], batches)
+        changed = bool(missing)
+        # Drop documents of earlier corpora once they are most of the index
+        if len(self.index) > 2 * len(set(keys)):
+            self.index = self.index.take(np.unique(self.index.rows(keys)))
+            changed = True
+        if changed and self.index_path is not None:
+            self.index.save(self.index_path)
+        logger.info(f"Late-interaction index ready in {time.perf_counter() - start:.1f}s.")
+
+    def _score(self, query: np.ndarray, docs: List[Any], top_k: int,
+               extra: Dict[str, np.ndarray]) -> np.ndarray:
+        keys = [content_hash(doc.text) for doc in docs]
+        rows = self.index.rows(keys)
+        scores = np.full(len(docs), -np.inf, dtype=np.float32)
+        outside = np.where(rows < 0)[0]
+        for i in outside:
+            tokens = extra[keys[i]]
+            scores[i] = float((query @ tokens.T).max(axis=1).sum()) if len(tokens) else 0.0
+        inside = np.where(rows >= 0)[0]
+        if len(inside):
+            scores[inside], scored = self.index.search(query, rows[inside], top_k, prune=self.prune,
+                                                       centroid_keep=self.centroid_keep, block_docs=self.block_docs,
+                                                       competing=scores[outside])
+            self.docs_scored += scored
+        self.docs_scored += len(outside)
+        return scores
+
+    def rerank_batch(self, queries: List[str], results_list: List[List[Any]], top_k: int = 10,
+                     batch_size: Optional[int] = None) -> List[List[Any]]:
+        """
+        Reranks the candidates of many queries; returns the top_k of each. Candidates pruned without
+        scoring could not have made the top_k.
+        """
+        start = time.perf_counter()
+        query_tokens = self.encode_tokens(list(queries), batch_size)
+        # Candidates outside the index are encoded together, once per distinct text
+        extra: Dict[str, np.ndarray] = {}
+        candidates = {content_hash(doc.text): doc.text for results in results_list for doc in results}
+        unknown = [key for key, row in zip(candidates, self.index.rows(list(candidates))) if row < 0]
+        if unknown:
+            extra = dict(zip(unknown, self.encode_tokens([candidates[key] for key in unknown], batch_size)))
+            self.docs_encoded += len(unknown)
+
+        reranked = []
+        for query, results in zip(query_tokens, results_list):
+            self.pairs_requested += len(results)
+            if not results:
+                reranked.append([])
+                continue
+            scores = self._score(query, results, top_k, extra)
+            kept = [(doc, score) for doc, score in zip(results, scores) if score > -np.inf]
+            for doc, score in kept:
+                doc.score = float(score)
+            kept.sort(key=lambda x: x[1], reverse=True)
+            reranked.append([doc for doc, _ in kept[:top_k]])
+        self.query_ms += 1000 * (time.perf_counter() - start)
+        self.queries += len(queries)
+        return reranked
+
+    def rerank(self, query: str, results: List[Any], top_k: int = 10) -> List[Any]:
+        return self.rerank_batch([query], [results], top_k=top_k)[0]
+
+    def stats(self) -> Dict[str, float]:
+        return {
+            "pairs_requested": self.pairs_requested,
+            "docs_scored": self.docs_scored,
+            "docs_pruned": self.pairs_requested - self.docs_scored,
+            "docs_encoded": self.docs_encoded,
+            "ms_per_query": self.query_ms / self.queries if self.queries else 0.0,
+            "index_bytes": self.index.nbytes,
+            "index_tokens": self.index.num_tokens,
+        }
@@ -0,0 +1,197 @@
+import logging
+import re
+import numpy as np
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Set, Tuple
+
+from financial_lexicon import FinancialLexicon, LexiconSpan
+
+logger = logging.getLogger(__name__)
+
+METADATA_FIELDS = ("company", "fiscal_year", "fiscal_quarter", "filing_type")
+
+FILING_TYPE_PATTERN = re.compile(r"\b(10-K|10-Q|8-K|20-F|40-F|S-1|DEF\s?14A)\b", re.IGNORECASE)
+_QUARTER_WORDS = {"first": 1, "second": 2, "third": 3, "fourth": 4}
+_BARE_YEAR = re.compile(r"(?:19|20)\d{2}")
+
+
+def parse_period(text: str) -> Tuple[Optional[int], Optional[int]]:
+    """
+    (fiscal year, fiscal quarter) of a period span such as 'FY2019', "FY'21", 'Q3 2021' or 'fourth quarter of 2020'.
+    """
+    year = None
+    quarter = None
+    m = re.search(r"(\d{4})|(?:FY\s?'?|'|Q[1-4]\s?(?:FY)?\s?'?)(\d{2})\b", text, re.IGNORECASE)
+    if m:
+        year = int(m.group(1)) if m.group(1) else 2000 + int(m.group(2))
+    m = re.search(r"\bQ([1-4])", text, re.IGNORECASE)
+    if m:
+        quarter = int(m.group(1))
+    else:
+        m = re.search(r"\b(first|second|third|fourth)\s+quarter", text, re.IGNORECASE)
+        if m:
+            quarter = _QUARTER_WORDS[m.group(1).lower()]
+    return year, quarter
+
+
+def normalize_value(field: str, value: Any) -> Any:
+    if field in ("fiscal_year", "fiscal_quarter"):
+        return int(value)
+    if field == "filing_type":
+        return re.sub(r"\s+", " ", str(value)).upper()
+    return str(value).lower()
+
+
+def metadata_from_spans(spans: Iterable[LexiconSpan], bare_years: bool = True) -> Dict[str, Set[Any]]:
+    """
+    Structured metadata implied by typed lexicon spans (entities -> company, periods -> year/quarter).
+    bare_years: Whether a lone 4-digit number such as '2019' counts as a fiscal year, or only period-shaped
+                spans ('FY2019', 'Q3 2019', 'fiscal 2019') do.
+    """
+    meta: Dict[str, Set[Any]] = {}
+    for span in spans:
+        if span.type == "entity":
+            meta.setdefault("company", set()).add(normalize_value("company", span.canonical))
+        elif span.type == "period":
+            if not bare_years and _BARE_YEAR.fullmatch(span.text):
+                continue
+            year, quarter = parse_period(span.text)
+            if year is not None:
+                meta.setdefault("fiscal_year", set()).add(year)
+            if quarter is not None:
+                meta.setdefault("fiscal_quarter", set()).add(quarter)
+    return meta
+
+
+def extract_metadata(text: str, lexicon: FinancialLexicon) -> Dict[str, Set[Any]]:
+    """
+    Company, fiscal year/quarter and filing type mentioned in a document.
+    """
+    meta = metadata_from_spans(lexicon.tag(text, types=("entity", "period")))
+    for m in FILING_TYPE_PATTERN.finditer(text):
+        meta.setdefault("filing_type", set()).add(normalize_value("filing_type", m.group(1)))
+    return meta
+
+
+def explicit_metadata(doc: Dict[str, Any]) -> Dict[str, Set[Any]]:
+    """
+    Metadata given with a corpus entry, either as top-level keys or under doc['metadata'].
+    """
+    source = dict(doc.get("metadata") or {})
+    source.update({k: doc[k] for k in METADATA_FIELDS if k in doc})
+    meta: Dict[str, Set[Any]] = {}
+    for field in METADATA_FIELDS:
+        value = source.get(field)
+        if value is None:
+            continue
+        values = value if isinstance(value, (list, tuple, set)) else [value]
+        meta[field] = {normalize_value(field, v) for v in values}
+    return meta
+
+
+class MetadataIndex:
+    """
+    Per-field inverted index from metadata value to the sorted int32 array of document rows holding it.
+
+    select() turns filter predicates into the sorted row subset to score: values of one field are OR-ed,
+    fields are AND-ed. With include_missing=True a document without any value for a field passes that
+    field's filter (used for filters guessed from query spans).
+    """
+    def __init__(self, doc_metadata: Sequence[Dict[str, Set[Any]]]):
+        self.num_docs = len(doc_metadata)
+        postings: Dict[str, Dict[Any, List[int]]] = {field: {} for field in METADATA_FIELDS}
+        for row, meta in enumerate(doc_metadata):
+            for field, values in meta.items():
+                for value in values:
+                    postings.setdefault(field, {}).setdefault(value, []).append(row)
+        self.postings: Dict[str, Dict[Any, np.ndarray]] = {
+            field: {value: np.asarray(rows, dtype=np.int32) for value, rows in values.items()}
+            for field, values in postings.items()
+        }
+        self.has_field: Dict[str, np.ndarray] = {
+            field: (np.unique(np.concatenate(list(values.values()))) if values else np.zeros(0, dtype=np.int32))
+            for field, values in self.postings.items()
+        }
+
+    def extend(self, doc_metadata: Sequence[Dict[str, Set[Any]]]):
+        """
+        Appends documents as rows num_docs, num_docs + 1, ... (row arrays stay sorted).
+        """
+        added: Dict[str, Dict[Any, List[int]]] = {}
+        for row, meta in enumerate(doc_metadata, start=self.num_docs):
+            for field, values in meta.items():
+                for value in values:
+                    added.setdefault(field, {}).setdefault(value, []).append(row)
+        for field, values in added.items():
+            postings = self.postings.setdefault(field, {})
+            for value, rows in values.items():
+                postings[value] = np.concatenate([postings.get(value, np.zeros(0, dtype=np.int32)),
+                                                  np.asarray(rows, dtype=np.int32)])
+            self.has_field[field] = np.union1d(self.has_field.get(field, np.zeros(0, dtype=np.int32)),
+                                               np.unique(np.asarray([r for rows in values.values() for r in rows],
+                                                                    dtype=np.int32)))
+        self.num_docs += len(doc_metadata)
+
+    def take(self, rows: np.ndarray) -> "MetadataIndex":
+        """
+        Index over the given sorted rows only, renumbered 0 .. len(rows) - 1 in order.
+        """
+        rows = np.asarray(rows, dtype=np.int32)
+        index = MetadataIndex([])
+        index.num_docs = len(rows)
+
+        def remap(field_rows: np.ndarray) -> np.ndarray:
+            kept = field_rows[np.isin(field_rows, rows, assume_unique=True)]
+            return np.searchsorted(rows, kept).astype(np.int32)
+
+        for field, values in self.postings.items():
+            index.postings[field] = {}
+            for value, value_rows in values.items():
+                remapped = remap(value_rows)
+                if len(remapped):
+                    index.postings[field][value] = remapped
+        index.has_field = {field: remap(field_rows) for field, field_rows in self.has_field.items()}
+        return index
+
+    def row_metadata(self, row: int) -> Dict[str, Set[Any]]:
+        """
+        Values held by one row. Scans every posting array, so only meant for occasional lookups.
+        """
+        meta: Dict[str, Set[Any]] = {}
+        for field, values in self.postings.items():
+            for value, rows in values.items():
+                i = np.searchsorted(rows, row)
+                if i < len(rows) and rows[i] == row:
+                    meta.setdefault(field, set()).add(value)
+        return meta
+
+    def values(self, field: str) -> List[Any]:
+        return list(self.postings.get(field, {}))
+
+    def select(self, filters: Dict[str, Any], include_missing: bool = False) -> np.ndarray:
+        """
+        Sorted row ids matching all filters. filters: {field: value or list of values}.
+        """
+        subset = None
+        for field, value in filters.items():
+            if field not in self.postings:
+                raise ValueError(f"Unknown metadata field: {field} (expected one of {list(self.postings)})")
+            values = value if isinstance(value, (list, tuple, set)) else [value]
+            parts = [self.postings[field].get(normalize_value(field, v)) for v in values]
+            parts = [p for p in parts if p is not None]
+            rows = np.unique(np.concatenate(parts)) if parts else np.zeros(0, dtype=np.int32)
+            if include_missing:
+                missing = np.setdiff1d(np.arange(self.num_docs, dtype=np.int32), self.has_field[field],
+                                       assume_unique=True)
+                rows = np.union1d(rows, missing)
+            subset = rows if subset is None else np.intersect1d(subset, rows, assume_unique=True)
+        if subset is None:
+            return np.arange(self.num_docs, dtype=np.int32)
+        return subset.astype(np.int32)
+
+    @staticmethod
+    def filters_from_spans(spans: Iterable[LexiconSpan]) -> Dict[str, List[Any]]:
+        """
+        Filter predicates implied by the typed spans of a query (company, fiscal year, fiscal quarter).
+        Bare numbers are not read as years: in 'revenue above $2000 million' the 2000 is an amount, not FY2000.
+        """
+        return {field: sorted(values) for field, values in metadata_from_spans(spans, bare_years=False).items()}
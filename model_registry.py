@@ -0,0 +1,182 @@
+"""
+Process-wide registry of neural models (sentence encoders, cross-encoders).
+
+sentence_transformers (and with it torch) is only imported when a model is first needed, and each model is
+loaded once per process: every retriever or reranker asking for the same (kind, name) shares one instance.
+Callers that only use BM25, metadata filtering or span extraction never import either library.
+
+preload() loads models up front, e.g. in the parent process of a server or batch job before it forks its
+workers. Forked workers then find the models already registered and share their weights copy-on-write
+instead of each loading a private copy.
+
+load_encoder() / load_reranker_model() resolve the model names taken by the benchmark and evaluation scripts,
+where 'stub' selects a deterministic stand-in (StubEncoder, StubCrossEncoder) that needs no model download.
+"""
+import gc
+import logging
+import os
+import threading
+import time
+import zlib
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+ENCODER = "encoder"
+CROSS_ENCODER = "cross_encoder"
+
+
+def _load_sentence_transformer(name: str):
+    from sentence_transformers import SentenceTransformer
+    return SentenceTransformer(name)
+
+
+def _load_cross_encoder(name: str):
+    from sentence_transformers import CrossEncoder
+    return CrossEncoder(name)
+
+
+LOADERS: Dict[str, Callable[[str], Any]] = {
+    ENCODER: _load_sentence_transformer,
+    CROSS_ENCODER: _load_cross_encoder,
+}
+
+_models: Dict[Tuple[str, str], Any] = {}
+_load_seconds: Dict[Tuple[str, str], float] = {}
+# Serializes loads so concurrent first requests (e.g. server threads) do not load the same model twice
+_lock = threading.Lock()
+
+
+def get_model(kind: str, name: str) -> Any:
+    """
+    The registered model of this kind and name, loading it on first use.
+    """
+    key = (kind, name)
+    model = _models.get(key)
+    if model is not None:
+        return model
+    if kind not in LOADERS:
+        raise ValueError(f"Unknown model kind: {kind} (expected one of {sorted(LOADERS)})")
+    with _lock:
+        model = _models.get(key)
+        if model is None:
+            logger.info(f"Loading {kind} model: {name}")
+            start = time.perf_counter()
+            model = LOADERS[kind](name)
+            _load_seconds[key] = time.perf_counter() - start
+            _models[key] = model
+            logger.info(f"Loaded {kind} model {name} in {_load_seconds[key]:.2f}s.")
+    return model
+
+
+def register(kind: str, name: str, model: Any):
+    """
+    Registers a prebuilt model (e.g. a stub or a fine-tuned instance) under a name.
+    """
+    with _lock:
+        _models[(kind, name)] = model
+
+
+def preload(encoders: Iterable[str] = (), cross_encoders: Iterable[str] = (), freeze: bool = True):
+    """
+    Loads models ahead of their first use.
+    freeze: Move everything allocated so far out of the cyclic garbage collector's reach (gc.freeze()), so
+            collections in forked workers do not write to, and thereby copy, the pages holding the models.
+    """
+    for name in encoders:
+        get_model(ENCODER, name)
+    for name in cross_encoders:
+        get_model(CROSS_ENCODER, name)
+    if freeze:
+        gc.freeze()
+
+
+def loaded() -> List[Tuple[str, str]]:
+    return list(_models)
+
+
+def load_seconds() -> Dict[str, float]:
+    return {f"{kind}:{name}": seconds for (kind, name), seconds in _load_seconds.items()}
+
+
+def clear():
+    """
+    Drops every registered model (they are freed once no component references them).
+    """
+    with _lock:
+        _models.clear()
+        _load_seconds.clear()
+
+
+# ---------------------------------------------------------------------------
+# Stub models
+# ---------------------------------------------------------------------------
+
+class StubEncoder:
+    """
+    Deterministic SentenceTransformer stand-in: hashed bag of words times a fixed random projection.
+    Similar texts get similar vectors, so dense retrieval results stay meaningful.
+    output_value='token_embeddings' returns the projected vector of every word instead.
+    """
+    def __init__(self, dim: int = 128, n_buckets: int = 1 << 16, seed: int = 0):
+        self.dim = dim
+        self.n_buckets = n_buckets
+        self.projection = np.random.default_rng(seed).standard_normal((n_buckets, dim)).astype(np.float32)
+        self._buckets: Dict[str, int] = {}
+
+    def _bucket(self, token: str) -> int:
+        b = self._buckets.get(token)
+        if b is None:
+            b = self._buckets[token] = zlib.crc32(token.encode("utf-8")) % self.n_buckets
+        return b
+
+    def encode(self, texts: List[str], batch_size: int = 32, convert_to_numpy: bool = True,
+               normalize_embeddings: bool = True, show_progress_bar: bool = False,
+               output_value: Optional[str] = "sentence_embedding", **kwargs):
+        if output_value == "token_embeddings":
+            # One vector per word, as late-interaction models use them
+            return [self.projection[[self._bucket(t) for t in text.lower().split()]] for text in texts]
+        out = np.empty((len(texts), self.dim), dtype=np.float32)
+        for start in range(0, len(texts), 4096):
+            for row, text in enumerate(texts[start:start + 4096], start):
+                buckets = [self._bucket(t) for t in text.lower().split()]
+                out[row] = self.projection[buckets].sum(axis=0) if buckets else 0.0
+        if normalize_embeddings:
+            norms = np.linalg.norm(out, axis=1, keepdims=True)
+            out /= np.maximum(norms, 1e-12)
+        return out
+
+
+class StubCrossEncoder:
+    """
+    Deterministic CrossEncoder stand-in: query-term overlap normalized by passage length.
+    cost_ms_per_pair optionally simulates model latency.
+    """
+    def __init__(self, cost_ms_per_pair: float = 0.0):
+        self.cost_ms_per_pair = cost_ms_per_pair
+
+    def predict(self, pairs: List[List[str]], batch_size: int = 32, **kwargs) -> np.ndarray:
+        scores = np.empty(len(pairs), dtype=np.float32)
+        for i, (query, passage) in enumerate(pairs):
+            q_terms = set(query.lower().split())
+            p_terms = passage.lower().split()
+            scores[i] = sum(t in q_terms for t in p_terms) / np.sqrt(len(p_terms) + 1)
+        if self.cost_ms_per_pair:
+            time.sleep(self.cost_ms_per_pair * len(pairs) / 1000)
+        return scores
+
+
+def load_encoder(name: str):
+    if name == "stub":
+        return StubEncoder()
+    os.environ.setdefault("HF_HUB_OFFLINE", "1")
+    return get_model(ENCODER, name)
+
+
+def load_reranker_model(name: str, cost_ms_per_pair: float):
+    if name == "stub":
+        return StubCrossEncoder(cost_ms_per_pair)
+    os.environ.setdefault("HF_HUB_OFFLINE", "1")
+    return get_model(CROSS_ENCODER, name)
@@ -0,0 +1,197 @@
+"""
+Near-duplicate detection with MinHash signatures and LSH banding.
+
+SEC filings repeat boilerplate (risk factors, forward-looking statement disclaimers, tables carried from the
+10-K into the 10-Q), so many chunks are copies of each other up to a few words. Each text is reduced to a
+MinHash signature of its word shingles; the fraction of equal signature entries estimates the Jaccard
+similarity of two shingle sets. Signatures are cut into bands, and only texts sharing a band with an earlier
+one are compared, so finding the duplicates of a text costs O(bands) lookups instead of a pass over the corpus.
+
+Clustering is greedy in insertion order: a text joins the cluster of the most similar earlier representative
+whose estimated similarity reaches the threshold, or becomes a representative itself. Only representatives are
+stored (one signature and one bucket entry per band each), so memory grows with the number of distinct texts
+and the same index serves the in-memory and the streaming chunking pipelines.
+"""
+import re
+import zlib
+from functools import lru_cache
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+_TOKEN = re.compile(r"\w+")
+_MASK = np.uint64(0xFFFFFFFF)
+_SHIFT = np.uint64(32)
+_SHINGLE_BASE = np.uint64(0x9E3779B1)
+_BLOCK = 4096  # shingles hashed at once: keeps the (num_perm, shingles) uint64 intermediate cache-sized
+_WORD_CACHE = 1 << 20
+
+
+@lru_cache(maxsize=None)
+def lsh_params(threshold: float, num_perm: int) -> Tuple[int, int]:
+    """
+    (bands, rows per band) minimising the probability mass of false positives below threshold plus false
+    negatives above it, for a signature of num_perm entries.
+    """
+    s = np.linspace(0.0, 1.0, 1001)  # uniform grid: the mean over it approximates the integral over [0, 1]
+    best, best_error = (1, num_perm), float("inf")
+    for rows in range(1, num_perm + 1):
+        bands = num_perm // rows
+        candidate = 1.0 - (1.0 - s ** rows) ** bands
+        error = np.where(s < threshold, candidate, 1.0 - candidate).mean()
+        if error < best_error:
+            best, best_error = (bands, rows), error
+    return best
+
+
+class NearDuplicateIndex:
+    """
+    Incremental MinHash/LSH index over representative texts, keyed by caller ids.
+    threshold: Minimum estimated Jaccard similarity of the word shingle sets for a text to count as a duplicate.
+    num_perm: Signature length; more entries give a tighter similarity estimate at a higher hashing cost.
+    shingle_size: Words per shingle (texts with fewer words form a single shingle).
+    """
+    def __init__(self, threshold: float = 0.8, num_perm: int = 128, shingle_size: int = 5, seed: int = 0):
+        if not 0.0 < threshold <= 1.0:
+            raise ValueError(f"threshold must be in (0, 1], got {threshold}")
+        self.threshold = threshold
+        self.num_perm = num_perm
+        self.shingle_size = shingle_size
+        self.bands, self.rows = lsh_params(threshold, num_perm)
+        rng = np.random.default_rng(seed)
+        # Multiply-add-shift hashing of 32-bit shingle hashes: the top 32 bits of (a * x + b) mod 2^64
+        self._a = rng.integers(0, np.iinfo(np.uint64).max, size=(num_perm, 1), dtype=np.uint64, endpoint=True)
+        self._b = rng.integers(0, np.iinfo(np.uint64).max, size=(num_perm, 1), dtype=np.uint64, endpoint=True)
+        self._powers = _SHINGLE_BASE ** np.arange(shingle_size, dtype=np.uint64)
+        self._signatures = np.zeros((0, num_perm), dtype=np.uint32)
+        self._keys: List[Optional[str]] = []  # None once removed
+        self._slot_of: Dict[str, int] = {}
+        self._buckets: List[Dict[bytes, List[int]]] = [{} for _ in range(self.bands)]
+        self._word_hashes: Dict[str, int] = {}  # filing vocabulary repeats; crc32 of each word once
+
+    def __len__(self) -> int:
+        return len(self._slot_of)
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._slot_of
+
+    def _shingles(self, text: str) -> np.ndarray:
+        cache = self._word_hashes
+        hashes = []
+        for word in _TOKEN.findall(text.lower()):
+            h = cache.get(word)
+            if h is None:
+                if len(cache) >= _WORD_CACHE:
+                    cache.clear()
+                h = cache[word] = zlib.crc32(word.encode("utf-8"))
+            hashes.append(h)
+        words = np.array(hashes, dtype=np.uint64)
+        if len(words) <= self.shingle_size:
+            return (words * self._powers[:len(words)]).sum(keepdims=True) & _MASK
+        windows = np.lib.stride_tricks.sliding_window_view(words, self.shingle_size)
+        return (windows * self._powers).sum(axis=1) & _MASK
+
+    def _hash(self, shingles: np.ndarray) -> np.ndarray:
+        # (num_perm, len(shingles)): top 32 bits of a * x + b mod 2^64, computed in place
+        hashed = shingles * self._a
+        hashed += self._b
+        hashed >>= _SHIFT
+        return hashed
+
+    def signatures(self, texts: List[str]) -> np.ndarray:
+        """
+        (len(texts), num_perm) uint32 MinHash signatures of the texts' word shingles (lowercased, punctuation
+        ignored). Short texts are hashed together, about _BLOCK shingles at a time, and reduced per text.
+        """
+        out = np.empty((len(texts), self.num_perm), dtype=np.uint32)
+        pending: List[np.ndarray] = []
+        rows: List[int] = []
+        size = 0
+        for i, text in enumerate(texts):
+            shingles = self._shingles(text)
+            if len(shingles) > _BLOCK:
+                out[i] = np.min([self._hash(shingles[j:j + _BLOCK]).min(axis=1)
+                                 for j in range(0, len(shingles), _BLOCK)], axis=0)
+                continue
+            pending.append(shingles)
+            rows.append(i)
+            size += len(shingles)
+            if size >= _BLOCK:
+                self._reduce(pending, rows, out)
+                pending, rows, size = [], [], 0
+        if pending:
+            self._reduce(pending, rows, out)
+        return out
+
+    def _reduce(self, shingles: List[np.ndarray], rows: List[int], out: np.ndarray):
+        # Hashes the shingles of several texts at once; out[rows[i]] = minimum over the i-th text's shingles
+        offsets = np.cumsum([0] + [len(s) for s in shingles[:-1]])
+        out[rows] = np.minimum.reduceat(self._hash(np.concatenate(shingles)), offsets, axis=1).T
+
+    def signature(self, text: str) -> np.ndarray:
+        return self.signatures([text])[0]
+
+    def _band_keys(self, signature: np.ndarray) -> Iterable[Tuple[int, bytes]]:
+        for band in range(self.bands):
+            yield band, signature[band * self.rows:(band + 1) * self.rows].tobytes()
+
+    def match(self, signature: np.ndarray) -> Optional[str]:
+        """
+        Key of the most similar representative at or above the threshold (the earliest on ties), or None.
+        """
+        slots = {slot for band, key in self._band_keys(signature) for slot in self._buckets[band].get(key, ())}
+        slots = sorted(slot for slot in slots if self._keys[slot] is not None)
+        if not slots:
+            return None
+        similarities = (self._signatures[slots] == signature).mean(axis=1)
+        best = int(np.argmax(similarities))
+        return self._keys[slots[best]] if similarities[best] >= self.threshold else None
+
+    def insert(self, key: str, signature: np.ndarray):
+        """
+        Stores a text as a representative (no duplicate check).
+        """
+        if key in self._slot_of:
+            raise ValueError(f"Key already indexed: {key}")
+        slot = len(self._keys)
+        if slot == len(self._signatures):
+            grown = np.zeros((max(64, 2 * slot), self.num_perm), dtype=np.uint32)
+            grown[:slot] = self._signatures
+            self._signatures = grown
+        self._signatures[slot] = signature
+        self._keys.append(key)
+        self._slot_of[key] = slot
+        for band, band_key in self._band_keys(signature):
+            self._buckets[band].setdefault(band_key, []).append(slot)
+
+    def remove(self, key: str):
+        """
+        Drops a representative; later texts no longer match it. Unknown keys are ignored.
+        """
+        slot = self._slot_of.pop(key, None)
+        if slot is None:
+            return
+        self._keys[slot] = None
+        for band, band_key in self._band_keys(self._signatures[slot]):
+            bucket = self._buckets[band][band_key]
+            bucket.remove(slot)
+            if not bucket:
+                del self._buckets[band][band_key]
+
+    def add(self, key: str, text: str) -> Optional[str]:
+        """
+        Key of the representative this text duplicates, or None after storing it as a new representative.
+        """
+        return self.add_many([key], [text])[0]
+
+    def add_many(self, keys: List[str], texts: List[str]) -> List[Optional[str]]:
+        """
+        add() for each (key, text) in order; later texts also match representatives stored by earlier ones.
+        """
+        representatives = []
+        for key, signature in zip(keys, self.signatures(texts)):
+            representative = self.match(signature)
+            if representative is None:
+                self.insert(key, signature)
+            representatives.append(representative)
+        return representatives
@@ -0,0 +1,103 @@
+import hashlib
+import logging
+import os
+import sqlite3
+import threading
+import zlib
+from collections import OrderedDict
+from typing import Dict, Iterable, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+def normalize_query(query: str) -> str:
+    """
+    Case- and whitespace-insensitive form of a query, so trivially different repeats share cache entries.
+    """
+    return " ".join(query.lower().split())
+
+
+def rerank_cache_key(model_name: str, query: str, doc_id: str, text: str) -> str:
+    """
+    Cache key of one (query, document) pair for one reranker model.
+    The document text checksum keeps an edited document from reusing a stale score.
+    """
+    raw = f"{model_name}\x1f{normalize_query(query)}\x1f{doc_id}\x1f{zlib.crc32(text.encode('utf-8'))}"
+    return hashlib.sha1(raw.encode("utf-8")).hexdigest()
+
+
+class RerankScoreCache:
+    """
+    Two-tier cache of cross-encoder scores: an in-process LRU and an optional on-disk SQLite tier.
+    Disk hits are promoted into the LRU. Safe to share between threads.
+    """
+    def __init__(self, max_entries: int = 100000, db_path: Optional[str] = None):
+        self.max_entries = max_entries
+        self.db_path = db_path
+        self._lru: "OrderedDict[str, float]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._db = None
+        if db_path:
+            os.makedirs(os.path.dirname(db_path) or ".", exist_ok=True)
+            self._db = sqlite3.connect(db_path, check_same_thread=False)
+            self._db.execute("CREATE TABLE IF NOT EXISTS rerank_scores (key TEXT PRIMARY KEY, score REAL NOT NULL)")
+            self._db.commit()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+    def _remember(self, key: str, score: float):
+        self._lru[key] = score
+        self._lru.move_to_end(key)
+        if len(self._lru) > self.max_entries:
+            self._lru.popitem(last=False)
+
+    def get_many(self, keys: Iterable[str]) -> Dict[str, float]:
+        keys = list(keys)
+        found: Dict[str, float] = {}
+        with self._lock:
+            missing = []
+            for key in keys:
+                if key in self._lru:
+                    self._lru.move_to_end(key)
+                    found[key] = self._lru[key]
+                else:
+                    missing.append(key)
+            if missing and self._db is not None:
+                # SQLite limits the number of bound parameters per statement
+                for start in range(0, len(missing), 500):
+                    chunk = missing[start:start + 500]
+                    rows = self._db.execute(
+                        f"SELECT key, score FROM rerank_scores WHERE key IN ({','.join('?' * len(chunk))})", chunk)
+                    for key, score in rows:
+                        found[key] = score
+                        self._remember(key, score)
+                        self.disk_hits += 1
+            self.hits += len(found)
+            self.misses += len(keys) - len(found)
+        return found
+
+    def put_many(self, items: List[Tuple[str, float]]):
+        with self._lock:
+            for key, score in items:
+                self._remember(key, score)
+            if self._db is not None and items:
+                self._db.executemany("INSERT OR REPLACE INTO rerank_scores (key, score) VALUES (?, ?)", items)
+                self._db.commit()
+
+    def clear(self):
+        with self._lock:
+            self._lru.clear()
+            if self._db is not None:
+                self._db.execute("DELETE FROM rerank_scores")
+                self._db.commit()
+
+    def stats(self) -> Dict[str, float]:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._lru),
+            "hits": self.hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
@@ -0,0 +1,313 @@
+import asyncio
+import json
+import logging
+import time
+from concurrent.futures import Executor, ThreadPoolExecutor
+from typing import Any, Dict, List, Optional, Tuple
+
+from metadata_index import METADATA_FIELDS, normalize_value
+
+logger = logging.getLogger(__name__)
+
+
+class ServerOverloaded(Exception):
+    """
+    Raised when a query cannot be queued because the request queue is full (backpressure).
+    """
+
+
+class MicroBatchServer:
+    """
+    Asyncio front end for FinanceRAGSystem that answers concurrent queries in micro-batches.
+
+    Queries are queued; a batching loop collects up to max_batch_size of them, waiting at most max_wait_ms
+    after the first one, and hands each batch to answer_batch() on a worker pool so encoding, scoring and
+    reranking run as full batches. Each caller awaits its own future.
+
+    max_queue_size:         Bound of the request queue. When it is full, answer() waits up to enqueue_timeout_s
+                            for space (None: wait indefinitely, 0: reject at once) and then raises ServerOverloaded.
+    max_concurrent_batches: Batches in flight at once; the batching loop stops pulling from the queue while
+                            this many are running, which is what lets the queue apply backpressure.
+    """
+    def __init__(self, system, max_batch_size: int = 32, max_wait_ms: float = 5.0, max_queue_size: int = 1024,
+                 max_concurrent_batches: int = 1, enqueue_timeout_s: Optional[float] = None,
+                 executor: Optional[Executor] = None):
+        self.system = system
+        self.max_batch_size = max_batch_size
+        self.max_wait_ms = max_wait_ms
+        self.max_queue_size = max_queue_size
+        self.max_concurrent_batches = max_concurrent_batches
+        self.enqueue_timeout_s = enqueue_timeout_s
+        self._executor = executor
+        self._owns_executor = executor is None
+        self._queue: Optional[asyncio.Queue] = None
+        self._slots: Optional[asyncio.Semaphore] = None
+        self._loop_task: Optional[asyncio.Task] = None
+        self._batch_tasks: set = set()
+        # Queries taken off the queue by the batch being collected (not yet handed to a batch task)
+        self._collecting: List[Tuple] = []
+        self.batches = 0
+        self.queries = 0
+        self.rejected = 0
+        self.queue_wait_ms = 0.0
+
+    async def start(self) -> "MicroBatchServer":
+        if self._loop_task is not None:
+            return self
+        self._queue = asyncio.Queue(maxsize=self.max_queue_size)
+        self._slots = asyncio.Semaphore(self.max_concurrent_batches)
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.max_concurrent_batches, thread_name_prefix="rag-batch")
+        self._loop_task = asyncio.create_task(self._batch_loop())
+        return self
+
+    async def stop(self):
+        """
+        Stops accepting batches, waits for the running ones, and fails queries still in the queue.
+        """
+        if self._loop_task is None:
+            return
+        self._loop_task.cancel()
+        try:
+            await self._loop_task
+        except asyncio.CancelledError:
+            pass
+        self._loop_task = None
+        if self._batch_tasks:
+            await asyncio.gather(*self._batch_tasks, return_exceptions=True)
+        pending, self._collecting = self._collecting, []
+        while not self._queue.empty():
+            pending.append(self._queue.get_nowait())
+        for _, _, future, _ in pending:
+            if not future.done():
+                future.set_exception(ServerOverloaded("Server stopped before the query was answered."))
+        if self._owns_executor:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+
+    async def __aenter__(self) -> "MicroBatchServer":
+        return await self.start()
+
+    async def __aexit__(self, *exc):
+        await self.stop()
+
+    async def answer(self, query: str, filters: Optional[Dict[str, Any]] = None):
+        """
+        Answers one query; resolves once the micro-batch holding it has been processed.
+        """
+        if self._loop_task is None:
+            raise RuntimeError("Server not started; call start() or use 'async with'.")
+        # Reject bad filters here, otherwise they would fail every query of the batch
+        unknown = set(filters or {}) - set(METADATA_FIELDS)
+        if unknown:
+            raise ValueError(f"Unknown metadata field(s): {sorted(unknown)} (expected one of {list(METADATA_FIELDS)})")
+        for field, value in (filters or {}).items():
+            values = value if isinstance(value, (list, tuple, set)) else [value]
+            try:
+                for v in values:
+                    if v is None:
+                        raise TypeError(v)
+                    normalize_value(field, v)
+            except (TypeError, ValueError):
+                raise ValueError(f"Invalid value for metadata filter {field!r}: {value!r}") from None
+        future = asyncio.get_running_loop().create_future()
+        item = (query, filters, future, time.perf_counter())
+        try:
+            if self.enqueue_timeout_s is None:
+                await self._queue.put(item)
+            elif self.enqueue_timeout_s <= 0:
+                self._queue.put_nowait(item)
+            else:
+                await asyncio.wait_for(self._queue.put(item), self.enqueue_timeout_s)
+        except (asyncio.QueueFull, asyncio.TimeoutError):
+            self.rejected += 1
+            raise ServerOverloaded(f"Request queue full ({self.max_queue_size} queries waiting).")
+        return await future
+
+    async def _collect(self) -> List[Tuple]:
+        # The batch lives on self while it is being filled, so stop() can fail it if the loop is cancelled
+        batch = self._collecting
+        batch.append(await self._queue.get())
+        deadline = asyncio.get_running_loop().time() + self.max_wait_ms / 1000
+        while len(batch) < self.max_batch_size:
+            # Take whatever is already queued without waiting, then wait for stragglers until the deadline
+            try:
+                batch.append(self._queue.get_nowait())
+                continue
+            except asyncio.QueueEmpty:
+                pass
+            timeout = deadline - asyncio.get_running_loop().time()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        self._collecting = []
+        return batch
+
+    async def _batch_loop(self):
+        while True:
+            await self._slots.acquire()
+            try:
+                batch = await self._collect()
+            except BaseException:
+                self._slots.release()
+                raise
+            task = asyncio.create_task(self._run_batch(batch))
+            self._batch_tasks.add(task)
+            task.add_done_callback(self._batch_tasks.discard)
+
+    async def _run_batch(self, batch: List[Tuple]):
+        try:
+            # Callers that gave up (cancelled) are not worth scoring
+            batch = [item for item in batch if not item[2].done()]
+            if not batch:
+                return
+            queries = [item[0] for item in batch]
+            filters = [item[1] for item in batch]
+            started = time.perf_counter()
+            self.queue_wait_ms += sum(1000 * (started - item[3]) for item in batch)
+            loop = asyncio.get_running_loop()
+            try:
+                results = await loop.run_in_executor(
+                    self._executor, lambda: self.system.answer_batch(queries, batch_size=len(queries), filters=filters))
+            except Exception as e:
+                logger.exception("Batch of %d queries failed.", len(batch))
+                for _, _, future, _ in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                return
+            self.batches += 1
+            self.queries += len(batch)
+            for (_, _, future, _), result in zip(batch, results):
+                if not future.done():
+                    future.set_result(result)
+        finally:
+            self._slots.release()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "queue_depth": self._queue.qsize() if self._queue is not None else 0,
+            "batches": self.batches,
+            "queries": self.queries,
+            "mean_batch_size": self.queries / self.batches if self.batches else 0.0,
+            "mean_queue_wait_ms": self.queue_wait_ms / self.queries if self.queries else 0.0,
+            "rejected": self.rejected,
+            "batches_in_flight": len(self._batch_tasks),
+        }
+
+
+def result_to_dict(result) -> Dict[str, Any]:
+    return {"doc_id": result.doc_id, "score": float(result.score), "text": result.text,
+            "metadata": result.metadata}
+
+
+class HttpFrontend:
+    """
+    Minimal asyncio HTTP/1.1 stand-in for an API server, for local testing without a web framework.
+
+    POST /answer  {"query": "...", "filters": {...}}  ->  {"results": [...], "trace": {...}}
+    GET  /stats   micro-batching statistics
+    GET  /health
+    A full queue answers 503, malformed requests 400.
+    """
+    def __init__(self, server: MicroBatchServer, host: str = "127.0.0.1", port: int = 8080,
+                 max_body_bytes: int = 1 << 20):
+        self.server = server
+        self.host = host
+        self.port = port
+        self.max_body_bytes = max_body_bytes
+        self._http: Optional[asyncio.base_events.Server] = None
+
+    async def start(self) -> "HttpFrontend":
+        await self.server.start()
+        self._http = await asyncio.start_server(self._handle, self.host, self.port)
+        self.port = self._http.sockets[0].getsockname()[1]
+        logger.info(f"Serving on http://{self.host}:{self.port}")
+        return self
+
+    async def stop(self):
+        if self._http is not None:
+            self._http.close()
+            await self._http.wait_closed()
+            self._http = None
+        await self.server.stop()
+
+    async def serve_forever(self):
+        await self.start()
+        try:
+            await self._http.serve_forever()
+        finally:
+            await self.stop()
+
+    @staticmethod
+    async def _respond(writer: asyncio.StreamWriter, status: int, payload: Dict[str, Any]):
+        reasons = {200: "OK", 400: "Bad Request", 404: "Not Found", 413: "Payload Too Large",
+                   500: "Internal Server Error", 503: "Service Unavailable"}
+        body = json.dumps(payload).encode("utf-8")
+        writer.write(f"HTTP/1.1 {status} {reasons.get(status, '')}\r\nContent-Type: application/json\r\n"
+                     f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode("latin-1") + body)
+        await writer.drain()
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            request_line = (await reader.readline()).decode("latin-1").split()
+            headers = {}
+            while True:
+                line = (await reader.readline()).decode("latin-1")
+                if line in ("\r\n", "\n", ""):
+                    break
+                name, _, value = line.partition(":")
+                headers[name.strip().lower()] = value.strip()
+            if len(request_line) < 2:
+                await self._respond(writer, 400, {"error": "malformed request line"})
+                return
+            method, path = request_line[0], request_line[1].split("?")[0]
+            if method == "GET" and path == "/health":
+                await self._respond(writer, 200, {"status": "ok"})
+            elif method == "GET" and path == "/stats":
+                await self._respond(writer, 200, self.server.stats())
+            elif method == "POST" and path == "/answer":
+                try:
+                    length = int(headers.get("content-length", 0))
+                except ValueError:
+                    length = -1
+                if length < 0:
+                    await self._respond(writer, 400, {"error": "invalid Content-Length"})
+                    return
+                if length > self.max_body_bytes:
+                    await self._respond(writer, 413, {"error": "request body too large"})
+                    return
+                try:
+                    request = json.loads(await reader.readexactly(length))
+                except (ValueError, asyncio.IncompleteReadError):
+                    request = None
+                if not isinstance(request, dict) or not isinstance(request.get("query"), str):
+                    await self._respond(writer, 400, {"error": "expected a JSON object with a string 'query' field"})
+                    return
+                filters = request.get("filters")
+                if filters is not None and not isinstance(filters, dict):
+                    await self._respond(writer, 400, {"error": "'filters' must be a JSON object"})
+                    return
+                try:
+                    results = await self.server.answer(request["query"], filters=filters)
+                except ServerOverloaded as e:
+                    await self._respond(writer, 503, {"error": str(e)})
+                    return
+                except ValueError as e:
+                    await self._respond(writer, 400, {"error": str(e)})
+                    return
+                trace = getattr(results, "trace", None)
+                await self._respond(writer, 200, {"results": [result_to_dict(r) for r in results],
+                                                  "trace": trace.to_dict() if trace is not None else None})
+            else:
+                await self._respond(writer, 404, {"error": f"no route for {method} {path}"})
+        except Exception as e:
+            logger.exception("Request failed.")
+            try:
+                await self._respond(writer, 500, {"error": str(e)})
+            except ConnectionError:
+                pass
+        finally:
+            writer.close()
@@ -0,0 +1,343 @@
+import logging
+import multiprocessing
+import os
+import shutil
+import tempfile
+import traceback
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+from bm25_index import BM25Index, BM25Stats
+from document_store import DocumentStore
+from embedding_store import EmbeddingStore, dot_blocks
+from financial_lexicon import FinancialLexicon
+from fusion import FUSION_STRATEGIES, ScoreStats, candidate_ranks, fuse_scores, top_candidates
+from instrumentation import Tracer
+from metadata_index import MetadataIndex, explicit_metadata, extract_metadata
+from model_registry import ENCODER, get_model
+
+logger = logging.getLogger(__name__)
+
+# Worker side: this module is imported by spawned shard processes, so it must not import the model stack
+# (advanced_rag_architecture / sentence_transformers) at module level.
+
+
+def _shard_search(bm25: BM25Index, matrix: np.ndarray, query_embeddings: np.ndarray, tokens: List[List[str]],
+                  k: int, subsets: List[Optional[np.ndarray]]) -> List[Optional[Dict[str, Any]]]:
+    """
+    Scores a batch of queries on one shard. Per query, returns the local dense and sparse top-k lists,
+    both scores of every document in their union, and the shard's score statistics.
+    subsets: Per query, sorted local rows to score (metadata filter), or None for the whole shard.
+    """
+    unfiltered = [i for i, subset in enumerate(subsets) if subset is None]
+    dense_all = sparse_all = None
+    if unfiltered:
+        dense_all = dot_blocks(matrix, query_embeddings[unfiltered])
+        # Single queries take the same per-term path as HybridRetriever.retrieve
+        sparse_all = bm25.get_scores(tokens[unfiltered[0]])[None, :] if len(unfiltered) == 1 \
+            else bm25.get_scores_batch([tokens[i] for i in unfiltered])
+    row_of = {i: j for j, i in enumerate(unfiltered)}
+
+    out: List[Optional[Dict[str, Any]]] = []
+    for i, subset in enumerate(subsets):
+        if subset is None:
+            dense, sparse = dense_all[row_of[i]], sparse_all[row_of[i]]
+        elif len(subset) == 0:
+            out.append(None)
+            continue
+        else:
+            dense = np.asarray(matrix[subset], dtype=np.float32) @ query_embeddings[i]
+            sparse = bm25.get_scores(tokens[i], doc_ids=subset)
+        dense_top = top_candidates(dense, k)
+        sparse_top = top_candidates(sparse, k)
+        union = np.union1d(dense_top, sparse_top)
+        rows = union if subset is None else subset[union]
+        out.append({
+            "rows": rows.astype(np.int64),
+            "dense": dense[union],
+            "sparse": sparse[union],
+            "dense_top": np.searchsorted(union, dense_top),
+            "sparse_top": np.searchsorted(union, sparse_top),
+            "dense_stats": ScoreStats.from_scores(dense),
+            "sparse_stats": ScoreStats.from_scores(sparse),
+        })
+    return out
+
+
+def _shard_main(conn, documents_path: str, start: int, end: int):
+    """
+    Shard process loop. Phase 1 reports local BM25 statistics; phase 2 ('build') builds the sparse index with the
+    global statistics and memory-maps the shard's embedding rows; then it answers 'search' requests.
+    The shard's texts are read from the coordinator's memory-mapped DocumentStore and tokenized on the fly.
+    """
+    try:
+        documents = DocumentStore.open(documents_path)
+
+        def tokenized():
+            return (documents[row].split(" ") for row in range(start, end))
+
+        conn.send(("ok", BM25Stats.from_corpus(tokenized())))
+        bm25 = matrix = None
+        while True:
+            command, payload = conn.recv()
+            try:
+                if command == "build":
+                    global_stats, matrix_path = payload
+                    bm25 = BM25Index(tokenized(), global_stats=global_stats)
+                    documents = None
+                    matrix = np.load(matrix_path, mmap_mode="r")[start:end]
+                    conn.send(("ok", None))
+                elif command == "search":
+                    conn.send(("ok", _shard_search(bm25, matrix, *payload)))
+                elif command == "close":
+                    break
+                else:
+                    conn.send(("error", f"Unknown shard command: {command}"))
+            except Exception:
+                conn.send(("error", traceback.format_exc()))
+    except (EOFError, KeyboardInterrupt):
+        pass
+    finally:
+        conn.close()
+
+
+class ShardedHybridRetriever:
+    """
+    Multi-process version of HybridRetriever: the corpus is split into n_shards contiguous partitions,
+    each held by a worker process with its own BM25 index and a memory-mapped slice of the embedding matrix.
+
+    BM25 statistics are computed in two phases (local document frequencies and lengths are gathered,
+    merged, and broadcast back), so sparse scores equal the unsharded engine's exactly. Each query is
+    scattered to every shard; shards return their dense and sparse top-k' lists with both scores and their
+    score statistics, and the coordinator merges them into the global top-k' lists and fuses the union as
+    HybridRetriever does. Dense scoring on shards is exact (flat).
+
+    The coordinator keeps the query encoder, document texts (a DocumentStore the shards also read their
+    partition from) and the metadata index.
+    The index is static: incremental add/update/delete (see HybridRetriever) is not supported across shards,
+    re-run index_corpus() instead.
+    Call close() (or use as a context manager) to stop the shard processes. Shards are started with 'spawn'
+    by default, so scripts creating them need the usual if __name__ == "__main__" guard.
+    """
+    def __init__(self, n_shards: Optional[int] = None, embedding_model_name: str = 'BAAI/bge-m3',
+                 store_dir: Optional[str] = None, store_dtype: str = 'float16', encode_batch_size: int = 32,
+                 fusion: str = 'weighted', fusion_candidates: Optional[int] = None, rrf_k: int = 60,
+                 lexicon=None, encoder: Optional[Any] = None, tracer: Optional[Tracer] = None,
+                 start_method: str = "spawn"):
+        """
+        n_shards: Number of shard processes (default: one per CPU).
+        store_dir: Where the embedding matrix and texts are persisted for the shards to memory-map; a temporary
+                   directory (removed when used as a context manager) when None.
+        start_method: multiprocessing start method for the shards; 'spawn' keeps model libraries and their
+                      threads out of the workers.
+        Other arguments as for HybridRetriever.
+        """
+        if fusion not in FUSION_STRATEGIES:
+            raise ValueError(f"Unknown fusion strategy: {fusion} (expected one of {FUSION_STRATEGIES})")
+        self.n_shards = n_shards or os.cpu_count() or 1
+        self.embedding_model_name = embedding_model_name
+        self._encoder = encoder
+        self.encode_batch_size = encode_batch_size
+        self._tmp_dir = None if store_dir else tempfile.mkdtemp(prefix="rag_shards_")
+        self.store_dir = store_dir or self._tmp_dir
+        self.embedding_store = EmbeddingStore(self.store_dir, embedding_model_name, dtype=store_dtype)
+        self.fusion = fusion
+        self.fusion_candidates = fusion_candidates
+        self.rrf_k = rrf_k
+        self.lexicon = lexicon or FinancialLexicon()
+        self.tracer = tracer or Tracer()
+        self.start_method = start_method
+        self.metadata_index: Optional[MetadataIndex] = None
+        self.corpus_ids: List[str] = []
+        self.corpus_texts = DocumentStore()
+        self.shard_offsets = np.zeros(1, dtype=np.int64)
+        self._processes = []
+        self._conns = []
+
+    @property
+    def encoder(self):
+        if self._encoder is None:
+            self._encoder = get_model(ENCODER, self.embedding_model_name)
+        return self._encoder
+
+    @encoder.setter
+    def encoder(self, encoder):
+        self._encoder = encoder
+
+    def _encode(self, texts: List[str], show_progress_bar: bool = False) -> np.ndarray:
+        return self.encoder.encode(texts, batch_size=self.encode_batch_size, convert_to_numpy=True,
+                                   normalize_embeddings=True, show_progress_bar=show_progress_bar)
+
+    def _gather(self, conns=None) -> List[Any]:
+        results = []
+        for shard, conn in enumerate(conns or self._conns):
+            status, payload = conn.recv()
+            if status != "ok":
+                raise RuntimeError(f"Shard {shard} failed:\n{payload}")
+            results.append(payload)
+        return results
+
+    def index_corpus(self, corpus: List[Dict[str, str]]):
+        """
+        Indexes the corpus across the shard processes (same corpus format as HybridRetriever.index_corpus).
+        """
+        self.close()
+        logger.info(f"Indexing {len(corpus)} documents on {self.n_shards} shards...")
+        self.corpus_ids = [doc['id'] for doc in corpus]
+        texts = [doc['text'] for doc in corpus]
+        self.corpus_texts = DocumentStore.build(texts, os.path.join(self.store_dir, "documents"))
+        self.metadata_index = MetadataIndex([{**extract_metadata(doc['text'], self.lexicon), **explicit_metadata(doc)}
+                                             for doc in corpus])
+
+        n_shards = max(1, min(self.n_shards, len(corpus)))
+        self.shard_offsets = np.linspace(0, len(corpus), n_shards + 1).astype(np.int64)
+
+        # Phase 1: shards tokenize their partition and report local statistics (while the coordinator encodes)
+        context = multiprocessing.get_context(self.start_method)
+        for start, end in zip(self.shard_offsets[:-1], self.shard_offsets[1:]):
+            parent, child = context.Pipe()
+            process = context.Process(target=_shard_main, args=(child, self.corpus_texts.path, int(start), int(end)),
+                                      daemon=True)
+            process.start()
+            child.close()
+            self._processes.append(process)
+            self._conns.append(parent)
+        self.embedding_store.sync(self.corpus_ids, texts, lambda missing: self._encode(missing, show_progress_bar=True))
+        global_stats = BM25Stats.merge(self._gather())
+
+        # Phase 2: broadcast global statistics; shards build their BM25 index and map their embedding rows
+        for conn in self._conns:
+            conn.send(("build", (global_stats, self.embedding_store.matrix_path)))
+        self._gather()
+        logger.info(f"Sharded index ready: {global_stats.corpus_size} docs, {len(global_stats.doc_freq)} terms.")
+
+    def close(self):
+        for conn in self._conns:
+            try:
+                conn.send(("close", None))
+                conn.close()
+            except (OSError, BrokenPipeError):
+                pass
+        for process in self._processes:
+            process.join(timeout=5)
+            if process.is_alive():
+                process.terminate()
+        self._processes, self._conns = [], []
+
+    def __enter__(self) -> "ShardedHybridRetriever":
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+        if self._tmp_dir is not None:
+            shutil.rmtree(self._tmp_dir, ignore_errors=True)
+
+    def _candidate_k(self, top_k: int) -> int:
+        return self.fusion_candidates or 2 * top_k
+
+    def select(self, filters: Optional[Dict[str, Any]], strict: bool = True) -> Optional[np.ndarray]:
+        """
+        Sorted global rows matching the metadata filters, or None when every document is to be scored.
+        """
+        if not filters:
+            return None
+        subset = self.metadata_index.select(filters, include_missing=not strict)
+        if not strict and (len(subset) == 0 or len(subset) == len(self.corpus_ids)):
+            return None
+        return subset
+
+    def _scatter_gather(self, query_embeddings: np.ndarray, tokens: List[List[str]], k: int,
+                        subsets: List[Optional[np.ndarray]]) -> List[List[Optional[Dict[str, Any]]]]:
+        """
+        Sends a batch of queries to every shard; returns, per shard, its per-query partial results
+        with rows translated to global row ids.
+        """
+        for conn, start, end in zip(self._conns, self.shard_offsets[:-1], self.shard_offsets[1:]):
+            local = [None if s is None else s[(s >= start) & (s < end)] - start for s in subsets]
+            conn.send(("search", (query_embeddings, tokens, k, local)))
+        per_shard = self._gather()
+        for offset, partials in zip(self.shard_offsets[:-1], per_shard):
+            for partial in partials:
+                if partial is not None:
+                    partial["rows"] = partial["rows"] + offset
+        return per_shard
+
+    def _merge(self, partials: List[Optional[Dict[str, Any]]], top_k: int, alpha: float, fusion: str):
+        from advanced_rag_architecture import RetrievalResult
+
+        partials = [p for p in partials if p is not None]
+        if not partials:
+            return []
+        k = self._candidate_k(top_k)
+        rows = np.concatenate([p["rows"] for p in partials])
+        dense = np.concatenate([p["dense"] for p in partials])
+        sparse = np.concatenate([p["sparse"] for p in partials])
+        offsets = np.cumsum([0] + [len(p["rows"]) for p in partials[:-1]])
+        dense_top = np.concatenate([p["dense_top"] + o for p, o in zip(partials, offsets)])
+        sparse_top = np.concatenate([p["sparse_top"] + o for p, o in zip(partials, offsets)])
+
+        # Global top-k' lists from the per-shard ones, ties broken by lower row as in top_candidates
+        dense_ranked = rows[dense_top[np.lexsort((rows[dense_top], -dense[dense_top]))[:k]]]
+        sparse_ranked = rows[sparse_top[np.lexsort((rows[sparse_top], -sparse[sparse_top]))[:k]]]
+        candidates = np.union1d(dense_ranked, sparse_ranked)
+        position = np.searchsorted(rows, candidates)
+        dense_c, sparse_c = dense[position], sparse[position]
+
+        fused_scores = fuse_scores(fusion, dense_c, sparse_c, ScoreStats.merge(p["dense_stats"] for p in partials),
+                                   ScoreStats.merge(p["sparse_stats"] for p in partials),
+                                   candidate_ranks(candidates, dense_ranked), candidate_ranks(candidates, sparse_ranked),
+                                   alpha=alpha, rrf_k=self.rrf_k)
+        results = []
+        for i in top_candidates(fused_scores, top_k):
+            idx = int(candidates[i])
+            results.append(RetrievalResult(
+                doc_id=self.corpus_ids[idx],
+                score=float(fused_scores[i]),
+                store=self.corpus_texts,
+                row=idx,
+                dense_score=float(dense_c[i]),
+                sparse_score=float(sparse_c[i])
+            ))
+        return results
+
+    def retrieve(self, query: str, query_spans: List[str], top_k: int = 100, alpha: float = 0.5,
+                 fusion: Optional[str] = None, filters: Optional[Dict[str, Any]] = None,
+                 strict_filters: bool = True):
+        """
+        Same contract as HybridRetriever.retrieve.
+        """
+        return self.retrieve_batch([query], [query_spans], top_k=top_k, alpha=alpha, fusion=fusion,
+                                   filters=[filters], strict_filters=strict_filters)[0]
+
+    def retrieve_batch(self, queries: List[str], query_spans: List[List[str]], top_k: int = 100,
+                       alpha: float = 0.5, batch_size: int = 32, fusion: Optional[str] = None,
+                       filters: Optional[List[Optional[Dict[str, Any]]]] = None,
+                       strict_filters: bool = True):
+        """
+        Same contract as HybridRetriever.retrieve_batch; each batch is one scatter-gather round.
+        """
+        from advanced_rag_architecture import HybridRetriever
+
+        if not self._conns:
+            raise ValueError("Corpus not indexed!")
+        if len(queries) != len(query_spans) or (filters is not None and len(filters) != len(queries)):
+            raise ValueError("queries, query_spans and filters must have the same length")
+        all_results = []
+        for start in range(0, len(queries), batch_size):
+            batch_queries = queries[start:start + batch_size]
+            tokens = [HybridRetriever._sparse_query_tokens(q, s)
+                      for q, s in zip(batch_queries, query_spans[start:start + batch_size])]
+            with self.tracer.stage("filter", queries=len(batch_queries)):
+                subsets = [self.select(f, strict=strict_filters) for f in filters[start:start + batch_size]] \
+                    if filters is not None else [None] * len(batch_queries)
+            with self.tracer.stage("query_encoding", queries=len(batch_queries)):
+                query_embeddings = np.asarray(self._encode(batch_queries), dtype=np.float32)
+            with self.tracer.stage("scatter_gather", queries=len(batch_queries), shards=len(self._conns)) as stage:
+                per_shard = self._scatter_gather(query_embeddings, tokens, self._candidate_k(top_k), subsets)
+                stage.set(candidates=sum(len(p["rows"]) for partials in per_shard for p in partials if p is not None))
+            with self.tracer.stage("fusion", queries=len(batch_queries)):
+                for i in range(len(batch_queries)):
+                    all_results.append(self._merge([partials[i] for partials in per_shard], top_k, alpha,
+                                                   fusion or self.fusion))
+        return all_results